@@ -0,0 +1,443 @@
+"""Graph-native training input pipeline.
+
+``dataloader.preprocess`` runs in ``tf.py_function``, so decoding, augmentation and the
+ground-truth encoding of every sample hold the GIL. This module implements the same
+steps with TensorFlow ops so that ``tf.data`` runs them in parallel:
+
+- ``decode_image``: ``tf.io.decode_jpeg`` and the ``/ 255`` float conversion, or
+  ``cached_images`` to read a batch of the images ``image_cache.py`` decoded beforehand;
+- ``transform``, ``flip``, ``rotate`` and ``translate``: the functions of the same name
+  in ``dataset/annotate.py`` / ``dataloader.py``, on whole batches with a per-sample
+  ``apply`` mask. Image warps use ``ImageProjectiveTransformV3``, which samples pixels
+  like ``cv2.warpPerspective`` / ``cv2.warpAffine``;
+- ``augment_batch``: the random augmentation sequence of ``preprocess``;
+- ``cut_out``: ``yolov4``'s ``cut_out`` on the keypoint boxes of
+  ``dataloader.get_bounding_boxes``, whose ground truth ``ground_truth.GroundTruthEncoder``
+  encodes in the graph.
+
+Keypoints are ``(B, K, 3)`` tensors ``(x, y, visibility)`` normalised to the image, with
+the 4 calibration points first, and are transformed in float64.
+
+``python augment.py --cfg deepdarts_d1`` checks every op against its NumPy / OpenCV
+counterpart and exits with status 1 on a mismatch.
+"""
+import argparse
+import os
+import os.path as osp
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+import tensorflow as tf  # noqa: E402
+from yacs.config import CfgNode as CN  # noqa: E402
+
+from ground_truth import GroundTruthEncoder, box_visibility  # noqa: E402
+
+ALIGN_ANGLE = 9.0  # default angle of dataset.annotate.transform
+_IDENTITY_TRANSFORM = [[1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0]]
+
+
+def decode_image(path: tf.Tensor, input_size: Optional[int] = None) -> tf.Tensor:
+    """RGB float32 image in ``[0, 1]``, decoded like ``cv2.imread`` (accurate integer IDCT)."""
+    return decode_jpeg(tf.io.read_file(path), input_size)
+
+
+def decode_jpeg(contents: tf.Tensor, input_size: Optional[int] = None) -> tf.Tensor:
+    """``decode_image`` of JPEG bytes, e.g. read from ``tfrecords.py`` shards."""
+    image = tf.io.decode_jpeg(contents, channels=3, dct_method="INTEGER_ACCURATE")
+    if input_size is not None:
+        image = tf.ensure_shape(image, [input_size, input_size, 3])
+    return tf.cast(image, tf.float32) / 255.0
+
+
+def cached_images(rows: tf.Tensor, cache: Any, input_size: int) -> tf.Tensor:
+    """Images ``rows`` of an ``image_cache.ImageCache``, like ``decode_image`` without decoding.
+
+    The rows of a whole batch are gathered from the mapped file in one call, so the pipeline
+    leaves the graph once per batch rather than once per image. Sort ``rows`` to read the
+    file in order.
+    """
+    images = tf.numpy_function(cache.take, [rows], tf.uint8, stateful=False)
+    images = tf.ensure_shape(images, [None, input_size, input_size, 3])
+    return tf.cast(images, tf.float32) / 255.0
+
+
+def _image_size(images: tf.Tensor) -> tf.Tensor:
+    shape = tf.shape(images)
+    return tf.cast(tf.stack([shape[2], shape[1]]), tf.float64)  # (width, height)
+
+
+def _select(apply: tf.Tensor, new: tf.Tensor, old: tf.Tensor) -> tf.Tensor:
+    mask = tf.reshape(apply, tf.concat([tf.shape(apply), tf.ones([tf.rank(old) - 1], tf.int32)], 0))
+    return tf.where(mask, new, old)
+
+
+def _warp(images: tf.Tensor, matrices: tf.Tensor, apply: tf.Tensor) -> tf.Tensor:
+    """Warp each image by its forward pixel homography (B, 3, 3) where ``apply``."""
+
+    def warp() -> tf.Tensor:
+        # ImageProjectiveTransform maps output pixels to input pixels, i.e. takes the inverse.
+        inverse = tf.linalg.inv(matrices)
+        inverse = inverse / inverse[:, 2:3, 2:3]
+        transforms = tf.cast(tf.reshape(inverse, [-1, 9])[:, :8], tf.float32)
+        transforms = _select(apply, transforms, tf.constant(_IDENTITY_TRANSFORM))
+        return tf.raw_ops.ImageProjectiveTransformV3(
+            images=images,
+            transforms=transforms,
+            output_shape=tf.shape(images)[1:3],
+            fill_value=0.0,
+            interpolation="BILINEAR",
+            fill_mode="CONSTANT",
+        )
+
+    return tf.cond(tf.reduce_any(apply), warp, lambda: images)
+
+
+def perspective_transform(src: tf.Tensor, dst: tf.Tensor) -> tf.Tensor:
+    """Batched ``cv2.getPerspectiveTransform`` for (B, 4, 2) point sets."""
+    x, y, u, v = src[..., 0], src[..., 1], dst[..., 0], dst[..., 1]
+    zeros, ones = tf.zeros_like(x), tf.ones_like(x)
+    rows_u = tf.stack([x, y, ones, zeros, zeros, zeros, -x * u, -y * u], axis=-1)
+    rows_v = tf.stack([zeros, zeros, zeros, x, y, ones, -x * v, -y * v], axis=-1)
+    solution = tf.linalg.solve(tf.concat([rows_u, rows_v], 1), tf.concat([u, v], 1)[..., tf.newaxis])
+    return tf.reshape(tf.concat([solution[..., 0], ones[:, :1]], -1), [-1, 3, 3])
+
+
+def alignment_matrices(xy: tf.Tensor, size: tf.Tensor, angle: float = ALIGN_ANGLE) -> tf.Tensor:
+    """``transform``'s pixel homography moving the calibration points onto a circle."""
+    src = xy[:, :4, :2] * size
+    center = tf.reduce_mean(src, axis=1, keepdims=True)
+    radius = tf.reduce_mean(tf.norm(src - center, axis=-1), axis=1)[:, tf.newaxis, tf.newaxis]
+    sin, cos = np.sin(np.deg2rad(angle)), np.cos(np.deg2rad(angle))
+    offsets = tf.constant([[-sin, -cos], [sin, cos], [-cos, sin], [cos, -sin]], tf.float64)
+    return perspective_transform(src, center + radius * offsets)
+
+
+def _matrices(rows: List[tf.Tensor]) -> tf.Tensor:
+    return tf.reshape(tf.stack(rows, axis=-1), [-1, 3, 3])
+
+
+def _transform(xy: tf.Tensor, matrices: tf.Tensor, size: tf.Tensor) -> tf.Tensor:
+    points = xy[..., :2] * size
+    homogeneous = tf.concat([points, tf.ones_like(points[..., :1])], -1)
+    mapped = tf.linalg.matmul(homogeneous, matrices, transpose_b=True)
+    return tf.concat([mapped[..., :2] / mapped[..., 2:] / size, xy[..., 2:]], -1)
+
+
+def _flip(xy: tf.Tensor, axis: int, size: tf.Tensor, darts_only: bool) -> Tuple[tf.Tensor, tf.Tensor]:
+    center = tf.reduce_mean(xy[:, :4, :2], axis=1, keepdims=True)
+    sign = tf.constant([-1.0, 1.0] if axis == 0 else [1.0, -1.0], tf.float64)
+    moved = (xy[..., :2] - center) * sign + center
+    if darts_only:
+        moved = tf.concat([xy[:, :4, :2], moved[:, 4:]], 1)
+    zeros = tf.zeros_like(xy[:, 0, 0])
+    ones = tf.ones_like(zeros)
+    # pixel x -> w - 1 - x (or y -> h - 1 - y), i.e. img[:, ::-1] (img[::-1])
+    if axis == 0:
+        matrices = _matrices([-ones, zeros, ones * (size[0] - 1), zeros, ones, zeros, zeros, zeros, ones])
+    else:
+        matrices = _matrices([ones, zeros, zeros, zeros, -ones, ones * (size[1] - 1), zeros, zeros, ones])
+    return matrices, tf.concat([moved, xy[..., 2:]], -1)
+
+
+def _rotate(xy: tf.Tensor, angle: tf.Tensor, size: tf.Tensor, darts_only: bool) -> Tuple[tf.Tensor, tf.Tensor]:
+    center = tf.reduce_mean(xy[:, :4, :2], axis=1)
+    cx, cy = center[:, 0] * size[0], center[:, 1] * size[1]
+    radians = tf.cast(angle, tf.float64) * np.pi / 180.0
+    alpha, beta = tf.cos(radians), tf.sin(radians)
+    zeros, ones = tf.zeros_like(alpha), tf.ones_like(alpha)
+    # cv2.getRotationMatrix2D((cx, cy), angle, 1)
+    matrices = _matrices([
+        alpha, beta, (1 - alpha) * cx - beta * cy,
+        -beta, alpha, beta * cx + (1 - alpha) * cy,
+        zeros, zeros, ones,
+    ])
+    offset = xy[..., :2] - center[:, tf.newaxis]
+    moved = tf.linalg.matmul(offset, matrices[:, :2, :2], transpose_b=True) + center[:, tf.newaxis]
+    if darts_only:
+        moved = tf.concat([xy[:, :4, :2], moved[:, 4:]], 1)
+    return matrices, tf.concat([moved, xy[..., 2:]], -1)
+
+
+def _translate(xy: tf.Tensor, shift: tf.Tensor, size: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+    shift = tf.cast(shift, tf.float64)
+    zeros, ones = tf.zeros_like(shift[:, 0]), tf.ones_like(shift[:, 0])
+    matrices = _matrices([ones, zeros, shift[:, 0], zeros, ones, shift[:, 1], zeros, zeros, ones])
+    return matrices, tf.concat([xy[..., :2] + (shift / size)[:, tf.newaxis], xy[..., 2:]], -1)
+
+
+def transform(
+    images: tf.Tensor, xy: tf.Tensor, matrices: tf.Tensor, apply: tf.Tensor
+) -> Tuple[tf.Tensor, tf.Tensor]:
+    """``dataset.annotate.transform(xy, img, M=matrices)`` on the samples where ``apply``."""
+    moved = _transform(xy, matrices, _image_size(images))
+    return _warp(images, matrices, apply), _select(apply, moved, xy)
+
+
+def flip(
+    images: tf.Tensor, xy: tf.Tensor, direction: str, apply: tf.Tensor, darts_only: bool = True
+) -> Tuple[tf.Tensor, tf.Tensor]:
+    """``dataloader.flip``: mirror the image, and the darts around the board center."""
+    axis = 0 if direction == "lr" else 1
+    _, moved = _flip(xy, axis, _image_size(images), darts_only)
+    return _select(apply, tf.reverse(images, [2 - axis]), images), _select(apply, moved, xy)
+
+
+def rotate(
+    images: tf.Tensor, xy: tf.Tensor, angle: tf.Tensor, apply: tf.Tensor, darts_only: bool = True
+) -> Tuple[tf.Tensor, tf.Tensor]:
+    """``dataloader.rotate`` by per-sample ``angle`` degrees around the board center."""
+    matrices, moved = _rotate(xy, angle, _image_size(images), darts_only)
+    return _warp(images, matrices, apply), _select(apply, moved, xy)
+
+
+def translate(
+    images: tf.Tensor, xy: tf.Tensor, shift: tf.Tensor, apply: tf.Tensor
+) -> Tuple[tf.Tensor, tf.Tensor]:
+    """``dataloader.translate`` by per-sample ``shift`` (B, 2) ``(tx, ty)`` pixels."""
+    matrices, moved = _translate(xy, shift, _image_size(images))
+    return _warp(images, matrices, apply), _select(apply, moved, xy)
+
+
+def augment_batch(images: tf.Tensor, xy: tf.Tensor, cfg: CN) -> Tuple[tf.Tensor, tf.Tensor]:
+    """The training augmentations of ``dataloader.preprocess``, drawn per sample.
+
+    Flips and 36-degree rotations move the darts only and are done in the face-on frame
+    of ``transform``, which is undone at the end, or replaced by a randomly perturbed
+    inverse when the sample is also warped.
+
+    Keypoints go through every step like in ``preprocess``, while the pixel maps of the
+    steps are multiplied together and each image is warped once. The images are thus
+    interpolated once instead of once per step, and keep the pixels that an
+    intermediate step would have moved out of the frame.
+    """
+    aug = cfg.aug
+    batch = tf.shape(images)[0]
+    xy = tf.cast(xy, tf.float64)
+    size = _image_size(images)
+    composed = tf.eye(3, batch_shape=[batch], dtype=tf.float64)
+    warped = tf.zeros([batch], tf.bool)
+
+    def step(apply: tf.Tensor, matrices: tf.Tensor, moved: tf.Tensor) -> None:
+        nonlocal xy, composed, warped
+        xy = _select(apply, moved, xy)
+        composed = _select(apply, tf.linalg.matmul(matrices, composed), composed)
+        warped |= apply
+
+    def chance(prob: float) -> tf.Tensor:
+        return tf.random.uniform([batch]) < prob
+
+    selected = chance(aug.overall_prob)
+    nothing = tf.zeros([batch], tf.bool)
+    flip_lr = selected & chance(aug.flip_lr_prob) if aug.flip_lr_prob else nothing
+    flip_ud = selected & chance(aug.flip_ud_prob) if aug.flip_ud_prob else nothing
+    rot = selected & chance(aug.rot_prob) if aug.rot_prob else nothing
+    transformed = flip_lr | flip_ud | rot
+
+    aligned = alignment_matrices(xy, size)
+    step(transformed, aligned, _transform(xy, aligned, size))
+    if aug.flip_lr_prob:
+        step(flip_lr, *_flip(xy, 0, size, darts_only=True))
+    if aug.flip_ud_prob:
+        step(flip_ud, *_flip(xy, 1, size, darts_only=True))
+    if aug.rot_prob:
+        angles = tf.constant(np.arange(-180, 180, step=aug.rot_step), tf.float64)
+        angle = tf.gather(angles, tf.random.uniform([batch], 0, len(angles), tf.int32))
+        step(rot, *_rotate(xy, angle, size, darts_only=True))
+    if aug.rot_small_prob:
+        angle = tf.random.uniform([batch], -aug.rot_small_max, aug.rot_small_max, tf.float64)
+        step(selected & chance(aug.rot_small_prob), *_rotate(xy, angle, size, darts_only=False))
+    if aug.jitter_prob:
+        shift = tf.random.uniform([batch, 2], -1, 1, tf.float64) * aug.jitter_max * size[0]
+        step(selected & chance(aug.jitter_prob), *_translate(xy, shift, size))
+
+    inverse = tf.linalg.inv(aligned)
+    untransform = transformed
+    if aug.warp_prob:
+        warp = selected & chance(aug.warp_prob)
+        # Samples warped without a flip or rotation are moved to the face-on frame first.
+        current = alignment_matrices(xy, size)
+        step(warp & ~transformed, current, _transform(xy, current, size))
+        perturbed = tf.linalg.inv(_select(transformed, aligned, current))
+        factors = tf.random.uniform([batch, 6], 0, aug.warp_rho, tf.float64)
+        ones = tf.ones_like(factors[:, 0])
+        scale = _matrices([
+            ones, factors[:, 0], factors[:, 1],
+            factors[:, 2], ones, factors[:, 3],
+            factors[:, 4], factors[:, 5], ones,
+        ])
+        inverse = _select(warp, perturbed * scale, inverse)
+        untransform = transformed | warp
+    step(untransform, inverse, _transform(xy, inverse, size))
+    return _warp(images, composed, warped), tf.cast(xy, tf.float32)
+
+
+def cut_out(images: tf.Tensor, xy: tf.Tensor, bbox_size: float, apply: tf.Tensor) -> tf.Tensor:
+    """``yolov4``'s ``cut_out`` where ``apply``: grey out a random quarter-size patch in half the keypoint boxes."""
+    shape = tf.shape(images)
+    height, width = shape[1], shape[2]
+    batch, keypoints = tf.shape(xy)[0], tf.shape(xy)[1]
+    box_w = tf.cast(bbox_size * tf.cast(width, tf.float64), tf.int32)
+    box_h = tf.cast(bbox_size * tf.cast(height, tf.float64), tf.int32)
+    x_min = tf.cast(tf.cast(xy[..., 0], tf.float64) * tf.cast(width, tf.float64), tf.int32) - box_w // 2
+    y_min = tf.cast(tf.cast(xy[..., 1], tf.float64) * tf.cast(height, tf.float64), tf.int32) - box_h // 2
+    cut_w, cut_h = box_w // 4, box_h // 4
+    random = tf.random.uniform([batch, keypoints, 2], dtype=tf.float64)
+    left = tf.cast(tf.cast(box_w - cut_w, tf.float64) * random[..., 0], tf.int32) + x_min
+    top = tf.cast(tf.cast(box_h - cut_h, tf.float64) * random[..., 1], tf.int32) + y_min
+    active = box_visibility(tf.cast(xy, tf.float64), bbox_size) & (tf.random.uniform([batch, keypoints]) < 0.5)
+    active &= apply[:, tf.newaxis]
+
+    columns = tf.range(width)[tf.newaxis, tf.newaxis, :]
+    rows = tf.range(height)[tf.newaxis, tf.newaxis, :]
+    in_x = (columns >= left[..., tf.newaxis]) & (columns < (left + cut_w)[..., tf.newaxis])  # (B, K, W)
+    in_y = (rows >= top[..., tf.newaxis]) & (rows < (top + cut_h)[..., tf.newaxis])  # (B, K, H)
+    # Union of the patches as a (B, H, K) x (B, K, W) product of the row and column masks.
+    rows_in = tf.cast(in_y & active[..., tf.newaxis], tf.float32)
+    mask = tf.linalg.matmul(rows_in, tf.cast(in_x, tf.float32), transpose_a=True) > 0
+    return tf.where(mask[..., tf.newaxis], tf.constant(0.5, images.dtype), images)
+
+
+def _synthetic_sample(input_size: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.RandomState(seed)
+    noise = rng.uniform(0, 255, (input_size, input_size, 3)).astype(np.uint8)
+    image = cv2.GaussianBlur(noise, (0, 0), 3)
+    cv2.circle(image, (input_size // 2, input_size // 2), int(input_size * 0.36), (255, 255, 255), 2)
+    angles = np.deg2rad([81, 261, 171, 351]) + rng.uniform(-0.05, 0.05, 4)
+    cal = 0.5 + 0.36 * np.stack([np.cos(angles), -np.sin(angles)], axis=-1) * rng.uniform(0.9, 1.1, (4, 2))
+    darts = rng.uniform(0.3, 0.7, (3, 2))
+    xy = np.concatenate([np.concatenate([cal, darts]), np.ones((7, 1))], axis=-1).astype(np.float32)
+    return image, xy
+
+
+def _compare(name: str, expected: Tuple[Any, ...], actual: Tuple[Any, ...]) -> Dict[str, Any]:
+    image, xy = expected[0].astype(np.float64), np.asarray(expected[1], dtype=np.float64)
+    diff = np.abs(image - np.asarray(actual[0], dtype=np.float64)[0])
+    xy_diff = float(np.max(np.abs(xy - np.asarray(actual[1], dtype=np.float64)[0])))
+    return {
+        "op": name,
+        "image_mean": float(diff.mean()),
+        "image_p999": float(np.percentile(diff, 99.9)),
+        "xy_max": xy_diff,
+        "ok": diff.mean() < 2e-3 and np.percentile(diff, 99.9) < 0.05 and xy_diff < 1e-4,
+    }
+
+
+def check_parity(cfg: CN, image_path: Optional[str] = None, seed: int = 0) -> List[Dict[str, Any]]:
+    """Run each TensorFlow op and its NumPy / OpenCV counterpart on the same sample.
+
+    Images match up to OpenCV's fixed-point bilinear weights (1/32 pixel) and keypoints
+    to float rounding. ``image_path`` (a cropped training image) also checks the JPEG
+    decoding; a synthetic board is used otherwise.
+    """
+    from dataloader import flip as np_flip, get_bounding_boxes, rotate as np_rotate, translate as np_translate
+    from dataset.annotate import transform as np_transform
+
+    input_size = cfg.model.input_size
+    bgr, xy = _synthetic_sample(input_size, seed)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        if image_path is None:
+            image_path = osp.join(tmp, "sample.jpg")
+            cv2.imwrite(image_path, bgr)
+        decoded = decode_image(tf.constant(image_path))[tf.newaxis]
+        img = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB) / 255.
+        rows.append(_compare("decode", (img, xy), (decoded, xy[np.newaxis])))
+
+    apply = tf.constant([True])
+    images, points = tf.constant(img[np.newaxis], tf.float32), tf.constant(xy[np.newaxis], tf.float64)
+
+    xy_t, img_t, M = np_transform(xy.copy(), img)
+    aligned = alignment_matrices(points, _image_size(images))
+    images_t, points_t = transform(images, points, aligned, apply)
+    rows.append(_compare("transform", (img_t, xy_t), (images_t, points_t)))
+
+    for direction in ["lr", "ud"]:
+        expected = np_flip(img_t, xy_t.copy(), direction)
+        rows.append(_compare("flip_" + direction, expected, flip(images_t, points_t, direction, apply)))
+    for angle, darts_only in [(36.0, True), (-1.5, False)]:
+        expected = np_rotate(img_t, xy_t.copy(), angle, darts_only)
+        actual = rotate(images_t, points_t, tf.constant([angle]), apply, darts_only)
+        rows.append(_compare("rotate_{:g}{}".format(angle, "_darts" if darts_only else ""), expected, actual))
+    expected = np_translate(img_t, xy_t.copy(), 7.3, -4.1)
+    rows.append(_compare("translate", expected, translate(images_t, points_t, tf.constant([[7.3, -4.1]]), apply)))
+
+    M_inv = np.linalg.inv(M)
+    M_inv[[0, 0, 1, 1, 2, 2], [1, 2, 0, 2, 0, 1]] *= np.random.RandomState(seed).uniform(0, cfg.aug.warp_rho, 6)
+    xy_w, img_w, _ = np_transform(xy_t.copy(), img_t, M=M_inv)
+    actual = transform(images_t, points_t, tf.constant(M_inv[np.newaxis]), apply)
+    rows.append(_compare("warp", (img_w, xy_w), actual))
+
+    # augment_batch: the keypoints go through the same steps, the image is warped once by
+    # the product of the pixel maps.
+    expected_xy = np_flip(img_t, xy_t.copy(), "lr")[1]
+    expected_xy = np_rotate(img_t, expected_xy, 36.0, darts_only=True)[1]
+    expected_xy = np_translate(img_t, expected_xy, 7.3, -4.1)[1]
+    expected_xy = np_transform(expected_xy, img_t, M=np.linalg.inv(M))[0]
+    height, width = img.shape[:2]
+    center = np.mean(xy_t[:4, :2], axis=0) * [width, height]
+    product = np.linalg.inv(M) @ np.array([[1, 0, 7.3], [0, 1, -4.1], [0, 0, 1]]) @ np.vstack(
+        [cv2.getRotationMatrix2D(tuple(center), 36.0, 1), [0, 0, 1]]
+    ) @ np.array([[-1, 0, width - 1], [0, 1, 0], [0, 0, 1]]) @ M
+    expected = (cv2.warpPerspective(img, product, (width, height)), expected_xy)
+
+    size = _image_size(images)
+    inverse = np.linalg.inv(M)[np.newaxis]
+    steps = [
+        lambda xy: _flip(xy, 0, size, darts_only=True),
+        lambda xy: _rotate(xy, tf.constant([36.0]), size, darts_only=True),
+        lambda xy: _translate(xy, tf.constant([[7.3, -4.1]]), size),
+        lambda xy: (tf.constant(inverse), _transform(xy, tf.constant(inverse), size)),
+    ]
+    composed, moved = aligned, points_t
+    for step in steps:
+        matrices, moved = step(moved)
+        composed = tf.linalg.matmul(matrices, composed)
+    rows.append(_compare("composed", expected, (_warp(images, composed, apply), moved)))
+
+    try:
+        from yolov4.tf import YOLOv4
+    except ImportError:
+        return rows
+    yolo = YOLOv4(tiny=cfg.model.tiny)
+    yolo.classes = "classes"
+    yolo.input_size = (input_size, input_size)
+    dataset = yolo.load_dataset("dummy_dataset.txt", label_smoothing=0.)
+    encoder = GroundTruthEncoder(dataset, cfg.train.bbox_size)
+    for name, sample in [("ground_truth", xy), ("ground_truth_warp", xy_w)]:
+        bboxes = get_bounding_boxes(np.array(sample), cfg.train.bbox_size)
+        expected = dataset.bboxes_to_ground_truth(bboxes)
+        batch = np.array(sample)[np.newaxis]
+        for suffix, actual in [
+            ("", [truth.numpy() for truth in encoder(tf.constant(batch))]),
+            ("_numpy", encoder.encode(batch)),
+            ("_bboxes", encoder.bboxes_to_ground_truth(bboxes)),
+        ]:
+            error = max(float(np.max(np.abs(e[0] - a[0]))) for e, a in zip(expected, actual))
+            rows.append({"op": name + suffix, "image_mean": 0.0, "image_p999": 0.0, "xy_max": error, "ok": error == 0})
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check the graph-native augmentations against dataloader.py")
+    parser.add_argument("-c", "--cfg", default="deepdarts_d1")
+    parser.add_argument("--image", help="Cropped training image to check (a synthetic board is used otherwise)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    cfg = CN(new_allowed=True)
+    cfg.merge_from_file(osp.join("configs", args.cfg + ".yaml"))
+    rows = check_parity(cfg, args.image, args.seed)
+    print("{:<24} {:>12} {:>12} {:>10} {:>4}".format("op", "image mean", "image p99.9", "xy max", "ok"))
+    for row in rows:
+        print("{:<24} {:>12.2e} {:>12.2e} {:>10.2e} {:>4}".format(
+            row["op"], row["image_mean"], row["image_p999"], row["xy_max"], "yes" if row["ok"] else "NO"))
+    sys.exit(0 if all(row["ok"] for row in rows) else 1)
+
+
+if __name__ == "__main__":
+    main()
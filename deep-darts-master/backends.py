@@ -0,0 +1,302 @@
+"""Inference backends used by the API server.
+
+Every backend takes a list of RGB frames and returns, per frame, the YOLO predictions in
+the ``yolov4`` layout ``(x, y, w, h, class_id, probability)`` with coordinates normalised
+to the original frame, which is what ``predict.bboxes_to_xy`` consumes.
+"""
+import logging
+import threading
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from yacs.config import CfgNode as CN
+
+LOGGER = logging.getLogger("deepdarts.backends")
+
+BACKEND_NAMES = ("tensorflow", "onnx")
+# Mirrors the defaults of yolov4.tf.YOLOv4.predict so batched and single-frame outputs match.
+YOLO_IOU_THRESHOLD = 0.3
+YOLO_SCORE_THRESHOLD = 0.25
+LETTERBOX_FILL = 255
+
+# (scale, dw, dh): resize factor and left/top padding applied by ``letterbox``.
+LetterboxInfo = Tuple[float, int, int]
+# (intra-op, inter-op) thread counts; the framework default is used when not given.
+ThreadCounts = Optional[Tuple[int, int]]
+
+
+def letterbox_params(shape: Tuple[int, ...], input_size: int) -> Tuple[Tuple[int, int], LetterboxInfo]:
+    """Resized ``(width, height)`` and letterbox info for a frame of the given shape."""
+    height, width = shape[:2]
+    scale = min(input_size / width, input_size / height)
+    new_width = int(round(width * scale))
+    new_height = int(round(height * scale))
+    return (new_width, new_height), (scale, (input_size - new_width) // 2, (input_size - new_height) // 2)
+
+
+def letterbox_into(image: np.ndarray, out: np.ndarray, scratch: Optional[np.ndarray] = None) -> LetterboxInfo:
+    """Resize ``image`` straight into the square ``out`` array, keeping its aspect ratio.
+
+    Frames downscaled by 2x or more are first box-filtered by the integer part of the
+    factor (area interpolation, which is only fast for integer factors), then resized
+    bilinearly, so that the thin wires and dart tips are averaged instead of aliased.
+    ``scratch`` is a flat uint8 buffer for the intermediate frame, allocated if too small.
+    """
+    (new_width, new_height), (scale, dw, dh) = letterbox_params(image.shape, out.shape[0])
+    factor = int(1 / scale)
+    if factor >= 2:
+        height, width = image.shape[0] // factor, image.shape[1] // factor
+        size = height * width * image.shape[2]
+        if scratch is None or scratch.size < size:
+            scratch = np.empty(size, dtype=np.uint8)
+        reduced = scratch[:size].reshape(height, width, image.shape[2])
+        cv2.resize(image, (width, height), dst=reduced, interpolation=cv2.INTER_AREA)
+        image = reduced
+    if dh:
+        out[:dh] = LETTERBOX_FILL
+        out[dh + new_height:] = LETTERBOX_FILL
+    if dw:
+        out[:, :dw] = LETTERBOX_FILL
+        out[:, dw + new_width:] = LETTERBOX_FILL
+    resized = out[dh:dh + new_height, dw:dw + new_width]
+    cv2.resize(image, (new_width, new_height), dst=resized, interpolation=cv2.INTER_LINEAR)
+    return scale, dw, dh
+
+
+def letterbox(image: np.ndarray, input_size: int) -> Tuple[np.ndarray, LetterboxInfo]:
+    """Resize ``image`` into an ``input_size`` square, keeping its aspect ratio."""
+    padded = np.empty((input_size, input_size, image.shape[2]), dtype=image.dtype)
+    return padded, letterbox_into(image, padded)
+
+
+class InputBuffers(threading.local):
+    """Preallocated model input tensors, one set per thread.
+
+    ``fill`` letterboxes the frames into a uint8 staging batch, swaps BGR to RGB in place
+    and converts it to the float32 ``[0, 1]`` NHWC input in one pass, so a batch
+    allocates nothing once the buffers have grown to the largest batch size and frame
+    seen. The returned tensor is only valid until the next ``fill`` from the same thread.
+    """
+
+    def __init__(self, input_size: int) -> None:
+        self.input_size = input_size
+        self.staging = np.empty((0, input_size, input_size, 3), dtype=np.uint8)
+        self.batch = np.empty((0, input_size, input_size, 3), dtype=np.float32)
+        self.scratch = np.empty(0, dtype=np.uint8)
+
+    def fill(self, images: List[np.ndarray], bgr: bool = False) -> np.ndarray:
+        count = len(images)
+        if count > len(self.staging):
+            self.staging = np.empty((count,) + self.staging.shape[1:], dtype=np.uint8)
+            self.batch = np.empty((count,) + self.batch.shape[1:], dtype=np.float32)
+        for image, out in zip(images, self.staging):
+            reduced = image.shape[0] * image.shape[1] * image.shape[2] // 4
+            if self.scratch.size < reduced:
+                self.scratch = np.empty(reduced, dtype=np.uint8)
+            letterbox_into(image, out, self.scratch)
+            if bgr:
+                cv2.cvtColor(out, cv2.COLOR_BGR2RGB, dst=out)
+        return np.divide(self.staging[:count], np.float32(255.0), out=self.batch[:count])
+
+
+def fit_to_original(
+    bboxes: np.ndarray, input_size: int, info: LetterboxInfo, original_shape: Tuple[int, ...]
+) -> np.ndarray:
+    """Map bboxes normalised to the letterboxed input back onto the original frame."""
+    if not len(bboxes):
+        return bboxes
+    scale, dw, dh = info
+    height, width = original_shape[:2]
+    bboxes = bboxes.copy()
+    bboxes[:, 0] = (bboxes[:, 0] * input_size - dw) / (width * scale)
+    bboxes[:, 1] = (bboxes[:, 1] * input_size - dh) / (height * scale)
+    bboxes[:, 2] = bboxes[:, 2] * input_size / (width * scale)
+    bboxes[:, 3] = bboxes[:, 3] * input_size / (height * scale)
+    return bboxes
+
+
+def diou_nms(bboxes: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Greedy per-class DIoU non-maximum suppression over ``(x, y, w, h, class_id, score)`` rows."""
+    if not len(bboxes):
+        return bboxes
+    kept = []
+    for class_id in np.unique(bboxes[:, 4]):
+        candidates = bboxes[bboxes[:, 4] == class_id]
+        candidates = candidates[np.argsort(-candidates[:, 5], kind="stable")]
+        while len(candidates):
+            best, candidates = candidates[0], candidates[1:]
+            kept.append(best)
+            if not len(candidates):
+                break
+            top_left = np.maximum(best[:2] - best[2:4] / 2, candidates[:, :2] - candidates[:, 2:4] / 2)
+            bottom_right = np.minimum(best[:2] + best[2:4] / 2, candidates[:, :2] + candidates[:, 2:4] / 2)
+            intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=-1)
+            union = best[2] * best[3] + candidates[:, 2] * candidates[:, 3] - intersection
+            iou = intersection / np.maximum(union, 1e-9)
+
+            enclose_tl = np.minimum(best[:2] - best[2:4] / 2, candidates[:, :2] - candidates[:, 2:4] / 2)
+            enclose_br = np.maximum(best[:2] + best[2:4] / 2, candidates[:, :2] + candidates[:, 2:4] / 2)
+            diagonal = np.sum((enclose_br - enclose_tl) ** 2, axis=-1)
+            center_distance = np.sum((candidates[:, :2] - best[:2]) ** 2, axis=-1)
+            diou = iou - center_distance / np.maximum(diagonal, 1e-9)
+            candidates = candidates[diou <= iou_threshold]
+    return np.stack(kept).astype(np.float32)
+
+
+def candidates_to_pred_bboxes(
+    candidates: np.ndarray,
+    input_size: int,
+    iou_threshold: float = YOLO_IOU_THRESHOLD,
+    score_threshold: float = YOLO_SCORE_THRESHOLD,
+) -> np.ndarray:
+    """NumPy port of ``yolov4``'s candidate filtering for one frame.
+
+    ``candidates`` holds the already-decoded head outputs ``(x, y, w, h, conf, prob_0, ...)``
+    normalised to the network input.
+    """
+    class_ids = np.argmax(candidates[:, 5:], axis=-1)
+    scores = candidates[np.arange(len(candidates)), class_ids + 5] * candidates[:, 4]
+    keep = scores > score_threshold
+
+    half = candidates[:, 2:4] * 0.5
+    keep &= np.all(candidates[:, 0:2] - half >= 0, axis=-1)
+    keep &= np.all(candidates[:, 0:2] + half <= 1, axis=-1)
+    keep &= (candidates[:, 2] > 4 / input_size) & (candidates[:, 3] > 4 / input_size)
+
+    bboxes = np.concatenate(
+        [candidates[keep, :4], class_ids[keep, np.newaxis], scores[keep, np.newaxis]], axis=-1
+    ).astype(np.float32)
+    return diou_nms(bboxes, iou_threshold)
+
+
+def flatten_outputs(outputs: List[Any], batch_size: int) -> np.ndarray:
+    """Concatenate the per-scale head outputs into ``(batch, candidates, box_size)``."""
+    return np.concatenate(
+        [
+            np.reshape(np.asarray(output), (batch_size, output.shape[1] * output.shape[2] * 3, -1))
+            for output in outputs
+        ],
+        axis=1,
+    )
+
+
+class TensorFlowBackend:
+    """Keras YOLOv4(-tiny) model built through ``train.build_model``.
+
+    ``predict_batch`` follows ``yolov4.tf.YOLOv4.predict`` except that frames share one
+    NHWC forward pass and are resized into preallocated ``InputBuffers``.
+    """
+
+    name = "tensorflow"
+
+    def __init__(self, cfg: CN, yolo: Any) -> None:
+        self.cfg = cfg
+        self.input_size = int(cfg.model.input_size)
+        self.yolo = yolo
+        self.buffers = InputBuffers(self.input_size)
+
+    @classmethod
+    def load(cls, cfg: CN, weights_path: Path, threads: ThreadCounts = None) -> "TensorFlowBackend":
+        if threads is not None:
+            import tensorflow as tf
+
+            # Only effective before the TensorFlow runtime is initialised, which importing
+            # train already does (it lists the GPUs).
+            tf.config.threading.set_intra_op_parallelism_threads(threads[0])
+            tf.config.threading.set_inter_op_parallelism_threads(threads[1])
+        from train import build_model  # TensorFlow is only imported when this backend is used.
+
+        yolo = build_model(cfg)
+        yolo.load_weights(str(weights_path), cfg.model.weights_type)
+        return cls(cfg, yolo)
+
+    def forward(self, rgb_images: List[np.ndarray], bgr: bool = False) -> np.ndarray:
+        """Raw candidates; with ``bgr`` the frames are BGR and converted while batching."""
+        batch = self.buffers.fill(rgb_images, bgr)
+        return flatten_outputs(self.yolo.model(batch, training=False), len(rgb_images))
+
+    def postprocess(self, candidates: np.ndarray, rgb_images: List[np.ndarray]) -> List[np.ndarray]:
+        pred_bboxes = []
+        for image, image_candidates in zip(rgb_images, candidates):
+            bboxes = self.yolo.candidates_to_pred_bboxes(
+                image_candidates,
+                iou_threshold=YOLO_IOU_THRESHOLD,
+                score_threshold=YOLO_SCORE_THRESHOLD,
+            )
+            pred_bboxes.append(self.yolo.fit_pred_bboxes_to_original(bboxes, image.shape))
+        return pred_bboxes
+
+    def predict_batch(self, rgb_images: List[np.ndarray], bgr: bool = False) -> List[np.ndarray]:
+        return self.postprocess(self.forward(rgb_images, bgr), rgb_images)
+
+
+class OnnxBackend:
+    """Graph exported by ``export_to_onnx.py`` executed with ONNX Runtime.
+
+    Candidate filtering, NMS and the letterbox inversion run in NumPy, so neither
+    TensorFlow nor ``yolov4`` is imported.
+    """
+
+    name = "onnx"
+
+    def __init__(self, cfg: CN, model_path: Path, threads: ThreadCounts = None) -> None:
+        try:
+            import onnxruntime as ort
+        except ImportError as error:
+            raise ImportError(
+                "Le backend ONNX nécessite onnxruntime: pip install onnxruntime"
+            ) from error
+
+        self.cfg = cfg
+        self.input_size = int(cfg.model.input_size)
+        self.buffers = InputBuffers(self.input_size)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads is not None:
+            options.intra_op_num_threads, options.inter_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            str(model_path), sess_options=options, providers=ort.get_available_providers()
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Graphs exported without --dynamic-batch only accept one frame per run.
+        self.static_batch = isinstance(model_input.shape[0], int) and model_input.shape[0] == 1
+        LOGGER.info(
+            "Session ONNX chargée depuis %s (entrée %s %s, fournisseurs %s)",
+            model_path,
+            self.input_name,
+            model_input.shape,
+            self.session.get_providers(),
+        )
+
+    def _run(self, batch: np.ndarray) -> np.ndarray:
+        if not self.static_batch:
+            return flatten_outputs(self.session.run(None, {self.input_name: batch}), len(batch))
+        return np.concatenate(
+            [flatten_outputs(self.session.run(None, {self.input_name: batch[i:i + 1]}), 1) for i in range(len(batch))]
+        )
+
+    def forward(self, rgb_images: List[np.ndarray], bgr: bool = False) -> np.ndarray:
+        """Raw candidates; with ``bgr`` the frames are BGR and converted while batching."""
+        return self._run(self.buffers.fill(rgb_images, bgr))
+
+    def postprocess(self, candidates: np.ndarray, rgb_images: List[np.ndarray]) -> List[np.ndarray]:
+        pred_bboxes = []
+        for image, image_candidates in zip(rgb_images, candidates):
+            _, info = letterbox_params(image.shape, self.input_size)
+            bboxes = candidates_to_pred_bboxes(image_candidates, self.input_size)
+            pred_bboxes.append(fit_to_original(bboxes, self.input_size, info, image.shape))
+        return pred_bboxes
+
+    def predict_batch(self, rgb_images: List[np.ndarray], bgr: bool = False) -> List[np.ndarray]:
+        return self.postprocess(self.forward(rgb_images, bgr), rgb_images)
+
+
+def create_backend(name: str, cfg: CN, model_path: Path, threads: ThreadCounts = None) -> Any:
+    if name == "onnx":
+        return OnnxBackend(cfg, model_path, threads)
+    if name == "tensorflow":
+        return TensorFlowBackend.load(cfg, model_path, threads)
+    raise ValueError(f"Backend inconnu: {name}. Valeurs possibles: {', '.join(BACKEND_NAMES)}")
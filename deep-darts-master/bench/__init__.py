@@ -0,0 +1 @@
+"""Benchmarks for the DeepDarts detection pipeline. Run them from ``deep-darts-master``."""
@@ -0,0 +1,105 @@
+"""Memory allocated by the model input preprocessing, before and after ``InputBuffers``.
+
+Usage::
+
+    python -m bench.allocations --frame-size 1920x1080 --input-size 800 --batch-sizes 1 4 8
+
+``legacy`` is the former per-batch path: ``cv2.cvtColor`` to RGB, a freshly padded
+letterbox per frame, ``np.stack``, ``astype(np.float32)`` and ``/ 255``. ``buffers`` is
+``InputBuffers.fill`` on BGR frames, as the API server calls it. For each, the peak of
+the memory traced by ``tracemalloc`` during one batch (after warm-up) and the p50
+latency are reported. The model is never loaded.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import cv2
+import numpy as np
+
+from backends import LETTERBOX_FILL, InputBuffers, letterbox_params
+from bench.upload_formats import _synthetic_frame
+
+
+def _legacy_preprocess(bgr_images: List[np.ndarray], input_size: int) -> np.ndarray:
+    padded_images = []
+    for image in bgr_images:
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        (new_width, new_height), (_, dw, dh) = letterbox_params(rgb.shape, input_size)
+        padded = np.full((input_size, input_size, 3), LETTERBOX_FILL, dtype=np.uint8)
+        padded[dh:dh + new_height, dw:dw + new_width] = cv2.resize(rgb, (new_width, new_height))
+        padded_images.append(padded)
+    return np.stack(padded_images).astype(np.float32) / 255.0
+
+
+def _measure(fn: Callable[[], Any], repeats: int, warmup: int = 3) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(repeats):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {"peak_bytes": float(np.max(peaks)), "p50_ms": float(np.percentile(samples, 50) * 1000.0)}
+
+
+def bench_allocations(
+    frame: np.ndarray, input_size: int, batch_sizes: List[int], repeats: int
+) -> List[Dict[str, Any]]:
+    buffers = InputBuffers(input_size)
+    rows = []
+    for batch_size in batch_sizes:
+        images = [frame] * batch_size
+        paths = {
+            "legacy": lambda: _legacy_preprocess(images, input_size),
+            "buffers": lambda: buffers.fill(images, bgr=True),
+        }
+        for path, fn in paths.items():
+            rows.append({"path": path, "batch_size": batch_size, **_measure(fn, repeats)})
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", help="Frame to benchmark (a synthetic frame is used otherwise)")
+    parser.add_argument("--frame-size", default="1920x1080", help="WIDTHxHEIGHT of the synthetic frame")
+    parser.add_argument("--input-size", type=int, default=800)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.image:
+        frame = cv2.imread(args.image)
+        if frame is None:
+            parser.error(f"Impossible de lire l'image {args.image}")
+    else:
+        width, height = (int(v) for v in args.frame_size.lower().split("x"))
+        frame = cv2.resize(_synthetic_frame(max(width, height)), (width, height))
+
+    rows = bench_allocations(frame, args.input_size, args.batch_sizes, args.repeats)
+    print("{:<8} {:>6} {:>14} {:>14} {:>9}".format("path", "batch", "peak MiB", "MiB/frame", "p50 ms"))
+    for row in rows:
+        peak_mib = row["peak_bytes"] / 2 ** 20
+        print("{:<8} {:>6} {:>14.2f} {:>14.2f} {:>9.2f}".format(
+            row["path"], row["batch_size"], peak_mib, peak_mib / row["batch_size"], row["p50_ms"]))
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump({"args": vars(args), "results": rows}, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""Per-stage latency and throughput of the detection pipeline.
+
+Usage::
+
+    python -m bench.pipeline --backends tensorflow onnx --input-sizes 480 800 \\
+        --batch-sizes 1 4 8 --output bench-results.json --baseline bench-baseline.json
+
+Stages that do not need the model (``decode``, ``color``, ``nms``, ``bboxes_to_xy``, ``scoring``
+and ``serialize``) always run. ``forward``, ``postprocess`` and ``roundtrip`` (full
+``/api/detect`` requests against a local uvicorn) run for every backend / input size /
+batch size combination that can be loaded; the others are listed as skipped in the
+artifact. With ``--baseline`` the p50 of every stage is compared with the stored run and
+the command exits with status 1 when one regressed by more than ``--tolerance``.
+"""
+import argparse
+import base64
+import json
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from yacs.config import CfgNode as CN
+
+import serve
+from backends import BACKEND_NAMES, create_backend
+from bench.upload_formats import _synthetic_frame
+from dataset.annotate import get_dart_scores, score_darts
+from postprocess import keypoint_nms
+from predict import batch_bboxes_to_xy, bboxes_to_xy, pad_bboxes
+
+PERCENTILES = (50, 95, 99)
+# Stage key: (stage, backend, input size, batch size); model-free stages use None.
+StageKey = Tuple[str, Optional[str], Optional[int], int]
+
+
+def _summary(samples: List[float], frames_per_sample: int) -> Dict[str, float]:
+    samples_ms = np.asarray(samples) * 1000.0
+    summary = {f"p{p}_ms": float(np.percentile(samples_ms, p)) for p in PERCENTILES}
+    summary["mean_ms"] = float(samples_ms.mean())
+    summary["fps"] = frames_per_sample * len(samples) / float(np.sum(samples))
+    summary["samples"] = len(samples)
+    return summary
+
+
+def _time(fn: Callable[[], Any], repeats: int, warmup: int = 3) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _synthetic_bboxes(rng: np.random.Generator, n_darts: int = 3) -> np.ndarray:
+    """Four calibration points on a face-on board plus ``n_darts`` darts on it."""
+    radius = 0.3
+    cal = 0.5 + radius * np.array([[0.0, 1.0], [0.0, -1.0], [1.0, 0.0], [-1.0, 0.0]])
+    angles = rng.uniform(0, 2 * np.pi, n_darts)
+    distances = rng.uniform(0, radius, n_darts)
+    darts = 0.5 + distances[:, None] * np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+    xy = np.concatenate([cal, darts])
+    classes = np.concatenate([np.arange(1, 5), np.zeros(n_darts)])
+    probs = rng.uniform(0.5, 1.0, len(xy))
+    return np.column_stack([xy, np.full((len(xy), 2), 0.02), classes, probs]).astype(np.float32)
+
+
+def _load_cfg(cfg_name: str, input_size: Optional[int] = None) -> CN:
+    cfg = CN(new_allowed=True)
+    cfg.merge_from_file(str(serve.BASE_DIR / "configs" / f"{cfg_name}.yaml"))
+    cfg.model.name = cfg_name
+    if input_size is not None:
+        cfg.model.input_size = input_size
+    return cfg
+
+
+def _load_backend(name: str, cfg: CN, onnx_path: Optional[str]) -> Any:
+    if name == "onnx":
+        if onnx_path:
+            model_path = Path(onnx_path.format(size=cfg.model.input_size))
+        else:
+            model_path = serve._resolve_onnx_path(cfg.model.name)
+        backend = create_backend(name, cfg, model_path)
+        height = backend.session.get_inputs()[0].shape[1]
+        if isinstance(height, int) and height != cfg.model.input_size:
+            raise ValueError(f"{model_path} attend des images de {height} px")
+        return backend
+    return create_backend(name, cfg, serve._resolve_weights_path(cfg, cfg.model.name))
+
+
+def bench_model_free(frame: np.ndarray, cfg: CN, repeats: int) -> Dict[StageKey, Dict[str, float]]:
+    ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    assert ok
+    data_uri = "data:image/jpeg;base64," + base64.b64encode(encoded.tobytes()).decode("ascii")
+    bboxes = _synthetic_bboxes(np.random.default_rng(0))
+    xy = bboxes_to_xy(bboxes, serve.MAX_DARTS)
+
+    bundle = serve._ModelBundle()
+    _, confidences = batch_bboxes_to_xy(pad_bboxes([bboxes]), serve.MAX_DARTS, return_confidences=True)
+    detections = bundle._to_detections(xy, confidences[0], score_darts(xy[np.newaxis], cfg), 0)
+
+    stages = {
+        "decode": lambda: serve._decode_image(data_uri),
+        "color": lambda: cv2.cvtColor(frame, cv2.COLOR_BGR2RGB),
+        "nms": lambda: keypoint_nms(pad_bboxes([bboxes]), cfg.train.bbox_size, serve.NMS_RADIUS or 0.5),
+        "bboxes_to_xy": lambda: bboxes_to_xy(bboxes, serve.MAX_DARTS),
+        "scoring": lambda: get_dart_scores(xy[:, :2], cfg, numeric=True),
+        "serialize": lambda: json.dumps(jsonable_encoder(serve.DetectionResponse(detections=detections))),
+    }
+    return {(stage, None, None, 1): _summary(_time(fn, repeats), 1) for stage, fn in stages.items()}
+
+
+def bench_model(
+    backend: Any, frame: np.ndarray, batch_sizes: List[int], repeats: int
+) -> Dict[StageKey, Dict[str, float]]:
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    size = int(backend.cfg.model.input_size)
+    results = {}
+    for batch_size in batch_sizes:
+        images = [rgb] * batch_size
+        candidates = backend.forward(images)
+
+        def postprocess() -> None:
+            batch_bboxes_to_xy(pad_bboxes(backend.postprocess(candidates, images)), serve.MAX_DARTS)
+
+        results[("forward", backend.name, size, batch_size)] = _summary(
+            _time(lambda: backend.forward(images), repeats), batch_size
+        )
+        results[("postprocess", backend.name, size, batch_size)] = _summary(_time(postprocess, repeats), batch_size)
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def bench_roundtrip(
+    backend: Any, frame: np.ndarray, batch_sizes: List[int], repeats: int
+) -> Dict[StageKey, Dict[str, float]]:
+    """``/api/detect`` round-trips through uvicorn, ``batch_size`` clients at a time so the
+    server micro-batches them. Samples are per-request latencies.
+
+    Every request posts the same frame, so the result cache is disabled for the run."""
+    import httpx
+    import uvicorn
+
+    # Installing bumps the bundle version, so nothing computed by a previous backend is reused.
+    serve.bundle._install(backend, backend.cfg, None)
+    cache_bytes, serve.result_cache.max_bytes = serve.result_cache.max_bytes, 0
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(serve.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    assert ok
+    body = encoded.tobytes()
+    url = f"http://127.0.0.1:{port}/api/detect"
+    size = int(backend.cfg.model.input_size)
+    results = {}
+    try:
+        with httpx.Client(timeout=60.0) as client:
+            def request() -> float:
+                start = time.perf_counter()
+                client.post(url, content=body, headers={"Content-Type": "image/jpeg"}).raise_for_status()
+                return time.perf_counter() - start
+
+            for batch_size in batch_sizes:
+                with ThreadPoolExecutor(batch_size) as pool:
+                    list(pool.map(lambda _: request(), range(batch_size)))  # warm-up
+                    samples: List[float] = []
+                    wall_start = time.perf_counter()
+                    for _ in range(repeats):
+                        samples.extend(pool.map(lambda _: request(), range(batch_size)))
+                    wall = time.perf_counter() - wall_start
+                summary = _summary(samples, 1)
+                summary["fps"] = len(samples) / wall
+                results[("roundtrip", backend.name, size, batch_size)] = summary
+    finally:
+        server.should_exit = True
+        thread.join()
+        serve.result_cache.max_bytes = cache_bytes
+    return results
+
+
+def _environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+def _rows(results: Dict[StageKey, Dict[str, float]]) -> List[Dict[str, Any]]:
+    return [
+        {"stage": stage, "backend": backend, "input_size": size, "batch_size": batch_size, **summary}
+        for (stage, backend, size, batch_size), summary in results.items()
+    ]
+
+
+def compare(rows: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Stages whose p50 grew by more than ``tolerance`` relative to ``baseline``."""
+    def key(row: Dict[str, Any]) -> Tuple[Any, ...]:
+        return row["stage"], row["backend"], row["input_size"], row["batch_size"]
+
+    previous = {key(row): row for row in baseline}
+    regressions = []
+    for row in rows:
+        old = previous.get(key(row))
+        if old is None:
+            continue
+        ratio = row["p50_ms"] / old["p50_ms"]
+        row["baseline_p50_ms"] = old["p50_ms"]
+        if ratio > 1.0 + tolerance:
+            regressions.append(
+                "{} ({}, {}, batch {}): p50 {:.3f} ms -> {:.3f} ms (+{:.0%})".format(
+                    *key(row), old["p50_ms"], row["p50_ms"], ratio - 1.0
+                )
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cfg", default=serve.DEFAULT_CFG_NAME, help="Configuration in configs/")
+    parser.add_argument("--image", help="Frame to benchmark (a synthetic frame is used otherwise)")
+    parser.add_argument("--size", type=int, default=800, help="Side of the synthetic frame")
+    parser.add_argument("--backends", nargs="+", default=list(BACKEND_NAMES), choices=BACKEND_NAMES)
+    parser.add_argument("--input-sizes", nargs="+", type=int, default=[480, 800])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--onnx-path", help="ONNX graph, '{size}' is replaced by the input size")
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--no-roundtrip", action="store_true", help="Skip the uvicorn round-trips")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed p50 slowdown vs the baseline")
+    args = parser.parse_args()
+
+    frame = cv2.imread(args.image) if args.image else _synthetic_frame(args.size)
+    if frame is None:
+        parser.error(f"Impossible de lire l'image {args.image}")
+
+    results = bench_model_free(frame, _load_cfg(args.cfg), args.repeats)
+    skipped = []
+    for name in args.backends:
+        for input_size in args.input_sizes:
+            try:
+                backend = _load_backend(name, _load_cfg(args.cfg, input_size), args.onnx_path)
+            except (ImportError, FileNotFoundError, ValueError) as error:
+                skipped.append({"backend": name, "input_size": input_size, "reason": str(error)})
+                print(f"skipped {name} @ {input_size}: {error}", file=sys.stderr)
+                continue
+            results.update(bench_model(backend, frame, args.batch_sizes, args.repeats))
+            if not args.no_roundtrip:
+                results.update(bench_roundtrip(backend, frame, args.batch_sizes, args.repeats))
+
+    rows = _rows(results)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare(rows, json.load(handle)["results"], args.tolerance)
+
+    print("{:<13} {:<11} {:>5} {:>6} {:>9} {:>9} {:>9} {:>9}".format(
+        "stage", "backend", "size", "batch", "p50 ms", "p95 ms", "p99 ms", "frames/s"))
+    for row in rows:
+        print("{stage:<13} {backend!s:<11} {input_size!s:>5} {batch_size:>6} "
+              "{p50_ms:>9.3f} {p95_ms:>9.3f} {p99_ms:>9.3f} {fps:>9.1f}".format(**row))
+
+    if args.output:
+        artifact = {"environment": _environment(), "args": vars(args), "results": rows, "skipped": skipped}
+        with open(args.output, "w") as handle:
+            json.dump(artifact, handle, indent=2)
+
+    if regressions:
+        print("\nRegressions (tolerance {:.0%}):".format(args.tolerance))
+        for regression in regressions:
+            print("  " + regression)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
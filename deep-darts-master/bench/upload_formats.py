@@ -0,0 +1,99 @@
+"""Compare wire size and server CPU cost of the ``/api/detect`` upload formats.
+
+Usage::
+
+    python -m bench.upload_formats --image path/to/frame.jpg --repeats 200
+
+Each format is measured on the server side only: from the raw request body to the
+decoded BGR frame, i.e. ``serve._image_from_body``. The model is never loaded.
+"""
+import argparse
+import base64
+import json
+import time
+import uuid
+from typing import Callable, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from serve import _image_from_body
+
+
+def _synthetic_frame(size: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    frame = cv2.GaussianBlur(rng.integers(0, 255, (size, size, 3), dtype=np.uint8), (7, 7), 0)
+    cv2.circle(frame, (size // 2, size // 2), size // 3, (40, 40, 200), 4)
+    return frame
+
+
+def _payloads(jpeg: bytes) -> Dict[str, Tuple[bytes, str]]:
+    boundary = uuid.uuid4().hex
+    multipart = b"".join([
+        f"--{boundary}\r\n".encode(),
+        b'Content-Disposition: form-data; name="image"; filename="frame.jpg"\r\n',
+        b"Content-Type: image/jpeg\r\n\r\n",
+        jpeg,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    data_uri = "data:image/jpeg;base64," + base64.b64encode(jpeg).decode("ascii")
+    return {
+        "json-base64": (json.dumps({"image": data_uri}).encode(), "application/json"),
+        "image/jpeg": (jpeg, "image/jpeg"),
+        "multipart": (multipart, f"multipart/form-data; boundary={boundary}"),
+    }
+
+
+def _measure(decode: Callable[[], np.ndarray], repeats: int) -> Tuple[float, float]:
+    decode()  # warm-up
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for _ in range(repeats):
+        decode()
+    cpu = (time.process_time() - cpu_start) / repeats * 1000.0
+    wall = (time.perf_counter() - wall_start) / repeats * 1000.0
+    return cpu, wall
+
+
+def run(jpeg: bytes, repeats: int) -> List[Dict[str, float]]:
+    results = []
+    for name, (body, content_type) in _payloads(jpeg).items():
+        cpu_ms, wall_ms = _measure(lambda: _image_from_body(body, content_type), repeats)
+        results.append({
+            "format": name,
+            "bytes": len(body),
+            "overhead": len(body) / len(jpeg) - 1.0,
+            "cpu_ms": cpu_ms,
+            "wall_ms": wall_ms,
+        })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", help="JPEG frame to upload (a synthetic frame is used otherwise)")
+    parser.add_argument("--size", type=int, default=800, help="Side of the synthetic frame")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality of the synthetic frame")
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as handle:
+            jpeg = handle.read()
+    else:
+        ok, encoded = cv2.imencode(".jpg", _synthetic_frame(args.size), [cv2.IMWRITE_JPEG_QUALITY, args.quality])
+        assert ok
+        jpeg = encoded.tobytes()
+
+    results = run(jpeg, args.repeats)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print("{:<12} {:>10} {:>9} {:>9} {:>9}".format("format", "bytes", "overhead", "cpu ms", "wall ms"))
+    for result in results:
+        print("{format:<12} {bytes:>10d} {overhead:>8.1%} {cpu_ms:>9.3f} {wall_ms:>9.3f}".format(**result))
+
+
+if __name__ == "__main__":
+    main()
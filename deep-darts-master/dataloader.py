@@ -2,12 +2,15 @@ import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 import os.path as osp
 import tensorflow as tf
-import pandas as pd
 import numpy as np
 import cv2
 from dataset.annotate import draw, transform
 from yacs.config import CfgNode as CN
 from yolov4.tf.dataset import cut_out
+import augment
+from ground_truth import GroundTruthEncoder, keypoint_classes
+from image_cache import open_cache
+from tfrecords import load_records
 
 
 d1_val = ['d1_02_06_2020', 'd1_02_16_2020', 'd1_02_22_2020']
@@ -24,6 +27,7 @@ def get_splits(path='./dataset/labels.pkl', dataset='d1', split='train'):
         val_folders, test_folders = d1_val, d1_test
     else:
         val_folders, test_folders = d2_val, d2_test
+    import pandas as pd  # not needed to train from tfrecords
     df = pd.read_pickle(path)
     df = df[df.img_folder.str.contains(dataset)]
     splits = {}
@@ -36,12 +40,15 @@ def get_splits(path='./dataset/labels.pkl', dataset='d1', split='train'):
         return splits[split]
 
 
-def preprocess(path, xy, cfg, bbox_to_gt_func, split='train', return_xy=False):
-    path = path.numpy().decode('utf-8')
+def preprocess(path, xy, cfg, bbox_to_gt_func, split='train', return_xy=False, cache=None):
     xy = xy.numpy()
 
-    img = cv2.imread(path)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)  # yolov4 tf convention
+    if cache is not None:
+        img = cache[int(path.numpy())]  # path is the row of the decoded RGB image
+    else:
+        path = path.numpy().decode('utf-8')
+        img = cv2.imread(path)
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)  # yolov4 tf convention
     img = img / 255.  # yolov4 tf convention
 
     if split == 'train' and np.random.uniform() < cfg.aug.overall_prob:
@@ -210,15 +217,11 @@ def get_bounding_boxes(xy, size):
         (xy[:, 0] + size / 2 >= 1) |
         (xy[:, 1] - size / 2 <= 0) |
         (xy[:, 1] + size / 2 >= 1)), -1] = 0
-    xywhc = []
-    for i, _xy in enumerate(xy):
-        if i < 4:
-            cls = i + 1
-        else:
-            cls = 0
-        if _xy[-1]:  # is visible
-            xywhc.append([_xy[0], _xy[1], size, size, cls])
-    xywhc = np.array(xywhc)
+    visible = xy[:, -1] != 0
+    xywhc = np.empty((np.count_nonzero(visible), 5))
+    xywhc[:, :2] = xy[visible, :2]
+    xywhc[:, 2:4] = size
+    xywhc[:, 4] = keypoint_classes(len(xy))[visible]  # i + 1 for cal points, 0 for darts
     return xywhc
 
 
@@ -237,24 +240,60 @@ def set_shapes_tiny(img, gt1, gt2, input_size):
     return img, gt1, gt2
 
 
+def yolo_dataset(bbox_to_gt_func):
+    # the yolov4 Dataset when bbox_to_gt_func is its bound bboxes_to_ground_truth, which
+    # GroundTruthEncoder reproduces with array ops; None for any other function
+    if getattr(bbox_to_gt_func, '__name__', None) != 'bboxes_to_ground_truth':
+        return None
+    return getattr(bbox_to_gt_func, '__self__', None)
+
+
+def batch_ground_truth(xys, cfg, bbox_to_gt_func):
+    # per-image bbox_to_gt_func over a (B, 7, 3) batch, stacked per scale
+    gts = [bbox_to_gt_func(get_bounding_boxes(xy.copy(), cfg.train.bbox_size)) for xy in xys]
+    return [np.stack([item.reshape(item.shape[-4:]) for item in scale]).astype(np.float32) for scale in zip(*gts)]
+
+
+def get_xys(data):
+    xys = np.zeros((len(data), 7, 3))  # third column for visibility
+    for i, _xy in enumerate(data.xy.apply(np.array)):
+        xys[i, :_xy.shape[0], :2] = _xy
+        xys[i, :_xy.shape[0], 2] = 1
+    return xys.astype(np.float32)
+
+
 def load_tfds(
         cfg,
         bbox_to_gt_func,
         split='train',
         return_xy=False,
         batch_size=32,
-        debug=False):
+        debug=False,
+        native=True,
+        cache=True,
+        records=True):
+
+    AUTO = tf.data.experimental.AUTOTUNE if not debug else 1
+    input_size = cfg.model.input_size
+
+    records_path = cfg.data.get('records_path', '') if records else ''
+    if records_path:
+        # split exported by tfrecords.py, always through the graph-native pipeline
+        ds, n = load_records(records_path, cfg.data.dataset, split, input_size, seed=cfg.train.seed,
+                             num_parallel_calls=AUTO)
+        read_image = lambda image: augment.decode_jpeg(image, input_size)
+        ds = native_pipeline(ds, read_image, cfg, bbox_to_gt_func, split, return_xy, batch_size, AUTO)
+        return data_generator(iter(ds), n, cfg.model.tiny) if not return_xy else ds
 
     data = get_splits(cfg.data.labels_path, cfg.data.dataset, split)
-    img_path = osp.join(cfg.data.path, 'cropped_images', str(cfg.model.input_size))
+    img_path = osp.join(cfg.data.path, 'cropped_images', str(input_size))
     img_paths = [osp.join(img_path, folder, name) for (folder, name) in zip(data.img_folder, data.img_name)]
+    xys = get_xys(data)
 
-    xys = np.zeros((len(data), 7, 3))  # third column for visibility
-    data.xy = data.xy.apply(np.array)
-    for i, _xy in enumerate(data.xy):
-        xys[i, :_xy.shape[0], :2] = _xy
-        xys[i, :_xy.shape[0], 2] = 1
-    xys = xys.astype(np.float32)
+    # decoded images of image_cache.py, read instead of the jpegs when built
+    image_cache = open_cache(cfg.data.path, cfg.model.input_size) if cache else None
+    if image_cache is not None:
+        img_paths = image_cache.lookup(data.img_folder, data.img_name)
 
     if return_xy:
         dtypes = [tf.float32 for _ in range(2)]
@@ -264,18 +303,32 @@ def load_tfds(
         else:
             dtypes = [tf.float32 for _ in range(4)]
 
-    AUTO = tf.data.experimental.AUTOTUNE if not debug else 1
     ds = tf.data.Dataset.from_tensor_slices((img_paths, xys))
     ds = ds.shuffle(10000).repeat()
 
+    if native:
+        # graph-native pipeline (see augment.py), batched before augmentation
+        if image_cache is not None:
+            read_images = lambda rows: augment.cached_images(rows, image_cache, input_size)
+            ds = native_pipeline(ds, read_images, cfg, bbox_to_gt_func, split, return_xy, batch_size, AUTO,
+                                 batched_read=True)
+        else:
+            read_image = lambda path: augment.decode_image(path, input_size)
+            ds = native_pipeline(ds, read_image, cfg, bbox_to_gt_func, split, return_xy, batch_size, AUTO)
+        return data_generator(iter(ds), len(data), cfg.model.tiny) if not return_xy else ds
+
+    # vectorised drop-in for the bound bboxes_to_ground_truth of the yolov4 Dataset
+    dataset = yolo_dataset(bbox_to_gt_func)
+    if dataset is not None:
+        encode = GroundTruthEncoder(dataset, cfg.train.bbox_size).bboxes_to_ground_truth
+    else:
+        encode = bbox_to_gt_func
     ds = ds.map(lambda path, xy:
                 tf.py_function(
-                    lambda path, xy: preprocess(path, xy, cfg, bbox_to_gt_func, split, return_xy),
+                    lambda path, xy: preprocess(path, xy, cfg, encode, split, return_xy, image_cache),
                     [path, xy], dtypes),
                 num_parallel_calls=AUTO)
 
-    input_size = int(img_path.split('/')[-1])
-
     if not return_xy:
         if cfg.model.tiny:
             ds = ds.map(lambda img, gt1, gt2:
@@ -291,6 +344,46 @@ def load_tfds(
     return ds
 
 
+def native_pipeline(ds, read_image, cfg, bbox_to_gt_func, split, return_xy, batch_size, AUTO, batched_read=False):
+    # same outputs as preprocess, without tf.py_function, from (image source, xy) pairs
+    # read_image reads one source, or a whole batch of them with batched_read
+    if batched_read:
+        # samples sorted by source within the (shuffled) batch, so the cache is read in file order
+        def read_sorted(sources, xy):
+            order = tf.argsort(sources)
+            return read_image(tf.gather(sources, order)), tf.gather(xy, order)
+
+        ds = ds.batch(batch_size, drop_remainder=True)
+        ds = ds.map(read_sorted, num_parallel_calls=AUTO)
+    else:
+        ds = ds.map(lambda source, xy: (read_image(source), xy), num_parallel_calls=AUTO)
+        ds = ds.batch(batch_size, drop_remainder=True)
+    if split == 'train':
+        ds = ds.map(lambda img, xy: augment.augment_batch(img, xy, cfg), num_parallel_calls=AUTO)
+    if not return_xy:
+        dataset = yolo_dataset(bbox_to_gt_func)
+        if dataset is not None:
+            encoder = GroundTruthEncoder(dataset, cfg.train.bbox_size)
+        else:
+            # any other bbox_to_gt_func runs once per batch, outside the graph
+            strides = [16, 32] if cfg.model.tiny else [8, 16, 32]
+
+            def encoder(xy):
+                gts = tf.numpy_function(lambda xy: batch_ground_truth(xy, cfg, bbox_to_gt_func),
+                                        [xy], [tf.float32] * len(strides))
+                size = cfg.model.input_size
+                return [tf.ensure_shape(gt, [None, size // s, size // s, 3, 10]) for gt, s in zip(gts, strides)]
+
+        def encode(img, xy):
+            if split == 'train' and cfg.aug.cutout_prob:
+                apply = tf.random.uniform([tf.shape(img)[0]]) < cfg.aug.cutout_prob
+                img = augment.cut_out(img, xy, cfg.train.bbox_size, apply)
+            return (img, *encoder(xy))
+
+        ds = ds.map(encode, num_parallel_calls=AUTO)
+    return ds.prefetch(AUTO)
+
+
 class data_generator():
     """Wrap the tensorflow dataset in a generator so that we can combine
     gt into list because that's what the YOLOv4 loss function requires"""
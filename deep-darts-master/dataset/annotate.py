@@ -1,7 +1,7 @@
 import os
 import os.path as osp
+from collections import namedtuple
 import cv2
-import pandas as pd
 import numpy as np
 from yacs.config import CfgNode as CN
 import argparse
@@ -134,47 +134,167 @@ def transform(xy, img=None, angle=9, M=None):
     return xy_dst, img, M
 
 
-def get_dart_scores(xy, cfg, numeric=False):
-    valid_cal_pts = xy[:4][(xy[:4, 0] > 0) & (xy[:4, 1] > 0)]
-    if xy.shape[0] <= 4 or valid_cal_pts.shape[0] < 4:  # missing calibration point
-        return []
-    xy, _, _ = transform(xy.copy(), angle=0)
-    c, r_d = get_circle(xy)
+# homography to the face-on board, board center and radii in the transformed frame
+BoardGeometry = namedtuple('BoardGeometry', ['M', 'c', 'r_d', 'r_t', 'r_ob', 'r_ib', 'w_dt'])
+
+
+def board_geometry(cal_xy, cfg):
+    cal_xy, _, M = transform(cal_xy[:4, :2].copy(), angle=0)
+    c, r_d = get_circle(cal_xy)
     r_t, r_ob, r_ib, w_dt = board_radii(r_d, cfg)
-    xy -= c
-    angles = np.arctan2(-xy[4:, 1], xy[4:, 0]) / np.pi * 180
-    angles = [a + 360 if a < 0 else a for a in angles]  # map to 0-360
-    distances = np.linalg.norm(xy[4:], axis=-1)
-    scores = []
-    for angle, dist in zip(angles, distances):
-        if dist > r_d:
-            scores.append('0')
-        elif dist <= r_ib:
-            scores.append('DB')
-        elif dist <= r_ob:
-            scores.append('B')
-        else:
-            number = BOARD_DICT[int(angle / 18)]
-            if dist <= r_d and dist > r_d - w_dt:
-                scores.append('D' + number)
-            elif dist <= r_t and dist > r_t - w_dt:
-                scores.append('T' + number)
-            else:
-                scores.append(number)
+    return BoardGeometry(M, c, r_d, r_t, r_ob, r_ib, w_dt)
+
+
+class CalibrationCache:
+    """Keeps the board geometry of a fixed camera between frames.
+
+    The homography and ring radii are only recomputed when a detected calibration point
+    drifts by more than `tolerance` (fraction of the calibration circle radius). Frames
+    where calibration points are occluded, or drift while some are occluded, reuse the
+    cached geometry.
+    """
+    def __init__(self, tolerance=0.01):
+        self.tolerance = tolerance
+        self.reset()
+
+    def reset(self):
+        self.cal_xy = None
+        self.radius = None
+        self.geometry = None
+        self.hits = 0
+        self.misses = 0
+
+    def update(self, cal_xy, cfg, detected=None):
+        """Return the geometry to score `cal_xy`'s frame with, or None if the board is not calibrated.
+        `detected` flags the calibration points actually seen in this frame (default: non-zero points)."""
+        cal_xy = np.asarray(cal_xy)[:4, :2]
+        valid = (cal_xy[:, 0] > 0) & (cal_xy[:, 1] > 0)
+        detected = valid if detected is None else np.asarray(detected, dtype=bool) & valid
+        if self.geometry is not None:
+            drift = np.linalg.norm(cal_xy[detected] - self.cal_xy[detected], axis=-1)
+            if not len(drift) or drift.max() <= self.tolerance * self.radius:
+                self.hits += 1
+                return self.geometry
+        if not valid.all():
+            # the board moved but cannot be recalibrated yet: fall back to the last good geometry
+            if self.geometry is not None:
+                self.hits += 1
+            return self.geometry
+        self.cal_xy = cal_xy.copy()
+        self.radius = get_circle(self.cal_xy)[1]
+        self.geometry = board_geometry(cal_xy, cfg)
+        self.misses += 1
+        return self.geometry
+
+
+# label codes returned by score_darts: miss, outer bull, inner bull, then the 20 singles,
+# doubles and trebles in BOARD_DICT (angle) order
+CODE_MISS, CODE_BULL, CODE_DOUBLE_BULL, CODE_SINGLE, CODE_DOUBLE, CODE_TREBLE = 0, 1, 2, 3, 23, 43
+SECTOR_NUMBERS = np.array([int(BOARD_DICT[i]) for i in range(20)])
+DART_LABELS = np.array(
+    ['0', 'B', 'DB'] +
+    [BOARD_DICT[i] for i in range(20)] +
+    ['D' + BOARD_DICT[i] for i in range(20)] +
+    ['T' + BOARD_DICT[i] for i in range(20)])
+DART_BASE_SCORES = np.concatenate([[0, 25, 25], SECTOR_NUMBERS, SECTOR_NUMBERS, SECTOR_NUMBERS])
+DART_MULTIPLIERS = np.concatenate([[0, 1, 2], np.full(20, 1), np.full(20, 2), np.full(20, 3)])
+DART_SCORES = DART_BASE_SCORES * DART_MULTIPLIERS
+
+DartScores = namedtuple('DartScores', ['codes', 'base_scores', 'multipliers', 'scores', 'totals', 'valid'])
+
+
+def apply_homography(M, xy):
+    # batched equivalent of the point mapping in transform(), M is (N, 3, 3) and xy (N, K, 2)
+    xyz = np.concatenate((xy, np.ones(xy.shape[:-1] + (1,))), axis=-1).astype(np.float32)
+    xyz_dst = np.matmul(M, xyz.transpose(0, 2, 1)).transpose(0, 2, 1)
+    return xyz_dst[..., :2] / xyz_dst[..., 2:]
+
+
+def batch_board_geometry(cal_xys):
+    """Homographies (N, 3, 3), centers (N, 2) and double radii (N,) for (N, 4, 2) calibration points.
+    Same computation as board_geometry; the 4-point homography is still solved by cv2 for each
+    board so that the results stay bit-identical."""
+    c = np.mean(cal_xys, axis=1)
+    r = np.mean(np.linalg.norm(cal_xys - c[:, np.newaxis], axis=-1), axis=1)
+    c, r = c.astype(np.float64), r.astype(np.float64)
+    dst_pts = np.stack([
+        np.stack([c[:, 0], c[:, 1] - r], axis=-1),
+        np.stack([c[:, 0], c[:, 1] + r], axis=-1),
+        np.stack([c[:, 0] - r, c[:, 1]], axis=-1),
+        np.stack([c[:, 0] + r, c[:, 1]], axis=-1)], axis=1).astype(np.float32)
+    src_pts = cal_xys.astype(np.float32)
+    M = np.zeros((len(cal_xys), 3, 3))
+    for i in range(len(cal_xys)):
+        M[i] = cv2.getPerspectiveTransform(src_pts[i], dst_pts[i])
+    cal_dst = apply_homography(M, cal_xys)
+    c_d = np.mean(cal_dst, axis=1)
+    r_d = np.mean(np.linalg.norm(cal_dst - c_d[:, np.newaxis], axis=-1), axis=1)
+    return M, c_d, r_d
+
+
+def score_darts(xys, cfg, geometry=None):
+    """Vectorized scoring of (N, K, 2 or 3) keypoint sets (4 calibration points then K - 4 darts).
+
+    Returns DartScores of (N, K - 4) label codes (index into DART_LABELS), base scores, multipliers
+    and numeric scores, plus (N,) totals and a (N,) mask of boards that could be scored. Like
+    get_dart_scores, every dart row is scored whatever its visibility. If `geometry` (a BoardGeometry)
+    is given it is used for all boards instead of the calibration points; a list of N optional
+    BoardGeometry gives one per board, None falling back to the calibration points of that board.
+    """
+    xys = np.asarray(xys)
+    n, n_darts = xys.shape[0], max(xys.shape[1] - 4, 0)
+    codes = np.full((n, n_darts), -1, dtype=np.int64)
+    if geometry is None or isinstance(geometry, BoardGeometry):
+        geometry = [geometry] * n
+    fixed = np.array([g is not None for g in geometry], dtype=bool).reshape(n)
+    valid = fixed | np.all((xys[:, :4, 0] > 0) & (xys[:, :4, 1] > 0), axis=1)
+    if not n_darts:
+        valid[:] = False
+
+    if valid.any():
+        xy = xys[valid, :, :2]
+        M, c, r_d = np.zeros((len(xy), 3, 3)), np.zeros((len(xy), 2)), np.zeros(len(xy))
+        from_points = ~fixed[valid]
+        if from_points.any():
+            M[from_points], c[from_points], r_d[from_points] = batch_board_geometry(xy[from_points, :4])
+        for i, g in enumerate(g for g, v in zip(geometry, valid) if v):
+            if g is not None:
+                M[i], c[i], r_d[i] = g.M, g.c, g.r_d
+        r_t, r_ob, r_ib, w_dt = [r[:, np.newaxis] for r in board_radii(r_d, cfg)]
+        r_d = r_d[:, np.newaxis]
+
+        darts = apply_homography(M, xy[:, 4:]) - c[:, np.newaxis]
+        angles = np.arctan2(-darts[..., 1], darts[..., 0]) / np.pi * 180
+        angles = np.where(angles < 0, angles + 360, angles)  # map to 0-360
+        distances = np.linalg.norm(darts, axis=-1)
+        sectors = (angles / 18).astype(np.int64) % 20
+
+        # later assignments take precedence, mirroring the if/elif order of get_dart_scores
+        board_codes = CODE_SINGLE + sectors
+        board_codes = np.where((distances <= r_t) & (distances > r_t - w_dt), CODE_TREBLE + sectors, board_codes)
+        board_codes = np.where((distances <= r_d) & (distances > r_d - w_dt), CODE_DOUBLE + sectors, board_codes)
+        board_codes = np.where(distances <= r_ob, CODE_BULL, board_codes)
+        board_codes = np.where(distances <= r_ib, CODE_DOUBLE_BULL, board_codes)
+        board_codes = np.where(distances > r_d, CODE_MISS, board_codes)
+        codes[valid] = board_codes
+
+    scored = codes >= 0
+    base_scores = np.where(scored, DART_BASE_SCORES[codes], 0)
+    multipliers = np.where(scored, DART_MULTIPLIERS[codes], 0)
+    scores = np.where(scored, DART_SCORES[codes], 0)
+    return DartScores(codes, base_scores, multipliers, scores, scores.sum(axis=1), valid)
+
+
+def get_dart_scores(xy, cfg, numeric=False, geometry=None):
+    xy = np.asarray(xy)
+    if xy.shape[0] <= 4:
+        return []
+    scores = score_darts(xy[np.newaxis], cfg, geometry=geometry)
+    if not scores.valid[0]:  # missing calibration point
+        return []
     if numeric:
-        for i, s in enumerate(scores):
-            if 'B' in s:
-                if 'D' in s:
-                    scores[i] = 50
-                else:
-                    scores[i] = 25
-            else:
-                if 'D' in s or 'T' in s:
-                    scores[i] = int(s[1:])
-                    scores[i] = scores[i] * 2 if 'D' in s else scores[i] * 3
-                else:
-                    scores[i] = int(s)
-    return scores
+        return scores.scores[0].tolist()
+    return DART_LABELS[scores.codes[0]].tolist()
 
 
 def draw(img, xy, cfg, circles, score, color=(255, 255, 0)):
@@ -245,6 +365,7 @@ def adjust_xy(idx):
 
 
 def add_last_dart(annot, data_path, folder):
+    import pandas as pd  # imported here so that the scoring helpers don't pull in pandas
     csv_path = osp.join(data_path, 'annotations', folder + '.csv')
     if osp.isfile(csv_path):
         dart_labels = []
@@ -289,6 +410,7 @@ def get_bounding_box(img_path, scale=0.2):
 
 def main(cfg, folder, scale, draw_circles, dart_score=True):
     global xy, img_copy
+    import pandas as pd
     img_dir = osp.join(cfg.data.path, 'images', folder)
     imgs = sorted(os.listdir(img_dir))
     annot_path = osp.join(cfg.data.path, 'annotations', folder + '.pkl')
@@ -0,0 +1,138 @@
+"""YOLO ground truth of the keypoint boxes, with array operations.
+
+Every keypoint is a ``bbox_size`` box (``dataloader.get_bounding_boxes``): class ``i + 1``
+for calibration point ``i``, 0 for the darts, and no box when the keypoint is not
+visible or its box crosses the image border. ``GroundTruthEncoder`` turns them into the
+targets of ``yolov4``'s ``Dataset.bboxes_to_ground_truth``: ``(B, H, W, 3, 5 + classes)``
+per output scale, i.e. ``input_size // 16`` and ``// 32`` grids for YOLOv4-tiny (see
+``dataloader.set_shapes_tiny``). The same encoding runs on NumPy batches (``encode``), as a
+drop-in for ``bboxes_to_ground_truth`` and in the TensorFlow graph (``__call__``). As in
+the original loop, the last box assigned to a grid cell and anchor wins.
+"""
+from typing import Any, List
+
+import numpy as np
+import tensorflow as tf
+
+IOU_THRESHOLD = 0.3  # as in yolov4's bboxes_to_ground_truth
+
+
+def box_visibility(xy: Any, bbox_size: float) -> Any:
+    """Keypoints of ``(..., K, 3)`` NumPy or TensorFlow ``xy`` that get a box."""
+    x, y = xy[..., 0], xy[..., 1]
+    half = bbox_size / 2
+    inside = (x - half > 0) & (x + half < 1) & (y - half > 0) & (y + half < 1)
+    return (xy[..., 2] != 0) & inside
+
+
+def keypoint_classes(num_keypoints: int) -> np.ndarray:
+    index = np.arange(num_keypoints)
+    return np.where(index < 4, index + 1, 0)
+
+
+def _anchor_ious(boxes: Any, anchors: Any, xp: Any) -> Any:
+    # yolov4.tf.train.bbox_iou between (M, 4) boxes and the (S, 3) anchors centered on them
+    xy, wh = boxes[:, None, None, :2], boxes[:, None, None, 2:]
+    left_up = xp.maximum(xy - wh * 0.5, xy - anchors * 0.5)
+    right_down = xp.minimum(xy + wh * 0.5, xy + anchors * 0.5)
+    section = xp.maximum(right_down - left_up, 0.0)
+    intersection = section[..., 0] * section[..., 1]
+    union = wh[..., 0] * wh[..., 1] + anchors[..., 0] * anchors[..., 1] - intersection
+    return intersection / (union + 1e-8)
+
+
+class GroundTruthEncoder:
+    """Ground truth for the anchors and grids of a ``yolov4.tf.dataset.Dataset``.
+
+    ``dataset`` is the object whose ``bboxes_to_ground_truth`` the training script uses
+    (``yolo.load_dataset``); its anchors, grids, number of classes and label smoothing
+    are copied.
+    """
+
+    def __init__(self, dataset: Any, bbox_size: float) -> None:
+        self.bbox_size = bbox_size
+        self.anchors = np.asarray(dataset.anchors_ratio, dtype=np.float32)  # (S, 3, 2)
+        self.grid_size = [tuple(int(v) for v in size) for size in dataset.grid_size]  # (height, width)
+        self.grid_xy = [np.asarray(grid[0], dtype=np.float32) for grid in dataset.grid_xy]  # (H, W, 3, 2)
+        num_classes = dataset.num_classes
+        onehot = np.eye(num_classes, dtype=np.float32)
+        uniform = np.full(num_classes, 1.0 / num_classes, dtype=np.float32)
+        self.labels = (1 - dataset.label_smoothing) * onehot + dataset.label_smoothing * uniform
+
+    def _encode(self, batch: int, sample: np.ndarray, boxes: np.ndarray, classes: np.ndarray) -> List[np.ndarray]:
+        # boxes (M, 4) float32 of samples ``sample``, in the order they are written
+        ious = _anchor_ious(boxes, self.anchors, np)  # (M, S, 3)
+        positive = ious > IOU_THRESHOLD
+        flat = ious.reshape(len(boxes), self.anchors.shape[0] * self.anchors.shape[1])
+        best = np.zeros(flat.shape, dtype=bool)
+        best[np.arange(len(boxes)), flat.argmax(axis=1)] = True
+        best = best.reshape(positive.shape)
+        assign = np.where(positive.any(axis=(1, 2))[:, None, None], positive, best)
+        values = np.concatenate([boxes, np.ones((len(boxes), 1), np.float32), self.labels[classes]], axis=-1)
+
+        truths = []
+        for grid, (height, width), scale_assign in zip(self.grid_xy, self.grid_size, np.moveaxis(assign, 1, 0)):
+            truth = np.zeros((batch,) + grid.shape[:-1] + (5 + len(self.labels),), dtype=np.float32)
+            truth[..., 0:2] = grid
+            box, anchor = np.nonzero(scale_assign)  # by box, then anchor: later boxes overwrite
+            cell = np.floor(boxes[box, :2].astype(np.float64) * [width, height]).astype(np.int64)
+            truth[sample[box], cell[:, 1], cell[:, 0], anchor] = values[box]
+            truths.append(truth)
+        return truths
+
+    def encode(self, xy: np.ndarray) -> List[np.ndarray]:
+        """Ground truth per scale for NumPy ``(B, K, 3)`` keypoints."""
+        sample, keypoint = np.nonzero(box_visibility(xy, self.bbox_size))
+        boxes = np.empty((len(sample), 4), dtype=np.float32)
+        boxes[:, :2] = xy[sample, keypoint, :2]
+        boxes[:, 2:] = self.bbox_size
+        return self._encode(len(xy), sample, boxes, keypoint_classes(xy.shape[1])[keypoint])
+
+    def bboxes_to_ground_truth(self, bboxes: np.ndarray) -> List[np.ndarray]:
+        """Drop-in for ``Dataset.bboxes_to_ground_truth``: ``(1, H, W, 3, 5 + classes)``
+        per scale for the ``(x, y, w, h, class_id)`` rows of one image."""
+        bboxes = np.asarray(bboxes).reshape(-1, 5)
+        sample = np.zeros(len(bboxes), dtype=np.int64)
+        return self._encode(1, sample, bboxes[:, :4].astype(np.float32), bboxes[:, 4].astype(np.int64))
+
+    def __call__(self, xy: tf.Tensor) -> List[tf.Tensor]:
+        """Ground truth per scale for ``(B, K, 3)`` keypoint tensors, in the graph.
+
+        Scatter updates do not order duplicate indices, so boxes are written one keypoint
+        at a time, each for the whole batch.
+        """
+        xy = tf.cast(xy, tf.float64)
+        batch = tf.shape(xy)[0]
+        visible = box_visibility(xy, self.bbox_size)
+        anchors = tf.constant(self.anchors)
+        labels = tf.constant(self.labels)
+        classes = keypoint_classes(xy.shape[1])
+        scales = len(self.grid_size)
+
+        truths = []
+        for grid in self.grid_xy:
+            grid = tf.broadcast_to(tf.constant(grid), tf.concat([[batch], grid.shape], 0))
+            truths.append(tf.concat([grid, tf.zeros(tf.concat([tf.shape(grid)[:-1], [3 + len(self.labels)]], 0))], -1))
+
+        for k in range(xy.shape[1]):
+            centers = tf.cast(xy[:, k, :2], tf.float32)
+            boxes = tf.concat([centers, tf.fill([batch, 2], tf.constant(self.bbox_size, tf.float32))], -1)
+            ious = _anchor_ious(boxes, anchors, tf.math)
+            positive = ious > IOU_THRESHOLD
+            best = tf.reshape(tf.one_hot(tf.argmax(tf.reshape(ious, [batch, -1]), axis=1), scales * 3,
+                                         on_value=True, off_value=False), [batch, scales, 3])
+            exist = tf.reduce_any(positive, axis=[1, 2])
+            assign = tf.where(exist[:, tf.newaxis, tf.newaxis], positive, best) & visible[:, k, tf.newaxis, tf.newaxis]
+            label = tf.concat([tf.ones([1], tf.float32), labels[classes[k]]], 0)
+
+            for s, (height, width) in enumerate(self.grid_size):
+                index = tf.where(assign[:, s])  # (M, 2): sample, anchor
+                sample = index[:, 0]
+                cell = tf.cast(tf.math.floor(tf.cast(tf.gather(centers, sample), tf.float64) * [width, height]),
+                               tf.int64)
+                indices = tf.stack([sample, cell[:, 1], cell[:, 0], index[:, 1]], axis=1)
+                updates = tf.concat(
+                    [tf.gather(boxes, sample), tf.tile(label[tf.newaxis], [tf.shape(sample)[0], 1])], -1
+                )
+                truths[s] = tf.tensor_scatter_nd_update(truths[s], indices, updates)
+        return truths
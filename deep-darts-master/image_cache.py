@@ -0,0 +1,174 @@
+"""Decoded training images in one memory-mapped array.
+
+``python image_cache.py --size 800`` decodes ``<data>/cropped_images/800/<img_folder>/<img_name>``
+once for every row of ``labels.pkl`` and packs the images into ``<data>/cropped_images/800.npy``,
+a ``(N, 800, 800, 3)`` uint8 RGB array, with ``800.json`` mapping ``<img_folder>/<img_name>`` to
+its row and the size and modification time of its JPEG. ``load_tfds`` then reads batches of the
+memory-mapped array instead of decoding the JPEGs every epoch, and processes training on the same
+machine share its pages through the page cache. A cache whose JPEGs changed since it was built
+is ignored.
+"""
+import argparse
+import json
+import os
+import os.path as osp
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+
+def cache_paths(data_path: str, input_size: int) -> Tuple[str, str]:
+    """``(images, index)`` paths of the cache of ``input_size`` images under ``data_path``."""
+    prefix = osp.join(data_path, "cropped_images", str(input_size))
+    return prefix + ".npy", prefix + ".json"
+
+
+def image_key(folder: str, name: str) -> str:
+    return folder + "/" + name
+
+
+def source_stat(path: str) -> List[int]:
+    """``[size, mtime_ns]`` of a source JPEG, recorded in the index to detect re-cropped images."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class ImageCache:
+    """Read-only view of a cache written by ``build_cache``."""
+
+    def __init__(self, images_path: str, index_path: str) -> None:
+        self.images = np.load(images_path, mmap_mode="r")
+        with open(index_path) as handle:
+            index = json.load(handle)
+        self.keys: List[str] = index["keys"]
+        self.sources: Optional[List[List[int]]] = index.get("sources")
+        if len(self.keys) != len(self.images):
+            raise ValueError(
+                "Cache d'images incohérent : {} images pour {} clés ({})".format(
+                    len(self.images), len(self.keys), images_path)
+            )
+        self.rows: Dict[str, int] = {key: row for row, key in enumerate(self.keys)}
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def __getitem__(self, row: int) -> np.ndarray:
+        """The RGB image of ``row``, as a view of the mapped file."""
+        return self.images[row]
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """The ``(len(rows), size, size, 3)`` RGB images of ``rows``, gathered in one copy.
+
+        Pass the rows in ascending order to read the mapped file sequentially.
+        """
+        return self.images[rows]
+
+    def stale_keys(self, source_path: str) -> List[str]:
+        """Keys whose JPEG under ``source_path`` is missing or changed since the cache was built
+        (all of them for caches built without the source stats)."""
+        if self.sources is None:
+            return list(self.keys)
+        stale = []
+        for key, recorded in zip(self.keys, self.sources):
+            path = osp.join(source_path, key)
+            if not osp.exists(path) or source_stat(path) != recorded:
+                stale.append(key)
+        return stale
+
+    def lookup(self, folders: Sequence[str], names: Sequence[str]) -> np.ndarray:
+        """Rows of the ``img_folder`` / ``img_name`` images, which must all be cached."""
+        keys = [image_key(folder, name) for folder, name in zip(folders, names)]
+        missing = [key for key in keys if key not in self.rows]
+        if missing:
+            raise KeyError(
+                "{} image(s) absente(s) du cache, par ex. {} : reconstruisez-le avec "
+                "python image_cache.py --overwrite".format(len(missing), missing[0])
+            )
+        return np.array([self.rows[key] for key in keys], dtype=np.int64)
+
+
+def open_cache(data_path: str, input_size: int) -> Optional[ImageCache]:
+    """The cache of ``input_size`` images under ``data_path``, or None when it was not built or
+    is out of date with the cropped JPEGs."""
+    images_path, index_path = cache_paths(data_path, input_size)
+    if not (osp.exists(images_path) and osp.exists(index_path)):
+        return None
+    cache = ImageCache(images_path, index_path)
+    stale = cache.stale_keys(osp.join(data_path, "cropped_images", str(input_size)))
+    if stale:
+        print(
+            "Cache d'images périmé, ignoré : {} image(s) modifiée(s) depuis sa création, par ex. {}. "
+            "Reconstruisez-le avec python image_cache.py --overwrite".format(len(stale), stale[0])
+        )
+        return None
+    return cache
+
+
+def build_cache(
+    labels_path: str, data_path: str, input_size: int, overwrite: bool = False, workers: Optional[int] = None
+) -> str:
+    """Decode the cropped images of every labelled row into the cache and return its path.
+
+    Images that were not cropped are left out. The array and index are written under
+    temporary names and renamed at the end, so an interrupted build leaves no cache.
+    """
+    images_path, index_path = cache_paths(data_path, input_size)
+    if osp.exists(images_path) and osp.exists(index_path) and not overwrite:
+        print(images_path, "already exists")
+        return images_path
+
+    import pandas as pd  # only needed to build the cache
+
+    data = pd.read_pickle(labels_path)
+    crop_path = osp.join(data_path, "cropped_images", str(input_size))
+    keys = list(dict.fromkeys(image_key(f, n) for f, n in zip(data.img_folder, data.img_name)))
+    keys = [key for key in keys if osp.exists(osp.join(crop_path, key))]
+    if len(keys) < len(data):
+        print("Images non recadrées ignorées :", len(data) - len(keys))
+
+    tmp_images, tmp_index = images_path + ".tmp.npy", index_path + ".tmp"
+    images = np.lib.format.open_memmap(
+        tmp_images, mode="w+", dtype=np.uint8, shape=(len(keys), input_size, input_size, 3)
+    )
+
+    sources = [[0, 0]] * len(keys)
+
+    def load(row: int) -> None:
+        path = osp.join(crop_path, keys[row])
+        sources[row] = source_stat(path)  # before reading, so that a later change is detected
+        image = cv2.imread(path)
+        if image is None or image.shape[:2] != (input_size, input_size):
+            raise ValueError("Image illisible ou de taille inattendue : {}".format(keys[row]))
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=images[row])
+
+    try:
+        # cv2 releases the GIL while decoding, so threads decode in parallel.
+        with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+            list(pool.map(load, range(len(keys))))
+        images.flush()
+        del images
+        with open(tmp_index, "w") as handle:
+            json.dump({"input_size": input_size, "keys": keys, "sources": sources}, handle)
+        os.replace(tmp_images, images_path)
+        os.replace(tmp_index, index_path)
+    finally:
+        for path in [tmp_images, tmp_index]:
+            if osp.exists(path):
+                os.remove(path)
+    print("Wrote", images_path, "({} images)".format(len(keys)))
+    return images_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-lp", "--labels-path", default="dataset/labels.pkl")
+    parser.add_argument("-dp", "--data-path", default="dataset", help="Directory holding cropped_images/")
+    parser.add_argument("-s", "--size", nargs="+", type=int, default=[800])
+    parser.add_argument("-w", "--workers", type=int, help="Decoding threads (default: CPU count)")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild an existing cache")
+    args = parser.parse_args()
+
+    for size in args.size:
+        build_cache(args.labels_path, args.data_path, size, args.overwrite, args.workers)
@@ -0,0 +1,64 @@
+"""Confidence-aware cleanup of the keypoint detections.
+
+The detector predicts every keypoint as a fixed-size box (``cfg.train.bbox_size`` of
+the input), so duplicates of one keypoint are boxes of the same class whose centers are
+close relative to that size, whatever their IoU or predicted w/h. ``keypoint_nms`` keeps
+the most confident box of each group and moves it to the confidence-weighted mean of the
+group, on padded batches (see ``predict.pad_bboxes``) so that a whole batch costs a few
+array operations.
+"""
+from typing import Union
+
+import numpy as np
+
+
+def keypoint_nms(
+    bboxes: np.ndarray,
+    box_size: Union[float, np.ndarray],
+    radius: float = 0.5,
+    score_threshold: float = 0.0,
+    refine: bool = True,
+) -> np.ndarray:
+    """Class-wise distance NMS over padded ``(B, N, 6)`` boxes ``(x, y, w, h, class_id, score)``.
+
+    ``box_size`` is the nominal keypoint box size in the units of the boxes: ``cfg.train.bbox_size``
+    for boxes normalised to the model input, or ``(B, 2)`` per-image ``(w, h)`` sizes. Two boxes of
+    the same class are duplicates when their centers are closer than ``radius`` box sizes. Boxes are visited by decreasing score and kept unless
+    they duplicate an already kept box; with ``refine`` a kept box is moved to the
+    confidence-weighted mean center of its duplicates. Boxes scoring below
+    ``score_threshold`` are dropped. Returns the boxes sorted by decreasing score, with the
+    removed ones turned into padding rows (class -1). Boxes without a score (NaN) rank
+    last and weigh 1.
+    """
+    cls = bboxes[:, :, 4]
+    conf = bboxes[:, :, 5]
+    rank = np.where(np.isnan(conf), 0, conf)
+    valid = (cls >= 0) & ~(rank < score_threshold)
+    order = np.argsort(np.where(valid, -rank, np.inf), axis=1, kind="stable")
+    boxes = np.take_along_axis(bboxes, order[:, :, np.newaxis], axis=1)
+    valid = np.take_along_axis(valid, order, axis=1)
+    cls = boxes[:, :, 4]
+
+    box_size = np.asarray(box_size, dtype=np.float64)
+    if box_size.ndim == 2:
+        box_size = box_size[:, np.newaxis, np.newaxis]
+    offset = (boxes[:, :, np.newaxis, :2] - boxes[:, np.newaxis, :, :2]) / box_size
+    close = np.sum(offset ** 2, axis=-1) < radius ** 2  # (B, N, N)
+    close &= cls[:, :, np.newaxis] == cls[:, np.newaxis]
+    close &= valid[:, :, np.newaxis] & valid[:, np.newaxis]
+
+    # Greedy suppression, vectorised over the batch: box i survives unless a kept box ranked
+    # before it is a duplicate.
+    keep = np.zeros(valid.shape, dtype=bool)
+    for i in range(boxes.shape[1]):
+        keep[:, i] = valid[:, i] & ~np.any(keep[:, :i] & close[:, :i, i], axis=1)
+
+    if refine:
+        weights = close * np.where(np.isnan(boxes[:, :, 5]), 1.0, boxes[:, :, 5])[:, np.newaxis]
+        total = weights.sum(axis=-1, keepdims=True)
+        centers = np.einsum("bij,bjk->bik", weights, boxes[:, :, :2]) / np.where(total > 0, total, 1)
+        boxes[:, :, :2] = np.where(keep[:, :, np.newaxis] & (total > 0), centers, boxes[:, :, :2])
+
+    boxes[~keep] = 0
+    boxes[:, :, 4] = np.where(keep, cls, -1)
+    return boxes
@@ -2,65 +2,205 @@ import argparse
 from yacs.config import CfgNode as CN
 import os.path as osp
 import os
-from dataloader import get_splits
 import cv2
 import numpy as np
 from time import time
-from dataset.annotate import draw, get_dart_scores
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataset.annotate import draw, get_dart_scores, score_darts
+from backends import TensorFlowBackend
+from postprocess import keypoint_nms
 import pickle
 
 
-def bboxes_to_xy(bboxes, max_darts=3):
-    xy = np.zeros((4 + max_darts, 3), dtype=np.float32)
-    for cls in range(5):
-        if cls == 0:
-            dart_xys = bboxes[bboxes[:, 4] == 0, :2][:max_darts]
-            xy[4:4 + len(dart_xys), :2] = dart_xys
-        else:
-            cal = bboxes[bboxes[:, 4] == cls, :2]
-            if len(cal):
-                xy[cls - 1, :2] = cal[0]
-    xy[(xy[:, 0] > 0) & (xy[:, 1] > 0), -1] = 1
-    if np.sum(xy[:4, -1]) == 4:
+def bboxes_to_xy(bboxes, max_darts=3, nms_radius=0, bbox_size=None):
+    # bbox_size: cfg.train.bbox_size, needed when nms_radius > 0
+    padded = pad_bboxes([bboxes])
+    if nms_radius > 0:
+        padded = keypoint_nms(padded, bbox_size, nms_radius)
+    return batch_bboxes_to_xy(padded, max_darts)[0]
+
+
+def pad_bboxes(bboxes_list):
+    """Stack per-image YOLO outputs (x, y, w, h, class_id[, prob]) into a (B, N, 6) array.
+    Padding rows have class_id -1."""
+    n = max([len(b) for b in bboxes_list] + [1])
+    padded = np.zeros((len(bboxes_list), n, 6), dtype=np.float32)
+    padded[:, :, 4] = -1
+    for i, bboxes in enumerate(bboxes_list):
+        bboxes = np.asarray(bboxes, dtype=np.float32).reshape((-1, np.shape(bboxes)[-1] if np.size(bboxes) else 6))
+        padded[i, :len(bboxes), :bboxes.shape[1]] = bboxes[:, :6]
+        if bboxes.shape[1] < 6:
+            padded[i, :len(bboxes), 5] = np.nan  # no confidence column
+    return padded
+
+
+def batch_bboxes_to_xy(bboxes, max_darts=3, return_confidences=False):
+    """Keypoints (B, 4 + max_darts, 3) from padded detector output (B, N, 6), see pad_bboxes.
+    Each calibration point is the most confident box of its class and darts are the max_darts
+    most confident class-0 boxes. Missing calibration points are estimated with batch_est_cal_pts.
+    With return_confidences, also returns the (B, max_darts) dart confidences (0 where no dart)."""
+    b = bboxes.shape[0]
+    cls = bboxes[:, :, 4]
+    conf = bboxes[:, :, 5] if bboxes.shape[-1] > 5 else np.full(cls.shape, np.nan, dtype=np.float32)
+    rank = np.where(np.isnan(conf), 0, conf)
+    rows = np.arange(b)[:, np.newaxis]
+
+    xy = np.zeros((b, 4 + max_darts, 3), dtype=np.float32)
+
+    cal_mask = cls[:, :, np.newaxis] == np.arange(1, 5)  # (B, N, 4)
+    cal_idx = np.argmax(np.where(cal_mask, rank[:, :, np.newaxis], -np.inf), axis=1)  # (B, 4)
+    cal_found = cal_mask.any(axis=1)
+    xy[:, :4, :2] = np.where(cal_found[:, :, np.newaxis], bboxes[rows, cal_idx, :2], 0)
+
+    dart_mask = cls == 0
+    order = np.argsort(np.where(dart_mask, -rank, np.inf), axis=1, kind='stable')[:, :max_darts]
+    dart_found = dart_mask[rows, order]
+    n = order.shape[1]
+    xy[:, 4:4 + n, :2] = np.where(dart_found[:, :, np.newaxis], bboxes[rows, order, :2], 0)
+
+    xy[(xy[:, :, 0] > 0) & (xy[:, :, 1] > 0), -1] = 1
+    xy = batch_est_cal_pts(xy)
+    if not return_confidences:
         return xy
-    else:
-        xy = est_cal_pts(xy)
-    return xy
+    dart_conf = np.zeros((b, max_darts), dtype=np.float32)
+    dart_conf[:, :n] = np.where(dart_found, conf[rows, order], 0)
+    return xy, dart_conf
 
 
 def est_cal_pts(xy):
-    missing_idx = np.where(xy[:4, -1] == 0)[0]
-    if len(missing_idx) == 1:
-        if missing_idx[0] <= 1:
-            center = np.mean(xy[2:4, :2], axis=0)
-            xy[:, :2] -= center
-            if missing_idx[0] == 0:
-                xy[0, 0] = -xy[1, 0]
-                xy[0, 1] = -xy[1, 1]
-                xy[0, 2] = 1
-            else:
-                xy[1, 0] = -xy[0, 0]
-                xy[1, 1] = -xy[0, 1]
-                xy[1, 2] = 1
-            xy[:, :2] += center
-        else:
-            center = np.mean(xy[:2, :2], axis=0)
-            xy[:, :2] -= center
-            if missing_idx[0] == 2:
-                xy[2, 0] = -xy[3, 0]
-                xy[2, 1] = -xy[3, 1]
-                xy[2, 2] = 1
-            else:
-                xy[3, 0] = -xy[2, 0]
-                xy[3, 1] = -xy[2, 1]
-                xy[3, 2] = 1
-            xy[:, :2] += center
-    else:
-        # TODO: if len(missing_idx) > 1
-        print('Missed more than 1 calibration point')
+    return batch_est_cal_pts(xy[np.newaxis])[0]
+
+
+# Offsets of the 4 calibration points from the board center, as linear maps of the offset of
+# point 3 (index 2) in the face-on board: cal_1 = R(cal_3), cal_2 = -R(cal_3), cal_4 = -cal_3,
+# where R rotates by 90 degrees.
+_R = np.array([[0., -1.], [1., 0.]])
+_CAL_MAPS = np.stack([_R, -_R, np.eye(2), -np.eye(2)])
+_PARTNER = np.array([1, 0, 3, 2])  # opposite calibration point
+
+
+def batch_est_cal_pts(xy):
+    """Fill missing calibration points of (B, K, 3) keypoints in place.
+    One missing point is mirrored through the center of the opposite pair; two missing points
+    are recovered from the two known ones assuming the calibration points are 90 degrees apart
+    around the center. Boards with 3 or 4 missing points are left unchanged."""
+    missing = xy[:, :4, -1] == 0
+    n_missing = missing.sum(axis=1)
+
+    one = np.where(n_missing == 1)[0]
+    if len(one):
+        idx = np.argmax(missing[one], axis=1)
+        other_pair = np.where(idx <= 1, 2, 0)
+        center = (xy[one, other_pair, :2] + xy[one, other_pair + 1, :2]) / 2
+        xy[one, idx, :2] = 2 * center - xy[one, _PARTNER[idx], :2]
+        xy[one, idx, 2] = 1
+
+    two = np.where(n_missing == 2)[0]
+    if len(two):
+        known = np.argsort(missing[two], axis=1, kind='stable')[:, :2]  # (M, 2) known indices
+        i, j = known[:, 0], known[:, 1]
+        p_i = xy[two, i, :2].astype(np.float64)
+        p_j = xy[two, j, :2].astype(np.float64)
+        # p_k = c + T_k u for every k, so p_i - p_j = (T_i - T_j) u
+        u = np.linalg.solve(_CAL_MAPS[i] - _CAL_MAPS[j], (p_i - p_j)[:, :, np.newaxis])
+        center = p_i - np.matmul(_CAL_MAPS[i], u)[:, :, 0]
+        estimates = center[:, np.newaxis] + np.matmul(_CAL_MAPS[np.newaxis], u[:, np.newaxis])[..., 0]  # (M, 4, 2)
+        fill = missing[two]
+        xy[two, :4, :2] = np.where(fill[:, :, np.newaxis], estimates, xy[two, :4, :2])
+        xy[two, :4, 2] = 1
     return xy
 
 
+def read_rgb(path):
+    ti = time()
+    img = cv2.imread(path)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return img, time() - ti
+
+
+def decoded_batches(img_paths, batch_size, workers, prefetch=2):
+    """Yield (indices, rgb images, summed decode time) batches in order. With workers > 0 the
+    images are decoded in a thread pool, up to `prefetch` batches ahead of the consumer."""
+    starts = iter(range(0, len(img_paths), batch_size))
+    if workers <= 0:
+        for start in starts:
+            decoded = [read_rgb(p) for p in img_paths[start:start + batch_size]]
+            yield list(range(start, start + len(decoded))), [d[0] for d in decoded], sum(d[1] for d in decoded)
+        return
+
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+
+        def submit():
+            start = next(starts, None)
+            if start is not None:
+                pending.append((start, [pool.submit(read_rgb, p) for p in img_paths[start:start + batch_size]]))
+
+        for _ in range(prefetch):
+            submit()
+        while pending:
+            start, futures = pending.popleft()
+            decoded = [f.result() for f in futures]
+            submit()
+            yield list(range(start, start + len(decoded))), [d[0] for d in decoded], sum(d[1] for d in decoded)
+
+
+def predict_batched(backend, img_paths, max_darts=3, batch_size=16, workers=4, on_batch=None, nms_radius=0,
+                    bbox_size=None):
+    """Decode ahead in a thread pool, run the model on whole batches and map the outputs to
+    keypoints with batch_bboxes_to_xy, after postprocess.keypoint_nms when nms_radius > 0
+    (in box sizes of bbox_size, i.e. cfg.train.bbox_size).
+    on_batch(idx, imgs, preds) is called after each batch with its image indices, decoded images
+    and predictions. Returns the predictions and the time spent per stage."""
+    preds = np.zeros((len(img_paths), 4 + max_darts, 3))
+    timings = {'decode': 0., 'decode_wait': 0., 'inference': 0., 'postprocess': 0.}
+    batches = decoded_batches(img_paths, batch_size, workers)
+    warmed_up = False
+    ti = time()
+    while True:
+        t = time()
+        batch = next(batches, None)
+        timings['decode_wait'] += time() - t
+        if batch is None:
+            break
+        idx, imgs, decode_time = batch
+        timings['decode'] += decode_time
+
+        if not warmed_up:  # keep graph building / kernel selection out of the inference time
+            t = time()
+            backend.forward(imgs)
+            ti += time() - t
+            warmed_up = True
+
+        t = time()
+        candidates = backend.forward(imgs)
+        timings['inference'] += time() - t
+
+        t = time()
+        bboxes = backend.postprocess(candidates, imgs)
+        padded = pad_bboxes(bboxes)
+        if nms_radius > 0:
+            padded = keypoint_nms(padded, bbox_size, nms_radius)
+        preds[idx] = batch_bboxes_to_xy(padded, max_darts)
+        timings['postprocess'] += time() - t
+
+        if on_batch is not None:
+            on_batch(idx, imgs, preds[idx])
+    timings['total'] = time() - ti
+    return preds, timings
+
+
+def write_prediction(img, path, pred, gt, cfg, split, fail_cases=False):
+    write_dir = osp.join('./models', cfg.model.name, 'preds', split, path.split('/')[-2])
+    os.makedirs(write_dir, exist_ok=True)
+    xy = pred[pred[:, -1] == 1]
+    error = sum(get_dart_scores(pred[:, :2], cfg, numeric=True)) - sum(get_dart_scores(gt[:, :2], cfg, numeric=True))
+    if not fail_cases or (fail_cases and error != 0):
+        img = draw(cv2.cvtColor(img, cv2.COLOR_RGB2BGR), xy[:, :2], cfg, circles=False, score=True)
+        cv2.imwrite(osp.join(write_dir, path.split('/')[-1]), img)
+
+
 def predict(
         yolo,
         cfg,
@@ -68,7 +208,14 @@ def predict(
         dataset='d1',
         split='val',
         max_darts=3,
-        write=False):
+        write=False,
+        fail_cases=False,
+        batch_size=1,
+        workers=0,
+        nms_radius=0):
+
+    # imported here so that serve.py can use bboxes_to_xy without pulling in tensorflow
+    from dataloader import get_splits
 
     np.random.seed(0)
 
@@ -90,46 +237,55 @@ def predict(
     preds = np.zeros((len(img_paths), 4 + max_darts, 3))
     print('Making predictions with {}...'.format(cfg.model.name))
 
-    for i, p in enumerate(img_paths):
-        if i == 1:
-            ti = time()
-        img = cv2.imread(p)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-        bboxes = yolo.predict(img)
-        preds[i] = bboxes_to_xy(bboxes, max_darts)
-
-        if write:
-            write_dir = osp.join('./models', cfg.model.name, 'preds', split, p.split('/')[-2])
-            os.makedirs(write_dir, exist_ok=True)
-            xy = preds[i]
-            xy = xy[xy[:, -1] == 1]
-            error = sum(get_dart_scores(preds[i, :, :2], cfg, numeric=True)) - sum(get_dart_scores(xys[i, :, :2], cfg, numeric=True))
-            if not args.fail_cases or (args.fail_cases and error != 0):
-                img = draw(cv2.cvtColor(img, cv2.COLOR_RGB2BGR), xy[:, :2], cfg, circles=False, score=True)
-                cv2.imwrite(osp.join(write_dir, p.split('/')[-1]), img)
-
-    fps = (len(img_paths) - 1) / (time() - ti)
-    print('FPS: {:.2f}'.format(fps))
+    timings = None
+    if batch_size > 1 or workers > 0:
+        def write_batch(idx, imgs, batch_preds):
+            for i, img, pred in zip(idx, imgs, batch_preds):
+                write_prediction(img, img_paths[i], pred, xys[i], cfg, split, fail_cases)
 
-    ASE = []  # absolute score error
-    for pred, gt in zip(preds, xys):
-        ASE.append(abs(
-            sum(get_dart_scores(pred[:, :2], cfg, numeric=True)) -
-            sum(get_dart_scores(gt[:, :2], cfg, numeric=True))))
+        preds, timings = predict_batched(
+            TensorFlowBackend(cfg, yolo), img_paths, max_darts, batch_size, workers,
+            on_batch=write_batch if write else None, nms_radius=nms_radius, bbox_size=cfg.train.bbox_size)
+        fps = len(img_paths) / timings['total']
+    else:
+        for i, p in enumerate(img_paths):
+            if i == 1:
+                ti = time()
+            img = cv2.imread(p)
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+            bboxes = yolo.predict(img)
+            preds[i] = bboxes_to_xy(bboxes, max_darts, nms_radius, cfg.train.bbox_size)
+
+            if write:
+                write_prediction(img, p, preds[i], xys[i], cfg, split, fail_cases)
+
+        fps = (len(img_paths) - 1) / (time() - ti)
+    print('FPS: {:.2f}'.format(fps))
 
-    ASE = np.array(ASE)
+    t = time()
+    ASE = np.abs(score_darts(preds[:, :, :2], cfg).totals - score_darts(xys[:, :, :2], cfg).totals)  # absolute score error
+    scoring_time = time() - t
     PCS = len(ASE[ASE == 0]) / len(ASE) * 100
     MASE = np.mean(ASE)
 
     print('Percent Correct Score (PCS): {:.1f}%'.format(PCS))
     print('Mean Absolute Score Error (MASE): {:.2f}'.format(MASE))
+    if timings is not None:
+        timings['scoring'] = scoring_time
+        n = len(img_paths)
+        print('Throughput (images/s, batch size {}, {} decode workers):'.format(batch_size, workers))
+        print('  decode:      {:.1f} per worker, main thread waited {:.2f}s for decoded images'.format(
+            n / max(timings['decode'], 1e-9), timings['decode_wait']))
+        for stage in ['inference', 'postprocess', 'scoring']:
+            print('  {:<12} {:.1f}'.format(stage + ':', n / max(timings[stage], 1e-9)))
 
     results = {
         'img_paths': img_paths,
         'preds': preds,
         'gt': xys,
         'fps': fps,
+        'timings': timings,
         'ASE': ASE,
         'PCS': PCS,
         'MASE': MASE
@@ -146,6 +302,10 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--split', default='val')
     parser.add_argument('-w', '--write', action='store_true')
     parser.add_argument('-f', '--fail-cases', action='store_true')
+    parser.add_argument('-b', '--batch-size', type=int, default=1)
+    parser.add_argument('-j', '--workers', type=int, default=0, help='image decoding threads')
+    parser.add_argument('--nms-radius', type=float, default=0,
+                        help='merge same-class keypoints closer than this many train.bbox_size (0: off)')
     args = parser.parse_args()
 
     cfg = CN(new_allowed=True)
@@ -158,4 +318,8 @@ if __name__ == '__main__':
     predict(yolo, cfg,
             dataset=cfg.data.dataset,
             split=args.split,
-            write=args.write)
+            write=args.write,
+            fail_cases=args.fail_cases,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            nms_radius=args.nms_radius)
@@ -1,34 +1,141 @@
 """FastAPI server exposing dart detection predictions."""
+import asyncio
 import base64
+import functools
+import hashlib
+import importlib
+import json
 import logging
+import math
 import os
+import queue
 import re
 import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, ValidationError
 from yacs.config import CfgNode as CN
 
 os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
 
-from train import build_model  # noqa: E402
-from predict import bboxes_to_xy  # noqa: E402
-from dataset.annotate import get_dart_scores  # noqa: E402
+from backends import BACKEND_NAMES, create_backend  # noqa: E402
+from predict import batch_bboxes_to_xy, pad_bboxes  # noqa: E402
+from postprocess import keypoint_nms  # noqa: E402
+from dataset.annotate import DART_LABELS, DART_SCORES, DartScores, score_darts  # noqa: E402
+from metrics import BYTES_BUCKETS, CONFIDENCE_BUCKETS, CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry  # noqa: E402
+from sessions import BoardROI, BoardSession, MotionGate, SessionRegistry, uncrop_bboxes  # noqa: E402
+from tracking import DartTracker  # noqa: E402
 
 
 BASE_DIR = Path(__file__).resolve().parent
 DEFAULT_CFG_NAME = os.getenv("DEEP_DARTS_CONFIG", "deepdarts_d1")
 MAX_DARTS = int(os.getenv("DEEP_DARTS_MAX_DARTS", "3"))
+NMS_RADIUS = float(os.getenv("DEEP_DARTS_NMS_RADIUS", "0"))
+MIN_CONFIDENCE = float(os.getenv("DEEP_DARTS_MIN_CONFIDENCE", "0"))
+REFINE_KEYPOINTS = os.getenv("DEEP_DARTS_REFINE_KEYPOINTS", "1") == "1"
+MAX_BATCH_SIZE = max(1, int(os.getenv("DEEP_DARTS_MAX_BATCH_SIZE", "8")))
+MAX_BATCH_WAIT_MS = max(0.0, float(os.getenv("DEEP_DARTS_MAX_BATCH_WAIT_MS", "5")))
+PROCESS_WORKERS = max(0, int(os.getenv("DEEP_DARTS_PROCESS_WORKERS", "0")))
+SHM_SLOT_BYTES = int(os.getenv("DEEP_DARTS_SHM_SLOT_BYTES", str(1920 * 1080 * 3)))
+INTRA_OP_THREADS = int(os.getenv("DEEP_DARTS_INTRA_OP_THREADS", "0"))
+INTER_OP_THREADS = int(os.getenv("DEEP_DARTS_INTER_OP_THREADS", "1"))
+INFERENCE_WORKERS = max(1, int(os.getenv("DEEP_DARTS_INFERENCE_WORKERS", str(max(1, PROCESS_WORKERS)))))
+DECODE_WORKERS = max(1, int(os.getenv("DEEP_DARTS_DECODE_WORKERS", str(min(4, os.cpu_count() or 1)))))
+MAX_PENDING = max(1, int(os.getenv("DEEP_DARTS_MAX_PENDING", "64")))
+RESULT_CACHE_MB = max(0.0, float(os.getenv("DEEP_DARTS_RESULT_CACHE_MB", "16")))
+RESULT_CACHE_TTL_S = float(os.getenv("DEEP_DARTS_RESULT_CACHE_TTL_S", "300"))
+UNAVAILABLE_RETRY_AFTER_S = 30
+MODEL_NAMES = [
+    name.strip()
+    for name in os.getenv("DEEP_DARTS_MODELS", "").split(",")
+    if name.strip()
+] or sorted(path.stem for path in (BASE_DIR / "configs").glob("*.yaml"))
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("DEEP_DARTS_MODEL_MEMORY_MB", "0"))
+RELOAD_INTERVAL_S = float(os.getenv("DEEP_DARTS_RELOAD_INTERVAL_S", "0"))
+FAST_START = os.getenv("DEEP_DARTS_FAST_START", "0") == "1"
+WARMUP_BATCH_SIZES = sorted(
+    {int(size) for size in os.getenv("DEEP_DARTS_WARMUP_BATCH_SIZES", "").split(",") if size.strip()}
+    if "DEEP_DARTS_WARMUP_BATCH_SIZES" in os.environ
+    else set(range(1, MAX_BATCH_SIZE + 1))
+)
+# Modules whose import dominates a backend's cold start, timed separately at load.
+FRAMEWORK_MODULES = {"tensorflow": "train", "onnx": "onnxruntime"}
+BATCH_STATS_WINDOW = 1024
+BACKEND_NAME = os.getenv("DEEP_DARTS_BACKEND", "tensorflow").lower()
+SESSION_TTL_S = float(os.getenv("DEEP_DARTS_SESSION_TTL_S", "600"))
+MAX_SESSIONS = int(os.getenv("DEEP_DARTS_MAX_SESSIONS", "64"))
+CALIBRATION_TOLERANCE = float(os.getenv("DEEP_DARTS_CALIBRATION_TOLERANCE", "0.01"))
+MOTION_GATE = os.getenv("DEEP_DARTS_MOTION_GATE", "0") == "1"
+MOTION_SIZE = int(os.getenv("DEEP_DARTS_MOTION_SIZE", "128"))
+MOTION_PIXEL_THRESHOLD = int(os.getenv("DEEP_DARTS_MOTION_PIXEL_THRESHOLD", "15"))
+MOTION_AREA_THRESHOLD = float(os.getenv("DEEP_DARTS_MOTION_AREA_THRESHOLD", "0.0002"))
+BOARD_ROI = os.getenv("DEEP_DARTS_BOARD_ROI", "1") == "1"
+BOARD_ROI_MARGIN = float(os.getenv("DEEP_DARTS_BOARD_ROI_MARGIN", "1.1"))
+TRACK_CONFIRM_FRAMES = int(os.getenv("DEEP_DARTS_TRACK_CONFIRM_FRAMES", "2"))
+TRACK_MAX_MISSED = int(os.getenv("DEEP_DARTS_TRACK_MAX_MISSED", "5"))
+TRACK_MAX_DISTANCE = float(os.getenv("DEEP_DARTS_TRACK_MAX_DISTANCE", "0.02"))
+MAX_IMAGE_BYTES = int(os.getenv("DEEP_DARTS_MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
 DATA_URI_PATTERN = re.compile(r"^data:image/[^;]+;base64,(?P<data>.+)$", re.IGNORECASE)
+BOUNDARY_PATTERN = re.compile(r'boundary="?(?P<boundary>[^";]+)"?', re.IGNORECASE)
+MULTIPART_FIELD = "image"
+SERVER_TIMING = os.getenv("DEEP_DARTS_SERVER_TIMING", "0") == "1"
 LOGGER = logging.getLogger("deepdarts.serve")
 
+METRICS = Registry()
+REQUEST_SECONDS = METRICS.histogram(
+    "deepdarts_request_duration_seconds", "HTTP request latency.", ("method", "path", "status")
+)
+STAGE_SECONDS = METRICS.histogram(
+    "deepdarts_stage_duration_seconds",
+    "Time spent per pipeline stage. inference, postprocess and scoring are observed once per batch.",
+    ("stage",),
+)
+REQUEST_BYTES = METRICS.histogram("deepdarts_request_bytes", "Size of uploaded frames.", buckets=BYTES_BUCKETS)
+IMAGE_BYTES = METRICS.histogram("deepdarts_image_bytes", "Size of decoded frames.", buckets=BYTES_BUCKETS)
+BATCH_SIZE = METRICS.histogram("deepdarts_batch_size", "Frames per forward pass.", buckets=(1, 2, 4, 8, 16, 32, 64))
+DETECTIONS_PER_FRAME = METRICS.histogram(
+    "deepdarts_detections_per_frame", "Darts detected per frame.", buckets=tuple(range(MAX_DARTS + 1))
+)
+DETECTION_CONFIDENCE = METRICS.histogram(
+    "deepdarts_detection_confidence", "Confidence of detected darts.", buckets=CONFIDENCE_BUCKETS
+)
+INFERENCE_ERRORS = METRICS.counter("deepdarts_inference_errors_total", "Batches whose inference failed.")
+SKIPPED_FRAMES = METRICS.counter(
+    "deepdarts_frames_skipped_total", "WebSocket frames answered without inference by the motion gate."
+)
+REJECTED_REQUESTS = METRICS.counter(
+    "deepdarts_rejected_requests_total", "Requests refused by admission control.", ("reason",)
+)
+MODEL_LOAD_SECONDS = METRICS.gauge("deepdarts_model_load_seconds", "Duration of the last model load.")
+QUEUE_DEPTH = METRICS.gauge(
+    "deepdarts_queue_depth", "Frames waiting for the micro-batcher.", callback=lambda: models.queue_depth
+)
+PENDING_REQUESTS = METRICS.gauge(
+    "deepdarts_pending_requests", "Admitted /api/detect requests not answered yet.", callback=lambda: admission.pending
+)
+RESULT_CACHE_LOOKUPS = METRICS.counter(
+    "deepdarts_result_cache_lookups_total", "/api/detect result cache lookups.", ("result",)
+)
+RESULT_CACHE_BYTES = METRICS.gauge(
+    "deepdarts_result_cache_bytes",
+    "Estimated size of the cached /api/detect responses.",
+    callback=lambda: result_cache.size,
+)
+
 
 class DetectRequest(BaseModel):
     image: str
+    model: Optional[str] = None
 
 
 class DetectionResult(BaseModel):
@@ -41,74 +148,262 @@ class DetectionResult(BaseModel):
     sector: Optional[str]
     confidence: Optional[float]
     normalized: bool = True
+    trackId: Optional[int] = None
 
 
 class DetectionResponse(BaseModel):
     detections: List[DetectionResult]
+    model: Optional[str] = None
 
 
 class _ModelBundle:
-    def __init__(self) -> None:
+    """One model, loaded on first use and hot-swappable with ``reload``.
+
+    Inference checks the current backend out and back in, so a backend replaced by
+    ``reload`` or ``unload`` is only closed once the batches still using it are done.
+    """
+
+    def __init__(
+        self,
+        backend_name: str = BACKEND_NAME,
+        cfg_name: str = DEFAULT_CFG_NAME,
+        on_load: Optional[Callable[["_ModelBundle"], None]] = None,
+    ) -> None:
+        if backend_name not in BACKEND_NAMES:
+            raise ValueError(
+                f"DEEP_DARTS_BACKEND invalide: {backend_name}. Valeurs possibles: {', '.join(BACKEND_NAMES)}"
+            )
+        self.backend_name = backend_name
+        self.cfg_name = cfg_name
+        self.on_load = on_load
         self.model = None
         self.cfg: Optional[CN] = None
+        self.model_path: Optional[Path] = None
+        self.model_mtime: Optional[float] = None
+        self.size_bytes = 0
+        self.version = 0
+        self.load_breakdown: Dict[str, Any] = {}
         self.lock = threading.Lock()
+        self._refs_lock = threading.Lock()
+        self._refs: Dict[int, int] = {}
+        self._retired: List[Any] = []
+
+    def _resolve(self) -> Tuple[CN, Path]:
+        # The DEEP_DARTS_CONFIG_PATH / _MODEL_NAME / _WEIGHTS / _ONNX_PATH overrides only
+        # apply to the default model; the others follow the configs/ and models/ layout.
+        is_default = self.cfg_name == DEFAULT_CFG_NAME
+        cfg_path_env = os.getenv("DEEP_DARTS_CONFIG_PATH") if is_default else None
+        if cfg_path_env:
+            cfg_path = _resolve_path(Path(cfg_path_env))
+        else:
+            cfg_path = (BASE_DIR / "configs" / f"{self.cfg_name}.yaml").resolve()
+        if not cfg_path.exists():
+            raise FileNotFoundError(
+                f"Configuration introuvable: {cfg_path}. "
+                "Utilisez DEEP_DARTS_CONFIG_PATH pour spécifier le chemin correct."
+            )
+
+        cfg = CN(new_allowed=True)
+        cfg.merge_from_file(str(cfg_path))
+        model_name = (os.getenv("DEEP_DARTS_MODEL_NAME") if is_default else None) or self.cfg_name
+        cfg.model.name = model_name
+
+        if self.backend_name == "onnx":
+            return cfg, _resolve_onnx_path(model_name, use_env=is_default)
+        return cfg, _resolve_weights_path(cfg, model_name, use_env=is_default)
+
+    def _create(self, cfg: CN, model_path: Path) -> Any:
+        """Load and warm up a backend; ``load_breakdown`` receives where the time went."""
+        breakdown: Dict[str, Any] = {}
+        if not PROCESS_WORKERS:
+            started = time.perf_counter()
+            importlib.import_module(FRAMEWORK_MODULES[self.backend_name])
+            breakdown["frameworkImport"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        if PROCESS_WORKERS:
+            from workers import ProcessPoolBackend
+
+            model = ProcessPoolBackend(
+                self.backend_name,
+                cfg,
+                model_path,
+                PROCESS_WORKERS,
+                slots=MAX_BATCH_SIZE,
+                slot_bytes=SHM_SLOT_BYTES,
+                inter_op_threads=INTER_OP_THREADS,
+                intra_op_threads=INTRA_OP_THREADS or None,
+            )
+        else:
+            model = create_backend(self.backend_name, cfg, model_path)
+        breakdown["modelLoad"] = time.perf_counter() - started
+        MODEL_LOAD_SECONDS.set(breakdown["modelLoad"])
+
+        breakdown["warmup"] = _warm_up(model, cfg, WARMUP_BATCH_SIZES)
+        self.load_breakdown = breakdown
+        LOGGER.info(
+            "Modèle %s chargé depuis %s: import %.2f s, chargement %.2f s, préchauffage %.2f s (tailles %s)",
+            self.cfg_name,
+            model_path,
+            breakdown.get("frameworkImport", 0.0),
+            breakdown["modelLoad"],
+            sum(breakdown["warmup"].values()),
+            ", ".join(map(str, breakdown["warmup"])) or "aucune",
+        )
+        return model
+
+    def _install(self, model: Any, cfg: Optional[CN], model_path: Optional[Path]) -> None:
+        """Atomically replace the current backend; the old one is closed once unused."""
+        with self._refs_lock:
+            old, self.model, self.cfg = self.model, model, cfg
+            self.model_path = model_path
+            self.model_mtime = _model_mtime(model_path) if model_path is not None else None
+            self.size_bytes = _model_bytes(model_path) if model_path is not None else 0
+            if model is not None:
+                self.version += 1
+            idle = old is not None and id(old) not in self._refs
+            if old is not None and not idle:
+                self._retired.append(old)
+        if idle:
+            _close_backend(old)
 
     def load(self) -> None:
         with self.lock:
             if self.model is not None and self.cfg is not None:
                 return
+            cfg, model_path = self._resolve()
+            self._install(self._create(cfg, model_path), cfg, model_path)
+        if self.on_load is not None:
+            self.on_load(self)
 
-            cfg_path_env = os.getenv("DEEP_DARTS_CONFIG_PATH")
-            if cfg_path_env:
-                cfg_path = _resolve_path(Path(cfg_path_env))
-            else:
-                cfg_path = (BASE_DIR / "configs" / f"{DEFAULT_CFG_NAME}.yaml").resolve()
-            if not cfg_path.exists():
-                raise FileNotFoundError(
-                    f"Configuration introuvable: {cfg_path}. "
-                    "Utilisez DEEP_DARTS_CONFIG_PATH pour spécifier le chemin correct."
-                )
+    def reload(self, force: bool = False) -> bool:
+        """Load the current weights next to the running model and swap them in once ready.
 
-            cfg = CN(new_allowed=True)
-            cfg.merge_from_file(str(cfg_path))
-            model_name = os.getenv("DEEP_DARTS_MODEL_NAME") or DEFAULT_CFG_NAME
-            cfg.model.name = model_name
-
-            weights_env = os.getenv("DEEP_DARTS_WEIGHTS")
-            if weights_env:
-                weights_path = _resolve_path(Path(weights_env))
-            else:
-                weights_path = (BASE_DIR / "models" / model_name / "weights").resolve()
-                if not weights_path.exists() and getattr(cfg.model, "weights_path", ""):
-                    weights_path = _resolve_path(Path(cfg.model.weights_path))
-            if not weights_path.exists():
-                raise FileNotFoundError(
-                    f"Poids introuvables pour le modèle: {weights_path}. "
-                    "Téléchargez les poids DeepDarts et définissez DEEP_DARTS_WEIGHTS si nécessaire."
-                )
+        Returns ``False`` when the model is not loaded or its file did not change.
+        """
+        with self.lock:
+            if self.model is None:
+                return False
+            cfg, model_path = self._resolve()
+            if not force and model_path == self.model_path and _model_mtime(model_path) == self.model_mtime:
+                return False
+            self._install(self._create(cfg, model_path), cfg, model_path)
+            LOGGER.info("Modèle %s rechargé (version %d)", self.cfg_name, self.version)
+        if self.on_load is not None:
+            self.on_load(self)
+        return True
 
-            yolo = build_model(cfg)
-            yolo.load_weights(str(weights_path), cfg.model.weights_type)
+    def unload(self) -> None:
+        with self.lock:
+            self._install(None, None, None)
+
+    close = unload
 
-            self.model = yolo
-            self.cfg = cfg
+    @property
+    def loaded(self) -> bool:
+        return self.model is not None
 
-    def predict(self, image: np.ndarray) -> List[DetectionResult]:
+    def _checkout(self) -> Tuple[Any, CN]:
         if self.model is None or self.cfg is None:
             self.load()
-        assert self.model is not None
-        assert self.cfg is not None
+        with self._refs_lock:
+            model, cfg = self.model, self.cfg
+            if model is None or cfg is None:
+                raise RuntimeError(f"Le modèle {self.cfg_name} a été déchargé")
+            self._refs[id(model)] = self._refs.get(id(model), 0) + 1
+        return model, cfg
+
+    def _checkin(self, model: Any) -> None:
+        with self._refs_lock:
+            self._refs[id(model)] -= 1
+            if self._refs[id(model)]:
+                return
+            del self._refs[id(model)]
+            retired = any(model is old for old in self._retired)
+            if retired:
+                self._retired = [old for old in self._retired if old is not model]
+        if retired:
+            _close_backend(model)
 
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        raw_bboxes = self.model.predict(rgb_image)
-        bboxes = _ensure_2d_array(raw_bboxes)
-        xy = bboxes_to_xy(bboxes, max_darts=MAX_DARTS)
+    def predict(self, image: np.ndarray, session: Optional[BoardSession] = None) -> List[DetectionResult]:
+        return self.predict_batch([image], [session])[0]
 
-        dart_rows = bboxes[bboxes[:, 4] == 0][:MAX_DARTS] if bboxes.size else np.zeros((0, 5))
-        confidences = _extract_confidences(dart_rows)
+    def predict_batch(
+        self,
+        images: List[np.ndarray],
+        sessions: Optional[List[Optional[BoardSession]]] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> List[List[DetectionResult]]:
+        """Detections for each BGR frame. ``timings`` receives the seconds spent per stage.
 
-        labels = get_dart_scores(xy.copy(), self.cfg, numeric=False)
-        numeric_scores = get_dart_scores(xy.copy(), self.cfg, numeric=True)
+        Frames of sessions with a board ROI are cropped to it before inference; the
+        detections are mapped back onto the full frame.
+        """
+        sessions = sessions or [None] * len(images)
+        crops = [
+            session.crop(image) if session is not None else (image, None) for image, session in zip(images, sessions)
+        ]
+        model, cfg = self._checkout()
+        try:
+            started = time.perf_counter()
+            # BGR to RGB happens while the backend fills its input tensor.
+            bgr_images = [crop for crop, _ in crops]
+            candidates = model.forward(bgr_images, bgr=True)
+            inferred = time.perf_counter()
+            raw_bboxes = [
+                uncrop_bboxes(_ensure_2d_array(bboxes), box)
+                for bboxes, (_, box) in zip(model.postprocess(candidates, bgr_images), crops)
+            ]
+        finally:
+            self._checkin(model)
+        padded = pad_bboxes(raw_bboxes)
+        if NMS_RADIUS > 0 or MIN_CONFIDENCE > 0:
+            # cfg.train.bbox_size in full-frame units: boxes of ROI crops were scaled by the crop
+            box_size = cfg.train.bbox_size * np.array(
+                [[1.0, 1.0] if box is None else [box[2] - box[0], box[3] - box[1]] for _, box in crops]
+            )
+            padded = keypoint_nms(padded, box_size, NMS_RADIUS, MIN_CONFIDENCE, REFINE_KEYPOINTS)
+        xys, dart_confidences = batch_bboxes_to_xy(padded, MAX_DARTS, return_confidences=True)
+        postprocessed = time.perf_counter()
+        geometries = [
+            session.board_geometry(xy, cfg, _detected_calibration(bboxes)) if session is not None else None
+            for xy, bboxes, session in zip(xys, raw_bboxes, sessions)
+        ]
+        scores = score_darts(xys, cfg, geometry=geometries)  # all frames at once
+        results = [
+            self._to_detections(xy, confidences, scores, frame)
+            for frame, (xy, confidences) in enumerate(zip(xys, dart_confidences))
+        ]
+        for image, bboxes, session in zip(images, raw_bboxes, sessions):
+            if session is not None:
+                session.update_roi(_detected_calibration(bboxes), image.shape, cfg)
+        scored = time.perf_counter()
+
+        stages = {
+            "inference": inferred - started,
+            "postprocess": postprocessed - inferred,
+            "scoring": scored - postprocessed,
+        }
+        for stage, seconds in stages.items():
+            STAGE_SECONDS.observe(seconds, stage=stage)
+        for detections in results:
+            DETECTIONS_PER_FRAME.observe(len(detections))
+            for detection in detections:
+                if detection.confidence is not None:
+                    DETECTION_CONFIDENCE.observe(detection.confidence)
+        if timings is not None:
+            timings.update(stages)
+        return results
+
+    def _to_detections(
+        self,
+        xy: np.ndarray,
+        dart_confidences: np.ndarray,
+        scores: DartScores,
+        frame: int,
+    ) -> List[DetectionResult]:
+        """Detections of frame ``frame`` of the batch, whose darts ``scores`` holds."""
+        confidences = _extract_confidences(dart_confidences)
 
         detections: List[DetectionResult] = []
         for idx in range(MAX_DARTS):
@@ -116,10 +411,8 @@ class _ModelBundle:
             if visibility <= 0:
                 continue
 
-            label = labels[idx] if idx < len(labels) else None
-            numeric_score = numeric_scores[idx] if idx < len(numeric_scores) else None
-            parsed = _parse_score_label(label, numeric_score)
-            confidence = confidences[idx] if idx < len(confidences) else None
+            parsed = _SCORE_FIELDS[scores.codes[frame, idx]] if scores.valid[frame] else _UNSCORED_FIELDS
+            confidence = confidences[idx]
 
             detections.append(
                 DetectionResult(
@@ -137,14 +430,474 @@ class _ModelBundle:
         return detections
 
 
-def _extract_confidences(dart_rows: np.ndarray) -> List[Optional[float]]:
-    if dart_rows.size == 0:
-        return []
-    if dart_rows.shape[1] > 5:
-        confidences = dart_rows[:, 5]
+class _PendingFrame:
+    __slots__ = ("image", "session", "timings", "future", "enqueued_at")
+
+    def __init__(
+        self,
+        image: np.ndarray,
+        session: Optional[BoardSession] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> None:
+        self.image = image
+        self.session = session
+        self.timings = timings if timings is not None else {}
+        self.future: "Future[List[DetectionResult]]" = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class _BatchStats:
+    """Rolling per-batch size and latency figures used to tune the batching window."""
+
+    def __init__(self, window: int = BATCH_STATS_WINDOW) -> None:
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.frames = 0
+        self.errors = 0
+        self.size_histogram: Dict[int, int] = {}
+        self.recent: Deque[Tuple[int, float, float]] = deque(maxlen=window)
+
+    def record(self, size: int, wait_ms: float, forward_ms: float, failed: bool = False) -> None:
+        with self.lock:
+            self.batches += 1
+            self.frames += size
+            self.errors += int(failed)
+            self.size_histogram[size] = self.size_histogram.get(size, 0) + 1
+            self.recent.append((size, wait_ms, forward_ms))
+
+    def mean_forward_ms(self) -> Optional[float]:
+        with self.lock:
+            if not self.recent:
+                return None
+            return sum(forward_ms for _, _, forward_ms in self.recent) / len(self.recent)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            recent = np.array(self.recent, dtype=np.float64).reshape((-1, 3))
+            snapshot: Dict[str, Any] = {
+                "batches": self.batches,
+                "frames": self.frames,
+                "errors": self.errors,
+                "sizeHistogram": {str(k): v for k, v in sorted(self.size_histogram.items())},
+            }
+        if len(recent):
+            snapshot["meanBatchSize"] = float(recent[:, 0].mean())
+            for name, column in (("queueWaitMs", 1), ("forwardMs", 2)):
+                snapshot[name] = {
+                    "p50": float(np.percentile(recent[:, column], 50)),
+                    "p95": float(np.percentile(recent[:, column], 95)),
+                    "max": float(recent[:, column].max()),
+                }
+        return snapshot
+
+
+class _MicroBatcher:
+    """Coalesces concurrent frames into a single NHWC forward pass.
+
+    A batch is flushed as soon as it holds ``max_batch_size`` frames or when the oldest
+    frame has waited ``max_wait_ms``, whichever comes first. ``workers`` threads run
+    batches concurrently, which bounds how many forward passes compete for the model.
+    At most ``max_queue`` frames wait; ``submit`` raises ``queue.Full`` beyond that.
+    """
+
+    def __init__(
+        self,
+        model_bundle: _ModelBundle,
+        max_batch_size: int,
+        max_wait_ms: float,
+        workers: int = 1,
+        max_queue: int = 0,
+    ) -> None:
+        self.bundle = model_bundle
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = workers
+        self.max_queue = max_queue
+        self.stats = _BatchStats()
+        self._queue: "queue.Queue[Optional[_PendingFrame]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if any(thread.is_alive() for thread in self._threads):
+                return
+            self._threads = [
+                threading.Thread(target=self._run, name=f"deepdarts-batcher-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have been processed, at least 1."""
+        forward_ms = self.stats.mean_forward_ms() or 100.0
+        batches = math.ceil((self.queue_depth + 1) / self.max_batch_size / self.workers)
+        return max(1, math.ceil(batches * forward_ms / 1000.0))
+
+    def submit(
+        self,
+        image: np.ndarray,
+        session: Optional[BoardSession] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> "Future[List[DetectionResult]]":
+        """Queue a frame. ``timings`` is filled with the per-stage seconds before the future resolves."""
+        self.start()
+        if self.max_queue and self._queue.qsize() >= self.max_queue:
+            raise queue.Full
+        pending = _PendingFrame(image, session, timings)
+        self._queue.put(pending)
+        return pending.future
+
+    def predict(self, image: np.ndarray, session: Optional[BoardSession] = None) -> List[DetectionResult]:
+        return self.submit(image, session).result()
+
+    def _collect(self, first: _PendingFrame) -> Tuple[List[_PendingFrame], bool]:
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                pending = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending is None:
+                return batch, True
+            batch.append(pending)
+        return batch, False
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stopping = self._collect(first)
+            self._process(batch)
+
+    def _process(self, batch: List[_PendingFrame]) -> None:
+        started = time.perf_counter()
+        wait_ms = (started - batch[0].enqueued_at) * 1000.0
+        BATCH_SIZE.observe(len(batch))
+        for pending in batch:
+            pending.timings["queue"] = started - pending.enqueued_at
+            STAGE_SECONDS.observe(pending.timings["queue"], stage="queue")
+        timings: Dict[str, float] = {}
+        try:
+            results = self.bundle.predict_batch(
+                [pending.image for pending in batch], [pending.session for pending in batch], timings
+            )
+        except Exception as error:
+            INFERENCE_ERRORS.inc()
+            self.stats.record(len(batch), wait_ms, (time.perf_counter() - started) * 1000.0, failed=True)
+            for pending in batch:
+                pending.future.set_exception(error)
+            return
+
+        forward_ms = (time.perf_counter() - started) * 1000.0
+        self.stats.record(len(batch), wait_ms, forward_ms)
+        LOGGER.debug("Batch de %d images traité en %.1f ms (attente %.1f ms)", len(batch), forward_ms, wait_ms)
+        for pending, detections in zip(batch, results):
+            pending.timings.update(timings)
+            pending.future.set_result(detections)
+
+
+class _ModelRegistry:
+    """Model bundles and their micro-batchers keyed by config name, in least recently used order.
+
+    Models are loaded on first use. Once the loaded models exceed ``memory_budget`` bytes
+    (estimated from their size on disk, 0 disables the limit) the least recently used
+    ones are unloaded; their batchers stay up and load them again on demand. With a
+    ``reload_interval``, loaded models whose weights changed on disk are reloaded in the
+    background and swapped in atomically.
+    """
+
+    def __init__(self, names: List[str], default: str, memory_budget: int = 0, reload_interval: float = 0.0) -> None:
+        self.names = sorted(set(names) | {default})
+        self.default = default
+        self.memory_budget = memory_budget
+        self.reload_interval = reload_interval
+        self._entries: "OrderedDict[str, Tuple[_ModelBundle, _MicroBatcher]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    def get(self, name: Optional[str] = None) -> Tuple[_ModelBundle, _MicroBatcher]:
+        """Bundle and batcher of ``name`` (the default model when empty); ``KeyError`` if unknown."""
+        name = name or self.default
+        if name not in self.names:
+            raise KeyError(name)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                model_bundle = _ModelBundle(cfg_name=name, on_load=self._enforce_budget)
+                model_batcher = _MicroBatcher(
+                    model_bundle, MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS, INFERENCE_WORKERS, MAX_PENDING
+                )
+                entry = self._entries[name] = (model_bundle, model_batcher)
+            self._entries.move_to_end(name)
+        return entry
+
+    def entries(self) -> List[Tuple[_ModelBundle, _MicroBatcher]]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def _enforce_budget(self, keep: _ModelBundle) -> None:
+        if not self.memory_budget:
+            return
+        with self._lock:
+            loaded = [b for b, _ in self._entries.values() if b.loaded]
+            total = sum(b.size_bytes for b in loaded)
+            evicted = []
+            for candidate in loaded:  # least recently used first
+                if total <= self.memory_budget:
+                    break
+                if candidate is not keep:
+                    evicted.append(candidate)
+                    total -= candidate.size_bytes
+        for candidate in evicted:
+            LOGGER.info("Modèle %s déchargé (budget mémoire dépassé)", candidate.cfg_name)
+            candidate.unload()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(b.queue_depth for _, b in self.entries())
+
+    def start(self) -> None:
+        for _, model_batcher in self.entries():
+            model_batcher.start()
+        if self.reload_interval > 0 and self._watcher is None:
+            self._stopping.clear()
+            self._watcher = threading.Thread(target=self._watch, name="deepdarts-reload", daemon=True)
+            self._watcher.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+        for model_bundle, model_batcher in self.entries():
+            model_batcher.stop()
+            model_bundle.close()
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(self.reload_interval):
+            for model_bundle, _ in self.entries():
+                try:
+                    model_bundle.reload()
+                except Exception as error:
+                    LOGGER.warning("Rechargement du modèle %s impossible: %s", model_bundle.cfg_name, error)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "name": model_bundle.cfg_name,
+                "loaded": model_bundle.loaded,
+                "version": model_bundle.version,
+                "modelPath": str(model_bundle.model_path) if model_bundle.model_path else None,
+                "sizeBytes": model_bundle.size_bytes,
+                "queueDepth": model_batcher.queue_depth,
+            }
+            for model_bundle, model_batcher in self.entries()
+        ]
+
+
+class _Admission:
+    """Counts admitted requests so that overload is refused up front instead of queued.
+
+    Only touched from the event loop, so no lock is needed.
+    """
+
+    def __init__(self, max_pending: int) -> None:
+        self.max_pending = max_pending
+        self.pending = 0
+
+    def try_acquire(self) -> bool:
+        if self.pending >= self.max_pending:
+            return False
+        self.pending += 1
+        return True
+
+    def release(self) -> None:
+        self.pending -= 1
+
+
+class _ResultCache:
+    """``/api/detect`` responses keyed by a BLAKE2b digest of the uploaded image, see ``_cache_payload``.
+
+    Entries remember the bundle and model version they were computed with, so a reload
+    invalidates them. The least recently used entries are dropped once the serialized
+    responses exceed ``max_bytes``; entries older than ``ttl`` seconds are ignored.
+    Only touched from the event loop, so no lock is needed.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Tuple[DetectionResponse, _ModelBundle, int, float, int]]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(body: bytes, model: Optional[str]) -> bytes:
+        digest = hashlib.blake2b(body, digest_size=16)
+        digest.update(b"\0" + (model or "").encode())
+        return digest.digest()
+
+    def get(self, key: bytes) -> Optional[DetectionResponse]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            response, model_bundle, version, stored_at, _ = entry
+            if model_bundle.version == version and time.monotonic() - stored_at <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                RESULT_CACHE_LOOKUPS.inc(result="hit")
+                return response
+            self._pop(key)
+        self.misses += 1
+        RESULT_CACHE_LOOKUPS.inc(result="miss")
+        return None
+
+    def put(self, key: bytes, response: DetectionResponse, model_bundle: "_ModelBundle", version: int) -> None:
+        size = len(key) + len(response.model_dump_json())
+        if size > self.max_bytes:
+            return
+        self._pop(key)
+        self._entries[key] = (response, model_bundle, version, time.monotonic(), size)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+
+    def _pop(self, key: bytes) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[4]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "sizeBytes": self.size,
+            "maxBytes": self.max_bytes,
+            "ttlSeconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else None,
+        }
+
+
+def _detected_calibration(bboxes: np.ndarray) -> np.ndarray:
+    """Which of the 4 calibration classes the detector found, as opposed to estimated points."""
+    return np.isin(np.arange(1, 5), bboxes[:, 4]) if bboxes.size else np.zeros(4, dtype=bool)
+
+
+def _extract_confidences(confidences: np.ndarray) -> List[Optional[float]]:
+    # NaN marks YOLO outputs without a probability column.
+    return [None if np.isnan(c) else float(max(0.0, min(1.0, float(c)))) for c in confidences]
+
+
+def _resolve_weights_path(cfg: CN, model_name: str, use_env: bool = True) -> Path:
+    weights_env = os.getenv("DEEP_DARTS_WEIGHTS") if use_env else None
+    if weights_env:
+        weights_path = _resolve_path(Path(weights_env))
     else:
-        return []
-    return [float(max(0.0, min(1.0, float(c)))) for c in confidences]
+        weights_path = (BASE_DIR / "models" / model_name / "weights").resolve()
+        if not weights_path.exists() and getattr(cfg.model, "weights_path", ""):
+            weights_path = _resolve_path(Path(cfg.model.weights_path))
+    if not weights_path.exists():
+        raise FileNotFoundError(
+            f"Poids introuvables pour le modèle: {weights_path}. "
+            "Téléchargez les poids DeepDarts et définissez DEEP_DARTS_WEIGHTS si nécessaire."
+        )
+    return weights_path
+
+
+def _resolve_onnx_path(model_name: str, use_env: bool = True) -> Path:
+    onnx_env = os.getenv("DEEP_DARTS_ONNX_PATH") if use_env else None
+    if onnx_env:
+        candidates = [_resolve_path(Path(onnx_env))]
+    else:
+        # Default output locations of export_to_onnx.py.
+        candidates = [
+            _resolve_path(Path("exports") / f"{model_name}.onnx"),
+            _resolve_path(Path("exports") / "deepdarts.onnx"),
+        ]
+    for candidate in candidates:
+        if candidate.exists():
+            return candidate
+    raise FileNotFoundError(
+        f"Modèle ONNX introuvable: {candidates[0]}. "
+        "Exportez-le avec export_to_onnx.py et définissez DEEP_DARTS_ONNX_PATH si nécessaire."
+    )
+
+
+def _model_files(path: Path) -> List[Path]:
+    """Files making up a model: a directory, a single file or a TF checkpoint prefix."""
+    if path.is_dir():
+        return [p for p in path.rglob("*") if p.is_file()]
+    files = [p for p in path.parent.glob(f"{path.name}.*") if p.is_file()]
+    return files + [path] if path.is_file() else files
+
+
+def _model_mtime(path: Path) -> Optional[float]:
+    return max((p.stat().st_mtime for p in _model_files(path)), default=None)
+
+
+def _model_bytes(path: Path) -> int:
+    """On-disk size of the model, used as an estimate of its memory footprint."""
+    return sum(p.stat().st_size for p in _model_files(path))
+
+
+def _process_age() -> Optional[float]:
+    """Seconds since this process started, or ``None`` where ``/proc`` is unavailable."""
+    try:
+        with open("/proc/self/stat") as handle:
+            start_ticks = float(handle.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as handle:
+            uptime = float(handle.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def _warm_up(model: Any, cfg: CN, batch_sizes: List[int]) -> Dict[int, float]:
+    """Run one blank batch of each size so that graph tracing and kernel selection happen
+    before the model serves traffic. Returns the seconds spent per batch size.
+    Backends with their own ``warm_up`` (the process pool) warm every worker with it."""
+    if hasattr(model, "warm_up"):
+        return model.warm_up(batch_sizes)
+    size = int(cfg.model.input_size)
+    frame = np.zeros((size, size, 3), dtype=np.uint8)
+    timings: Dict[int, float] = {}
+    for batch_size in batch_sizes:
+        started = time.perf_counter()
+        images = [frame] * batch_size
+        model.postprocess(model.forward(images), images)
+        timings[batch_size] = time.perf_counter() - started
+    return timings
+
+
+def _close_backend(model: Any) -> None:
+    if hasattr(model, "close"):
+        model.close()
 
 
 def _resolve_path(path: Path) -> Path:
@@ -236,6 +989,11 @@ def _parse_score_label(label: Optional[str], numeric_score: Optional[float]) ->
     }
 
 
+# _parse_score_label output for every label code of score_darts.
+_SCORE_FIELDS = [_parse_score_label(label, float(score)) for label, score in zip(DART_LABELS, DART_SCORES)]
+_UNSCORED_FIELDS = _parse_score_label(None, None)
+
+
 def _decode_image(data: str) -> np.ndarray:
     match = DATA_URI_PATTERN.match(data)
     if match:
@@ -244,40 +1002,484 @@ def _decode_image(data: str) -> np.ndarray:
         image_bytes = base64.b64decode(data)
     except (ValueError, TypeError) as exc:
         raise HTTPException(status_code=400, detail="Image base64 invalide") from exc
+    return _decode_image_bytes(image_bytes)
+
 
-    np_buffer = np.frombuffer(image_bytes, dtype=np.uint8)
-    image = cv2.imdecode(np_buffer, cv2.IMREAD_COLOR)
+def _decode_image_bytes(buffer: Any) -> np.ndarray:
+    # np.frombuffer only wraps ``buffer`` (bytes or memoryview), cv2.imdecode reads it in place.
+    np_buffer = np.frombuffer(buffer, dtype=np.uint8)
+    image = cv2.imdecode(np_buffer, cv2.IMREAD_COLOR) if np_buffer.size else None
     if image is None:
         raise HTTPException(status_code=400, detail="Impossible de décoder l'image fournie")
     return image
 
 
-bundle = _ModelBundle()
+def _multipart_image(body: bytes, content_type: str) -> memoryview:
+    """Return a view on the ``image`` part of a multipart body without copying it.
+
+    Falls back to the first part carrying a filename when no field is named ``image``.
+    """
+    match = BOUNDARY_PATTERN.search(content_type)
+    if not match:
+        raise HTTPException(status_code=400, detail="Frontière multipart manquante")
+    delimiter = b"--" + match.group("boundary").encode("latin-1")
+
+    fallback: Optional[memoryview] = None
+    view = memoryview(body)
+    position = body.find(delimiter)
+    while position != -1:
+        headers_start = position + len(delimiter) + 2  # skip CRLF after the delimiter
+        if body[position + len(delimiter):position + len(delimiter) + 2] == b"--":
+            break
+        headers_end = body.find(b"\r\n\r\n", headers_start)
+        if headers_end == -1:
+            break
+        next_position = body.find(b"\r\n" + delimiter, headers_end)
+        if next_position == -1:
+            break
+        headers = body[headers_start:headers_end].decode("latin-1").lower()
+        part = view[headers_end + 4:next_position]
+        if f'name="{MULTIPART_FIELD}"' in headers:
+            return part
+        if fallback is None and "filename=" in headers:
+            fallback = part
+        position = next_position + 2
+
+    if fallback is None:
+        raise HTTPException(status_code=400, detail=f"Champ multipart '{MULTIPART_FIELD}' manquant")
+    return fallback
+
+
+def _timed_decode(decode: Any, body: Any, *args: Any, timings: Dict[str, float]) -> Any:
+    """Run ``decode(body, *args)`` and record its duration and the payload/frame sizes.
+
+    ``decode`` returns the frame, or a tuple whose first item is the frame.
+    """
+    REQUEST_BYTES.observe(len(body))
+    started = time.perf_counter()
+    try:
+        result = decode(body, *args)
+    finally:
+        timings["decode"] = time.perf_counter() - started
+        STAGE_SECONDS.observe(timings["decode"], stage="decode")
+    IMAGE_BYTES.observe((result[0] if isinstance(result, tuple) else result).nbytes)
+    return result
+
+
+async def _decode_in_pool(decode: Any, body: Any, *args: Any, timings: Dict[str, float]) -> Any:
+    """``_timed_decode`` on the bounded decode pool, keeping the event loop free."""
+    loop = asyncio.get_running_loop()
+    decode = functools.partial(_timed_decode, decode, body, *args, timings=timings)
+    return await loop.run_in_executor(decode_pool, decode)
+
+
+def _overloaded(reason: str, target: Optional["_MicroBatcher"] = None) -> HTTPException:
+    REJECTED_REQUESTS.inc(reason=reason)
+    return HTTPException(
+        status_code=429,
+        detail="Serveur surchargé, réessayez plus tard",
+        headers={"Retry-After": str((target or batcher).retry_after())},
+    )
+
+
+def _model_entry(name: Optional[str]) -> Tuple["_ModelBundle", "_MicroBatcher"]:
+    try:
+        return models.get(name)
+    except KeyError:
+        raise HTTPException(
+            status_code=404, detail=f"Modèle inconnu: {name}. Modèles disponibles: {', '.join(models.names)}"
+        )
+
+
+def _server_timing(timings: Dict[str, float], total: float) -> str:
+    metrics = [f"{stage};dur={seconds * 1000.0:.2f}" for stage, seconds in timings.items()]
+    return ", ".join(metrics + [f"total;dur={total * 1000.0:.2f}"])
+
+
+def _decode_stream_frame(body: bytes, motion: Optional[MotionGate]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Decoded WebSocket frame and, when the session has a motion gate, its thumbnail."""
+    image = _decode_image_bytes(body)
+    return image, motion.thumbnail(image) if motion is not None else None
+
+
+def _image_from_body(body: bytes, content_type: str) -> np.ndarray:
+    """Decode the frame of an ``/api/detect`` body according to its content type."""
+    return _parse_detect_body(body, content_type)[0]
+
+
+def _cache_payload(body: bytes, content_type: str) -> Any:
+    """The bytes ``/api/detect`` responses are cached by: the image part of multipart bodies,
+    whose boundary is random per request, and the whole body otherwise."""
+    if content_type.split(";", 1)[0].strip().lower() == "multipart/form-data":
+        return _multipart_image(body, content_type)
+    return body
+
+
+def _parse_detect_body(body: bytes, content_type: str) -> Tuple[np.ndarray, Optional[str]]:
+    """Frame and, for JSON bodies, the requested model of an ``/api/detect`` body."""
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if media_type.startswith("image/") or media_type == "application/octet-stream":
+        return _decode_image_bytes(body), None
+    if media_type == "multipart/form-data":
+        return _decode_image_bytes(_multipart_image(body, content_type)), None
+    if media_type in ("", "application/json"):
+        try:
+            payload = DetectRequest(**json.loads(body))
+        except (ValueError, TypeError, ValidationError) as exc:
+            raise HTTPException(status_code=422, detail="Corps JSON invalide, attendu {\"image\": \"...\"}") from exc
+        if not payload.image:
+            raise HTTPException(status_code=400, detail="Le champ 'image' est requis")
+        return _decode_image(payload.image), payload.model
+    raise HTTPException(status_code=415, detail=f"Type de contenu non supporté: {media_type}")
+
+
+class _Startup:
+    """Readiness of the default model, reported by ``/readyz``."""
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.ready = False
+        self.error: Optional[str] = None
+        self.breakdown: Dict[str, Any] = {}
+
+    def prepare(self, model_bundle: "_ModelBundle") -> None:
+        """Load and warm up ``model_bundle``, then log the startup time breakdown."""
+        begin = time.perf_counter()
+        before_load = _process_age()
+        try:
+            model_bundle.load()
+        except FileNotFoundError as error:
+            # Différer l'erreur à la première requête tout en journalisant l'information.
+            self.error = str(error)
+            LOGGER.warning("Initialisation différée du modèle: %s", error)
+            return
+        except Exception as error:
+            self.error = f"{type(error).__name__}: {error}"
+            LOGGER.exception("Échec du chargement du modèle")
+            return
+        # Interpreter start and module imports are only known on Linux, through the process age.
+        before_load = before_load if before_load is not None else begin - self.started_at
+        self.breakdown = {
+            "beforeLoad": before_load,
+            **model_bundle.load_breakdown,
+            "total": before_load + time.perf_counter() - begin,
+        }
+        self.ready = True
+        LOGGER.info(
+            "Serveur prêt en %.2f s (démarrage et imports %.2f s, import du framework %.2f s, "
+            "chargement %.2f s, préchauffage %.2f s)",
+            self.breakdown["total"],
+            self.breakdown["beforeLoad"],
+            self.breakdown.get("frameworkImport", 0.0),
+            self.breakdown.get("modelLoad", 0.0),
+            sum(self.breakdown.get("warmup", {}).values()),
+        )
+
+
+startup = _Startup()
+models = _ModelRegistry(MODEL_NAMES, DEFAULT_CFG_NAME, int(MODEL_MEMORY_BUDGET_MB * 1024 * 1024), RELOAD_INTERVAL_S)
+bundle, batcher = models.get()
+admission = _Admission(MAX_PENDING)
+result_cache = _ResultCache(int(RESULT_CACHE_MB * 1024 * 1024), RESULT_CACHE_TTL_S)
+decode_pool = ThreadPoolExecutor(DECODE_WORKERS, thread_name_prefix="deepdarts-decode")
+sessions = SessionRegistry(
+    SESSION_TTL_S,
+    MAX_SESSIONS,
+    CALIBRATION_TOLERANCE,
+    functools.partial(MotionGate, MOTION_SIZE, MOTION_PIXEL_THRESHOLD, MOTION_AREA_THRESHOLD) if MOTION_GATE else None,
+    functools.partial(BoardROI, BOARD_ROI_MARGIN) if BOARD_ROI else None,
+    functools.partial(DartTracker, TRACK_CONFIRM_FRAMES, TRACK_MAX_MISSED, TRACK_MAX_DISTANCE)
+    if TRACK_CONFIRM_FRAMES > 0
+    else None,
+)
 app = FastAPI(title="DeepDarts Detection API", version="1.0.0")
 
 
+@app.middleware("http")
+async def _record_request(request: Request, call_next: Any) -> Any:
+    """Request latency histogram and, with DEEP_DARTS_SERVER_TIMING=1, a Server-Timing header."""
+    started = time.perf_counter()
+    request.state.timings = {}
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(
+        elapsed, method=request.method, path=getattr(route, "path", "unmatched"), status=str(response.status_code)
+    )
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = _server_timing(request.state.timings, elapsed)
+    return response
+
+
 @app.on_event("startup")
 def _load_on_startup() -> None:
+    models.start()
+    if FAST_START:
+        # Bind right away; /readyz reports when the model is loaded and warmed up.
+        threading.Thread(target=startup.prepare, args=(bundle,), name="deepdarts-loader", daemon=True).start()
+    else:
+        startup.prepare(bundle)
+
+
+@app.on_event("shutdown")
+def _stop_batcher() -> None:
+    models.stop()
+
+
+_DETECT_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "application/json": {
+            "schema": {"type": "object", "properties": {"image": {"type": "string"}}, "required": ["image"]}
+        },
+        "image/jpeg": {"schema": {"type": "string", "format": "binary"}},
+        "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {MULTIPART_FIELD: {"type": "string", "format": "binary"}},
+                "required": [MULTIPART_FIELD],
+            }
+        },
+    },
+}
+
+
+@app.post(
+    "/api/detect",
+    response_model=DetectionResponse,
+    openapi_extra={"requestBody": _DETECT_REQUEST_BODY},
+)
+async def detect_darts(request: Request, model: Optional[str] = None) -> DetectionResponse:
+    """Detect darts in one frame. ``model`` (query parameter or JSON field) picks the
+    configuration, e.g. ``deepdarts_d2`` for angled boards; the default model otherwise.
+
+    Resubmitting the same bytes returns the cached response without decoding the frame."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail="Image trop volumineuse")
+    if not admission.try_acquire():
+        raise _overloaded("pending")
     try:
-        bundle.load()
-    except FileNotFoundError as error:
-        # Différer l'erreur à la première requête tout en journalisant l'information.
-        LOGGER.warning("Initialisation différée du modèle: %s", error)
+        body = await request.body()
+        if len(body) > MAX_IMAGE_BYTES:
+            raise HTTPException(status_code=413, detail="Image trop volumineuse")
+        if not body:
+            raise HTTPException(status_code=400, detail="Le champ 'image' est requis")
+
+        content_type = request.headers.get("content-type", "")
+        cache_key = None
+        if result_cache.enabled:
+            cache_key = result_cache.key(_cache_payload(body, content_type), model)
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        timings = request.state.timings
+        image, body_model = await _decode_in_pool(_parse_detect_body, body, content_type, timings=timings)
+        target_bundle, target = _model_entry(body_model or model)
+        # Read before inference: a reload finishing meanwhile must not be credited with this result.
+        version = target_bundle.version
+        try:
+            detections = await asyncio.wrap_future(target.submit(image, timings=timings))
+        except queue.Full:
+            raise _overloaded("queue", target)
+        except FileNotFoundError as error:
+            raise HTTPException(
+                status_code=503, detail=str(error), headers={"Retry-After": str(UNAVAILABLE_RETRY_AFTER_S)}
+            )
+        except Exception as error:  # pragma: no cover
+            LOGGER.exception("Échec de la détection")
+            raise HTTPException(status_code=500, detail=f"Erreur interne: {error}")
+    finally:
+        admission.release()
+
+    response = DetectionResponse(detections=detections, model=target_bundle.cfg_name)
+    if cache_key is not None:
+        result_cache.put(cache_key, response, target_bundle, version)
+    return response
+
+
+@app.websocket("/ws/detect")
+async def detect_stream(websocket: WebSocket, board: str = "default", model: Optional[str] = None) -> None:
+    """Stream binary frames for one board and receive the tracked darts when they change.
+
+    Only the most recent unprocessed frame is kept: frames arriving while inference is
+    busy replace it and are counted as dropped, so latency stays bounded. A text message
+    ``{"type": "reset"}`` clears the board state (calibration and previous darts).
+    """
+    await websocket.accept()
+    try:
+        _, stream_batcher = _model_entry(model)
+    except HTTPException as error:
+        await websocket.send_json({"type": "error", "detail": error.detail})
+        await websocket.close(code=1008)
+        return
+    session = sessions.get(board)
+    await websocket.send_json({"type": "session", "board": board, **session.stats()})
+
+    latest: Dict[str, Any] = {"frame": None, "seq": 0}
+    frame_ready = asyncio.Event()
+
+    async def receive_frames() -> None:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                session.frames_received += 1
+                session.touch()
+                if latest["frame"] is not None:
+                    session.frames_dropped += 1
+                latest["frame"] = message["bytes"]
+                latest["seq"] = session.frames_received
+                frame_ready.set()
+            elif message.get("text"):
+                try:
+                    command = json.loads(message["text"])
+                except ValueError:
+                    command = {}
+                if isinstance(command, dict) and command.get("type") == "reset":
+                    session.reset()
+                    await websocket.send_json({"type": "reset", "board": board})
+                else:
+                    await websocket.send_json({"type": "error", "detail": "Message texte non supporté"})
+
+    async def process_frames() -> None:
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            body, seq = latest["frame"], latest["seq"]
+            latest["frame"] = None
+            if body is None:
+                continue
+            try:
+                image, thumbnail = await _decode_in_pool(_decode_stream_frame, body, session.motion, timings={})
+                if (
+                    thumbnail is not None
+                    and session.motion is not None
+                    and session.settled
+                    and session.motion.is_static(thumbnail)
+                ):
+                    # Same board as the last inferred frame: its detections still hold. Frames are
+                    # still inferred while a dart waits to be confirmed or removed by the tracker.
+                    session.frames_skipped += 1
+                    SKIPPED_FRAMES.inc()
+                    continue
+                detections = await asyncio.wrap_future(stream_batcher.submit(image, session))
+            except HTTPException as error:
+                await websocket.send_json({"type": "error", "frame": seq, "detail": error.detail})
+                continue
+            except queue.Full:
+                REJECTED_REQUESTS.inc(reason="queue")
+                session.frames_dropped += 1
+                await websocket.send_json(
+                    {
+                        "type": "error",
+                        "frame": seq,
+                        "detail": "Serveur surchargé",
+                        "retryAfter": stream_batcher.retry_after(),
+                    }
+                )
+                continue
+            except Exception as error:
+                detail = str(error) if isinstance(error, FileNotFoundError) else f"Erreur interne: {error}"
+                await websocket.send_json({"type": "error", "frame": seq, "detail": detail})
+                await websocket.close(code=1011)
+                return
 
+            if thumbnail is not None and session.motion is not None:
+                session.motion.update(thumbnail)
+            current, added, removed = session.update_detections(detections)
+            if added or removed:
+                await websocket.send_json(
+                    {
+                        "type": "detections",
+                        "frame": seq,
+                        "detections": jsonable_encoder(current),
+                        "added": jsonable_encoder(added),
+                        "removed": jsonable_encoder(removed),
+                    }
+                )
 
-@app.post("/api/detect", response_model=DetectionResponse)
-def detect_darts(payload: DetectRequest) -> DetectionResponse:
-    if not payload.image:
-        raise HTTPException(status_code=400, detail="Le champ 'image' est requis")
-    image = _decode_image(payload.image)
+    receiver = asyncio.ensure_future(receive_frames())
+    processor = asyncio.ensure_future(process_frames())
     try:
-        detections = bundle.predict(image)
+        await asyncio.wait([receiver, processor], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (receiver, processor):
+            task.cancel()
+        for task in (receiver, processor):
+            try:
+                await task
+            except (asyncio.CancelledError, WebSocketDisconnect):
+                pass
+            except Exception as error:  # pragma: no cover
+                LOGGER.warning("Flux WebSocket interrompu pour %s: %s", board, error)
+
+
+@app.get("/healthz")
+def healthz() -> Dict[str, Any]:
+    """Liveness: the process is up and serving HTTP, whether or not the model is loaded."""
+    return {"status": "ok", "uptimeSeconds": time.perf_counter() - startup.started_at}
+
+
+@app.get("/readyz")
+def readyz() -> JSONResponse:
+    """Readiness: the default model is loaded and warmed up."""
+    if startup.ready:
+        return JSONResponse({"status": "ready", "model": bundle.cfg_name, "startup": startup.breakdown})
+    return JSONResponse(
+        {"status": "error" if startup.error else "loading", "detail": startup.error},
+        status_code=503,
+        headers={"Retry-After": "5" if startup.error is None else str(UNAVAILABLE_RETRY_AFTER_S)},
+    )
+
+
+@app.get("/api/models")
+def list_models() -> Dict[str, Any]:
+    return {"default": models.default, "available": models.names, "models": models.stats()}
+
+
+@app.post("/api/models/{name}/reload")
+async def reload_model(name: str) -> Dict[str, Any]:
+    """Load the current weights of ``name`` and swap them in once ready; requests keep
+    being served by the previous version meanwhile."""
+    model_bundle, _ = _model_entry(name)
+    try:
+        reloaded = await run_in_threadpool(model_bundle.reload, True)
     except FileNotFoundError as error:
-        raise HTTPException(status_code=503, detail=str(error))
-    except Exception as error:  # pragma: no cover
-        raise HTTPException(status_code=500, detail=f"Erreur interne: {error}")
+        raise HTTPException(status_code=404, detail=str(error))
+    return {"model": name, "reloaded": reloaded, "version": model_bundle.version}
+
+
+@app.get("/api/stats/sessions")
+def session_stats() -> Dict[str, Any]:
+    return {"sessions": sessions.stats()}
+
+
+@app.get("/api/stats/batching")
+def batching_stats(model: Optional[str] = None) -> Dict[str, Any]:
+    _, model_batcher = _model_entry(model)
+    return {
+        "maxBatchSize": model_batcher.max_batch_size,
+        "maxWaitMs": model_batcher.max_wait * 1000.0,
+        "queueDepth": model_batcher.queue_depth,
+        "inferenceWorkers": model_batcher.workers,
+        "pendingRequests": admission.pending,
+        "maxPending": admission.max_pending,
+        **model_batcher.stats.snapshot(),
+    }
+
+
+@app.get("/api/stats/cache")
+def cache_stats() -> Dict[str, Any]:
+    return result_cache.stats()
+
 
-    return DetectionResponse(detections=detections)
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics() -> PlainTextResponse:
+    return PlainTextResponse(METRICS.render(), media_type=METRICS_CONTENT_TYPE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,285 @@
+"""Per-board state shared by consecutive frames of the same camera."""
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from yacs.config import CfgNode as CN
+
+from dataset.annotate import BoardGeometry, CalibrationCache, get_circle
+from tracking import DartTracker, Track
+
+# Two detections closer than this (normalised units) are considered the same dart.
+MATCH_TOLERANCE = 0.01
+
+# (x0, y0, x1, y1) region of a frame, normalised to the frame size.
+Box = Tuple[float, float, float, float]
+
+
+def uncrop_bboxes(bboxes: np.ndarray, box: Optional[Box]) -> np.ndarray:
+    """Map ``(x, y, w, h, ...)`` rows normalised to the ``box`` crop back onto the full frame."""
+    if box is None or not len(bboxes):
+        return bboxes
+    x0, y0, x1, y1 = box
+    bboxes = bboxes.copy()
+    bboxes[:, [0, 2]] *= x1 - x0
+    bboxes[:, [1, 3]] *= y1 - y0
+    bboxes[:, 0] += x0
+    bboxes[:, 1] += y0
+    return bboxes
+
+
+class BoardROI:
+    """Region of the frame holding the board, derived from its calibration points.
+
+    The training images are square crops just containing the board (``crop_images.py``),
+    i.e. about ``r_board / r_double`` times the calibration circle radius around its
+    center. Once the board is calibrated, frames are cropped the same way, with an extra
+    ``margin``, so the model input is spent on board pixels. The region follows the cached
+    calibration and is dropped when fewer than ``min_points`` calibration points are
+    detected, so the next frame is inferred in full to find the board again.
+    """
+
+    def __init__(self, margin: float = 1.1, min_points: int = 3) -> None:
+        self.margin = margin
+        self.min_points = min_points
+        self.box: Optional[Box] = None
+
+    def crop(self, image: np.ndarray) -> Tuple[np.ndarray, Optional[Box]]:
+        """View of ``image`` restricted to the region, or the full frame when there is none."""
+        box = self.box
+        if box is None:
+            return image, None
+        height, width = image.shape[:2]
+        left, top = int(box[0] * width), int(box[1] * height)
+        right, bottom = int(np.ceil(box[2] * width)), int(np.ceil(box[3] * height))
+        # Normalise with the rounded pixel bounds so that uncrop_bboxes maps back exactly.
+        return image[top:bottom, left:right], (left / width, top / height, right / width, bottom / height)
+
+    def update(self, cal_xy: Optional[np.ndarray], detected: np.ndarray, shape: Tuple[int, ...], cfg: CN) -> None:
+        """Recompute the region from ``cal_xy`` (normalised to a frame of ``shape``)."""
+        if cal_xy is None or np.count_nonzero(detected) < self.min_points:
+            self.box = None
+            return
+        height, width = shape[:2]
+        center, radius = get_circle(np.asarray(cal_xy)[:4, :2] * [width, height])
+        half = radius * cfg.board.r_board / cfg.board.r_double * self.margin
+        self.box = (
+            max(0.0, (center[0] - half) / width),
+            max(0.0, (center[1] - half) / height),
+            min(1.0, (center[0] + half) / width),
+            min(1.0, (center[1] + half) / height),
+        )
+        if self.box[2] <= self.box[0] or self.box[3] <= self.box[1]:
+            self.box = None
+
+    def reset(self) -> None:
+        self.box = None
+
+
+class MotionGate:
+    """Tells whether a frame differs from the last frame that went through inference.
+
+    Frames are compared as ``size`` x ``size`` grayscale thumbnails: a frame is static
+    when less than ``area_threshold`` of the thumbnail pixels changed by more than
+    ``pixel_threshold`` grey levels. Downscaling averages sensor noise out, while a dart
+    landing on the board still changes several thumbnail pixels (about 0.05% of them
+    for a dart 30 px long in an 800x600 frame).
+    """
+
+    def __init__(self, size: int = 128, pixel_threshold: int = 15, area_threshold: float = 0.0002) -> None:
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.area_threshold = area_threshold
+        self.reference: Optional[np.ndarray] = None
+
+    def thumbnail(self, image: np.ndarray) -> np.ndarray:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return cv2.resize(gray, (self.size, self.size), interpolation=cv2.INTER_AREA)
+
+    def changed_fraction(self, thumbnail: np.ndarray) -> float:
+        if self.reference is None:
+            return 1.0
+        changed = cv2.absdiff(thumbnail, self.reference) > self.pixel_threshold
+        return float(np.count_nonzero(changed)) / changed.size
+
+    def is_static(self, thumbnail: np.ndarray) -> bool:
+        return self.changed_fraction(thumbnail) < self.area_threshold
+
+    def update(self, thumbnail: np.ndarray) -> None:
+        self.reference = thumbnail
+
+    def reset(self) -> None:
+        self.reference = None
+
+
+class BoardSession:
+    def __init__(
+        self,
+        board_id: str,
+        calibration_tolerance: float = 0.01,
+        motion: Optional[MotionGate] = None,
+        roi: Optional[BoardROI] = None,
+        tracker: Optional[DartTracker] = None,
+    ) -> None:
+        self.board_id = board_id
+        self.lock = threading.Lock()
+        self.created_at = time.monotonic()
+        self.last_seen = self.created_at
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self.frames_cropped = 0
+        self.calibration = CalibrationCache(calibration_tolerance)
+        self.motion = motion
+        self.roi = roi
+        self.tracker = tracker
+        self.detections: List[Any] = []
+
+    def touch(self) -> None:
+        self.last_seen = time.monotonic()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.calibration.reset()
+            if self.motion is not None:
+                self.motion.reset()
+            if self.roi is not None:
+                self.roi.reset()
+            if self.tracker is not None:
+                self.tracker.reset()
+            self.detections = []
+
+    def board_geometry(self, xy: np.ndarray, cfg: CN, detected: np.ndarray) -> Optional[BoardGeometry]:
+        """Cached board geometry for this frame, see ``CalibrationCache.update``.
+
+        ``detected`` flags which of the 4 calibration classes the detector actually found,
+        as opposed to points ``est_cal_pts`` reconstructed.
+        """
+        with self.lock:
+            return self.calibration.update(xy, cfg, detected)
+
+    def crop(self, image: np.ndarray) -> Tuple[np.ndarray, Optional[Box]]:
+        """The board region of ``image`` to run inference on, see ``BoardROI.crop``."""
+        if self.roi is None:
+            return image, None
+        crop, box = self.roi.crop(image)
+        if box is not None:
+            self.frames_cropped += 1
+        return crop, box
+
+    def update_roi(self, detected: np.ndarray, shape: Tuple[int, ...], cfg: CN) -> None:
+        """Follow the cached calibration after a frame where ``detected`` calibration points were found."""
+        if self.roi is not None:
+            with self.lock:
+                cal_xy = self.calibration.cal_xy if self.calibration.geometry is not None else None
+                self.roi.update(cal_xy, detected, shape, cfg)
+
+    @property
+    def settled(self) -> bool:
+        """Whether skipping unchanged frames loses nothing, i.e. no tracked dart is pending."""
+        return self.tracker is None or self.tracker.settled
+
+    def update_detections(self, detections: List[Any]) -> Tuple[List[Any], List[Any], List[Any]]:
+        """Store this frame's ``detections`` and return the current darts and the
+        ``(added, removed)`` ones since the last frame.
+
+        With a tracker, the current darts are the confirmed tracks, carrying their
+        ``trackId``, and darts are added once confirmed rather than when first seen.
+        """
+        with self.lock:
+            self.frames_processed += 1
+            if self.tracker is not None:
+                landed, removed_tracks = self.tracker.update(detections)
+                self.detections = [_tracked(track) for track in self.tracker.confirmed]
+                return self.detections, [_tracked(t) for t in landed], [_tracked(t) for t in removed_tracks]
+            previous, self.detections = self.detections, list(detections)
+        added = [d for d in detections if not _has_match(d, previous)]
+        removed = [d for d in previous if not _has_match(d, detections)]
+        return self.detections, added, removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "board": self.board_id,
+            "framesReceived": self.frames_received,
+            "framesDropped": self.frames_dropped,
+            "framesProcessed": self.frames_processed,
+            "framesSkipped": self.frames_skipped,
+            "framesCropped": self.frames_cropped,
+            "roi": self.roi.box if self.roi is not None else None,
+            "trackedDarts": len(self.detections) if self.tracker is not None else None,
+            "calibrated": self.calibration.geometry is not None,
+            "calibrationHits": self.calibration.hits,
+            "calibrationMisses": self.calibration.misses,
+            "idleSeconds": time.monotonic() - self.last_seen,
+        }
+
+
+def _tracked(track: Track) -> Any:
+    return track.detection.model_copy(update={"trackId": track.id})
+
+
+def _has_match(detection: Any, others: Sequence[Any]) -> bool:
+    return any(
+        detection.sector == other.sector
+        and abs(detection.x - other.x) <= MATCH_TOLERANCE
+        and abs(detection.y - other.y) <= MATCH_TOLERANCE
+        for other in others
+    )
+
+
+class SessionRegistry:
+    """Board sessions keyed by board id, dropped after ``ttl`` seconds without frames.
+
+    With ``motion_gate`` / ``roi`` / ``tracker``, each new session gets the ``MotionGate`` /
+    ``BoardROI`` / ``DartTracker`` they return.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_sessions: int,
+        calibration_tolerance: float = 0.01,
+        motion_gate: Optional[Callable[[], MotionGate]] = None,
+        roi: Optional[Callable[[], BoardROI]] = None,
+        tracker: Optional[Callable[[], DartTracker]] = None,
+    ) -> None:
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.calibration_tolerance = calibration_tolerance
+        self.motion_gate = motion_gate
+        self.roi = roi
+        self.tracker = tracker
+        self._sessions: Dict[str, BoardSession] = {}
+        self._lock = threading.Lock()
+
+    def get(self, board_id: str) -> BoardSession:
+        with self._lock:
+            self._evict(time.monotonic())
+            session = self._sessions.get(board_id)
+            if session is None:
+                if len(self._sessions) >= self.max_sessions:
+                    oldest = min(self._sessions.values(), key=lambda s: s.last_seen)
+                    del self._sessions[oldest.board_id]
+                motion = self.motion_gate() if self.motion_gate is not None else None
+                roi = self.roi() if self.roi is not None else None
+                tracker = self.tracker() if self.tracker is not None else None
+                session = self._sessions[board_id] = BoardSession(
+                    board_id, self.calibration_tolerance, motion, roi, tracker
+                )
+            session.touch()
+            return session
+
+    def _evict(self, now: float) -> None:
+        for board_id in [b for b, s in self._sessions.items() if now - s.last_seen > self.ttl]:
+            del self._sessions[board_id]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._evict(time.monotonic())
+            return [session.stats() for session in self._sessions.values()]
@@ -0,0 +1,25 @@
+from pathlib import Path
+
+import pytest
+from yacs.config import CfgNode as CN
+
+pytest.importorskip("tensorflow")
+pytest.importorskip("yolov4")
+
+from augment import check_parity  # noqa: E402
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_graph_augmentations_match_dataloader(seed, monkeypatch):
+    # The dataloader reads ``classes`` and ``configs/`` relative to the repository root.
+    monkeypatch.chdir(REPO)
+    cfg = CN(new_allowed=True)
+    cfg.merge_from_file("configs/deepdarts_d1.yaml")
+
+    rows = check_parity(cfg, seed=seed)
+
+    assert rows
+    failed = [row for row in rows if not row["ok"]]
+    assert not failed, failed
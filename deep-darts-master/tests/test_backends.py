@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+yolov4_tf = pytest.importorskip("yolov4.tf")
+
+from backends import candidates_to_pred_bboxes  # noqa: E402
+
+INPUT_SIZE = 800
+CLASSES = ["dart", "cal1", "cal2", "cal3", "cal4"]
+
+
+def _candidates(rng: np.random.Generator, count: int) -> np.ndarray:
+    xy = rng.uniform(0.0, 1.0, (count, 2))
+    # Half of the boxes straddle the small-box cut-off of ``4 / input_size``.
+    wh = np.where(
+        rng.uniform(size=(count, 1)) < 0.5,
+        rng.uniform(1 / INPUT_SIZE, 8 / INPUT_SIZE, (count, 2)),
+        rng.uniform(0.005, 0.05, (count, 2)),
+    )
+    conf = rng.uniform(0.0, 1.0, (count, 1))
+    probs = rng.uniform(0.0, 1.0, (count, len(CLASSES)))
+    return np.concatenate([xy, wh, conf, probs], axis=-1).astype(np.float32)
+
+
+def _sorted(bboxes: np.ndarray) -> np.ndarray:
+    return bboxes[np.lexsort(bboxes.T[::-1])]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_candidates_to_pred_bboxes_matches_yolov4(seed):
+    yolo = yolov4_tf.YOLOv4(tiny=True)
+    yolo.classes = {i: name for i, name in enumerate(CLASSES)}
+    yolo.input_size = (INPUT_SIZE, INPUT_SIZE)
+
+    candidates = _candidates(np.random.default_rng(seed), 2000)
+    expected = yolo.candidates_to_pred_bboxes(candidates)
+    actual = candidates_to_pred_bboxes(candidates, INPUT_SIZE)
+
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(_sorted(actual), _sorted(expected.astype(np.float32)), rtol=1e-6, atol=1e-6)
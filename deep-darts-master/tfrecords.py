@@ -0,0 +1,170 @@
+"""Sharded TFRecord export of the dataset splits.
+
+``python tfrecords.py --size 800`` writes every split of ``dataloader.get_splits`` (d1 / d2,
+train / val / test) to ``<output>/800/<dataset>_<split>-<shard>-of-<shards>.tfrecord``. The
+records hold the cropped JPEG as is, its keypoints padded to the ``(7, 3)`` layout of
+``load_tfds`` and its ``img_folder/img_name`` key. Next to the shards,
+``<dataset>_<split>.json`` lists them with the number of images. Rows are shuffled once at
+export, with a fixed seed, so that every shard is a random sample of its split.
+
+``load_records`` reads a split with shards interleaved in parallel and seeded shuffles,
+without pandas or the loose image files. With ``data.records_path`` set in the config,
+``load_tfds`` uses it.
+"""
+import argparse
+import json
+import os
+import os.path as osp
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+import numpy as np  # noqa: E402
+import tensorflow as tf  # noqa: E402
+
+FEATURES = {
+    "image": tf.io.FixedLenFeature([], tf.string),
+    "xy": tf.io.FixedLenFeature([7 * 3], tf.float32),
+    "key": tf.io.FixedLenFeature([], tf.string),
+}
+
+
+def manifest_path(records_path: str, input_size: int, dataset: str, split: str) -> str:
+    return osp.join(records_path, str(input_size), "{}_{}.json".format(dataset, split))
+
+
+def _example(image: bytes, xy: np.ndarray, key: str) -> bytes:
+    feature = {
+        "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[image])),
+        "xy": tf.train.Feature(float_list=tf.train.FloatList(value=xy.reshape(-1).tolist())),
+        "key": tf.train.Feature(bytes_list=tf.train.BytesList(value=[key.encode("utf-8")])),
+    }
+    return tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString()
+
+
+def _write_shard(path: str, image_paths: Sequence[str], xys: np.ndarray, keys: Sequence[str]) -> None:
+    with tf.io.TFRecordWriter(path + ".tmp") as writer:
+        for image_path, xy, key in zip(image_paths, xys, keys):
+            with open(image_path, "rb") as handle:
+                writer.write(_example(handle.read(), xy, key))
+    os.replace(path + ".tmp", path)
+
+
+def export_split(
+    data: Any,
+    image_path: str,
+    output_path: str,
+    name: str,
+    shard_size: int = 1024,
+    seed: int = 0,
+    workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Write the ``data`` rows of ``labels.pkl`` to the ``name`` shards and manifest in ``output_path``."""
+    from dataloader import get_xys
+
+    order = np.random.RandomState(seed).permutation(len(data))
+    data = data.iloc[order]
+    keys = [folder + "/" + img_name for folder, img_name in zip(data.img_folder, data.img_name)]
+    image_paths = [osp.join(image_path, key) for key in keys]
+    xys = get_xys(data)
+
+    num_shards = max(1, -(-len(data) // shard_size))
+    bounds = np.linspace(0, len(data), num_shards + 1).astype(int)
+    shards = ["{}-{:05d}-of-{:05d}.tfrecord".format(name, i, num_shards) for i in range(num_shards)]
+    os.makedirs(output_path, exist_ok=True)
+    with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+        jobs = [
+            pool.submit(_write_shard, osp.join(output_path, shard), image_paths[lo:hi], xys[lo:hi], keys[lo:hi])
+            for shard, lo, hi in zip(shards, bounds[:-1], bounds[1:])
+        ]
+        for job in jobs:
+            job.result()
+
+    manifest = {"count": len(data), "shards": shards, "seed": seed}
+    with open(osp.join(output_path, name + ".json"), "w") as handle:
+        json.dump(manifest, handle, indent=2)
+    print("Wrote", name, "({} images, {} shards)".format(len(data), num_shards))
+    return manifest
+
+
+def _parse(record: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+    example = tf.io.parse_single_example(record, FEATURES)
+    return example["image"], tf.reshape(example["xy"], [7, 3])
+
+
+def load_records(
+    records_path: str,
+    dataset: str,
+    split: str,
+    input_size: int,
+    seed: int = 0,
+    shuffle_buffer: int = 1024,
+    cycle_length: int = 8,
+    num_parallel_calls: int = tf.data.AUTOTUNE,
+) -> Tuple[tf.data.Dataset, int]:
+    """Endless ``(jpeg, xy)`` dataset of one exported split, and its number of images.
+
+    Each epoch visits the shards in a new order, reading ``cycle_length`` of them in
+    parallel. Records are then shuffled in a ``shuffle_buffer`` (the shards are already
+    shuffled at export). For a given ``seed`` the order is the same on every run.
+    """
+    path = manifest_path(records_path, input_size, dataset, split)
+    if not osp.exists(path):
+        raise FileNotFoundError(
+            "Split {}_{} non exporté ({}) : lancez python tfrecords.py --size {}".format(
+                dataset, split, path, input_size)
+        )
+    with open(path) as handle:
+        manifest = json.load(handle)
+    files = [osp.join(osp.dirname(path), shard) for shard in manifest["shards"]]
+
+    ds = tf.data.Dataset.from_tensor_slices(files)
+    ds = ds.shuffle(len(files), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.interleave(
+        tf.data.TFRecordDataset,
+        cycle_length=min(cycle_length, len(files)),
+        num_parallel_calls=num_parallel_calls,
+        deterministic=True,
+    )
+    ds = ds.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True).repeat()
+    return ds.map(_parse, num_parallel_calls=num_parallel_calls), manifest["count"]
+
+
+def export(
+    labels_path: str,
+    data_path: str,
+    output_path: str,
+    input_size: int,
+    datasets: List[str],
+    splits: List[str],
+    shard_size: int = 1024,
+    seed: int = 0,
+    workers: Optional[int] = None,
+) -> None:
+    from dataloader import get_splits
+
+    image_path = osp.join(data_path, "cropped_images", str(input_size))
+    for dataset in datasets:
+        for split, data in get_splits(labels_path, dataset, None).items():
+            if split in splits:
+                name = "{}_{}".format(dataset, split)
+                export_split(data, image_path, osp.join(output_path, str(input_size)), name, shard_size, seed, workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-lp", "--labels-path", default="dataset/labels.pkl")
+    parser.add_argument("-dp", "--data-path", default="dataset", help="Directory holding cropped_images/")
+    parser.add_argument("-o", "--output", default="dataset/tfrecords")
+    parser.add_argument("-s", "--size", nargs="+", type=int, default=[800])
+    parser.add_argument("--datasets", nargs="+", default=["d1", "d2"], choices=["d1", "d2"])
+    parser.add_argument("--splits", nargs="+", default=["train", "val", "test"], choices=["train", "val", "test"])
+    parser.add_argument("--shard-size", type=int, default=1024, help="Images per shard")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the export shuffle")
+    parser.add_argument("-w", "--workers", type=int, help="Shards written in parallel (default: CPU count)")
+    args = parser.parse_args()
+
+    for size in args.size:
+        export(args.labels_path, args.data_path, args.output, size, args.datasets, args.splits,
+               args.shard_size, args.seed, args.workers)
@@ -0,0 +1,99 @@
+"""Dart tracking across the frames of one board.
+
+Detections are matched to tracks by minimum total distance (Hungarian assignment).
+A new track stays tentative until it has been matched in ``confirm_frames`` consecutive
+frames, then its dart is confirmed ("landed") and its detection, score included, is
+frozen. A confirmed dart survives up to ``max_missed`` frames without a match (an arm or
+another dart hiding it) before it is reported as removed.
+"""
+import itertools
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+
+class Track:
+    __slots__ = ("id", "x", "y", "detection", "hits", "misses", "confirmed")
+
+    def __init__(self, track_id: int, detection: Any) -> None:
+        self.id = track_id
+        self.x, self.y = detection.x, detection.y
+        self.detection = detection
+        self.hits = 1
+        self.misses = 0
+        self.confirmed = False
+
+    def match(self, detection: Any) -> None:
+        # The position follows the dart for matching; the detection is frozen once confirmed.
+        self.x, self.y = detection.x, detection.y
+        if not self.confirmed:
+            self.detection = detection
+        self.hits += 1
+        self.misses = 0
+
+
+class DartTracker:
+    """Stable dart identities for the detections (objects with ``x`` / ``y``) of one board."""
+
+    def __init__(self, confirm_frames: int = 2, max_missed: int = 5, max_distance: float = 0.02) -> None:
+        self.confirm_frames = max(1, confirm_frames)
+        self.max_missed = max_missed
+        self.max_distance = max_distance
+        self.tracks: List[Track] = []
+        self._ids = itertools.count(1)
+
+    @property
+    def confirmed(self) -> List[Track]:
+        return [track for track in self.tracks if track.confirmed]
+
+    @property
+    def settled(self) -> bool:
+        """No track waiting to be confirmed or removed, so unchanged frames can be skipped."""
+        return all(track.confirmed and not track.misses for track in self.tracks)
+
+    def _assign(self, detections: Sequence[Any]) -> List[Tuple[int, int]]:
+        if not self.tracks or not detections:
+            return []
+        tracked = np.array([[track.x, track.y] for track in self.tracks])
+        observed = np.array([[detection.x, detection.y] for detection in detections])
+        cost = np.linalg.norm(tracked[:, np.newaxis] - observed[np.newaxis], axis=-1)
+        rows, cols = linear_sum_assignment(cost)
+        return [(row, col) for row, col in zip(rows, cols) if cost[row, col] <= self.max_distance]
+
+    def update(self, detections: Sequence[Any]) -> Tuple[List[Track], List[Track]]:
+        """Match one frame's ``detections`` and return the ``(landed, removed)`` darts."""
+        matches = dict(self._assign(detections))
+        landed: List[Track] = []
+        removed: List[Track] = []
+        tracks: List[Track] = []
+        for index, track in enumerate(self.tracks):
+            column: Optional[int] = matches.get(index)
+            if column is not None:
+                track.match(detections[column])
+                if not track.confirmed and track.hits >= self.confirm_frames:
+                    track.confirmed = True
+                    landed.append(track)
+                tracks.append(track)
+            elif track.confirmed:
+                track.misses += 1
+                if track.misses > self.max_missed:
+                    removed.append(track)
+                else:
+                    tracks.append(track)
+            # Tentative tracks need consecutive matches and are dropped on the first miss.
+
+        matched = set(matches.values())
+        for column, detection in enumerate(detections):
+            if column in matched:
+                continue
+            track = Track(next(self._ids), detection)
+            if self.confirm_frames == 1:
+                track.confirmed = True
+                landed.append(track)
+            tracks.append(track)
+        self.tracks = tracks
+        return landed, removed
+
+    def reset(self) -> None:
+        self.tracks = []
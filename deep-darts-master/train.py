@@ -10,6 +10,7 @@ from utils import detect_hardware
 import pickle
 from tensorflow.keras import layers
 import random
+import time
 from predict import predict
 
 gpus = tf.config.list_physical_devices('GPU')
@@ -17,7 +18,7 @@ for gpu in gpus:
     tf.config.experimental.set_memory_growth(gpu, True)
 
 from yolov4.tf import YOLOv4
-from yolov4.model import yolov4
+from yolov4.model import head, yolov4
 from loss import YOLOv4Loss
 
 
@@ -48,6 +49,19 @@ def make_model(
             activation1=activation1,
             kernel_regularizer=kernel_regularizer,
         )
+    policy = tf.keras.mixed_precision.global_policy()
+    if policy.compute_dtype != 'float32':
+        # the head decodes the boxes on float32 grids and its outputs feed the loss: rebuild it
+        # (it has no weights) under a float32 policy, so that it casts its inputs to float32
+        tf.keras.mixed_precision.set_global_policy('float32')
+        try:
+            head_args = dict(anchors=yolo.anchors, num_classes=len(yolo.classes), xysclaes=yolo.xyscales)
+            if yolo.tiny:
+                yolo.model.yolov3_head_tiny = head.YOLOv3HeadTiny(**head_args)
+            else:
+                yolo.model.yolov3_head = head.YOLOv3Head(**head_args)
+        finally:
+            tf.keras.mixed_precision.set_global_policy(policy)
     yolo.model(inputs)
 
 
@@ -60,14 +74,59 @@ def build_model(cfg, classes='classes'):
     return yolo
 
 
+class ThroughputLogger(tf.keras.callbacks.Callback):
+    """Prints the training images/sec of every epoch and adds them to the history.
+
+    The first epoch includes graph tracing and XLA compilation, so it is recorded apart
+    as warmup_images_per_sec; images_per_sec and the final mean cover the later epochs.
+    """
+
+    def __init__(self, batch_size):
+        super().__init__()
+        self.batch_size = batch_size
+        self.rates = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.steps = 0
+        self.start = self.end = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+        self.end = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        images_per_sec = self.steps * self.batch_size / max(self.end - self.start, 1e-9)
+        warmup = epoch == 0
+        print('Epoch {}: {:.1f} images/sec{}'.format(epoch + 1, images_per_sec, ' (warm-up)' if warmup else ''))
+        if not warmup:
+            self.rates.append(images_per_sec)
+        if logs is not None:
+            logs['warmup_images_per_sec' if warmup else 'images_per_sec'] = images_per_sec
+
+    def on_train_end(self, logs=None):
+        if self.rates:
+            print('Mean after warm-up: {:.1f} images/sec'.format(np.mean(self.rates)))
+
+
+def has_images(cfg):
+    return osp.exists(osp.join(cfg.data.path, 'cropped_images', str(cfg.model.input_size)))
+
+
 def train(cfg, strategy):
-    img_path = osp.join(cfg.data.path, 'cropped_images', str(cfg.model.input_size))
-    assert osp.exists(img_path), 'Could not find cropped images at {}'.format(img_path)
+    if not cfg.data.get('records_path', ''):  # with records_path only the TFRecord shards are read
+        img_path = osp.join(cfg.data.path, 'cropped_images', str(cfg.model.input_size))
+        assert has_images(cfg), 'Could not find cropped images at {}'.format(img_path)
 
     tf.random.set_seed(cfg.train.seed)
     np.random.seed(cfg.train.seed)
     random.seed(cfg.train.seed)
 
+    xla = cfg.train.get('xla', False)
+    if cfg.train.get('mixed_precision', False):
+        # float16 compute with float32 variables (bfloat16 on TPU, which needs no loss scaling)
+        tpu = isinstance(strategy, tf.distribute.TPUStrategy)
+        tf.keras.mixed_precision.set_global_policy('mixed_bfloat16' if tpu else 'mixed_float16')
+
     with strategy.scope():
         yolo = build_model(cfg)
 
@@ -114,11 +173,14 @@ def train(cfg, strategy):
     with strategy.scope():
         lr = tf.keras.experimental.CosineDecay(cfg.train.lr, cfg.train.epochs * spe)
         optimizer = tf.keras.optimizers.Adam(lr)
+        if tf.keras.mixed_precision.global_policy().name == 'mixed_float16':
+            optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)  # dynamic loss scale
         loss = YOLOv4Loss(
             batch_size=yolo.batch_size,
             iou_type=cfg.train.loss_type,
-            verbose=cfg.train.loss_verbose)
-        yolo.model.compile(optimizer=optimizer, loss=loss)
+            verbose=cfg.train.loss_verbose,
+            max_boxes=3 * 7 if xla else None)  # 7 keypoints, each on at most 3 anchors per scale
+        yolo.model.compile(optimizer=optimizer, loss=loss, jit_compile=xla)
 
     val_steps = {'d1': 20, 'd2': 8}
 
@@ -129,7 +191,8 @@ def train(cfg, strategy):
         verbose=cfg.train.verbose,
         validation_data=None if not cfg.train.val else val_ds,
         validation_steps=val_steps[cfg.data.dataset] // strategy.num_replicas_in_sync,
-        steps_per_epoch=spe)
+        steps_per_epoch=spe,
+        callbacks=[ThroughputLogger(cfg.train.batch_size * strategy.num_replicas_in_sync)])
 
     yolo.save_weights(
         weights_path='./models/{}/weights'.format(cfg.model.name),
@@ -150,4 +213,8 @@ if __name__ == '__main__':
 
     tpu, strategy = detect_hardware(tpu_name=None)
     yolo = train(cfg, strategy)
-    predict(yolo, cfg, dataset=cfg.data.dataset, split='val')
+    # predict reads labels.pkl and the cropped images, which a machine with only the TFRecord shards lacks
+    if osp.exists(cfg.data.labels_path) and has_images(cfg):
+        predict(yolo, cfg, dataset=cfg.data.dataset, split='val')
+    else:
+        print('Skipping the val predictions: labels.pkl or the cropped images are missing')
@@ -0,0 +1,246 @@
+"""Inference worker processes fed through shared memory.
+
+``ProcessPoolBackend`` exposes the same ``forward`` / ``postprocess`` interface as the
+in-process backends, but runs the model in ``workers`` child processes. Each child owns a
+``multiprocessing.shared_memory`` buffer of ``slots`` frame slots: the front-end copies
+the RGB frames of a batch into the slots of an idle worker and only sends their shapes
+over a queue, so image arrays are never pickled. Only the small bbox arrays come back
+through the result queue.
+
+Children are started with the ``spawn`` method, pinned to a disjoint set of cores and
+configured with matching intra-op / inter-op thread counts before the model is loaded.
+"""
+import logging
+import multiprocessing as mp
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import cv2
+import numpy as np
+from yacs.config import CfgNode as CN
+
+from backends import create_backend
+
+LOGGER = logging.getLogger("deepdarts.workers")
+
+READY_TIMEOUT_S = 300.0
+POLL_INTERVAL_S = 1.0
+
+
+def split_cores(cores: Sequence[int], workers: int) -> List[Set[int]]:
+    """Split ``cores`` into ``workers`` contiguous groups, reusing cores if there are fewer."""
+    cores = sorted(cores)
+    if len(cores) < workers:
+        return [{cores[i % len(cores)]} for i in range(workers)]
+    size, extra = divmod(len(cores), workers)
+    groups, start = [], 0
+    for i in range(workers):
+        end = start + size + (i < extra)
+        groups.append(set(cores[start:end]))
+        start = end
+    return groups
+
+
+def _worker_main(
+    index: int,
+    backend_name: str,
+    cfg: CN,
+    model_path: Path,
+    shm_name: str,
+    slot_bytes: int,
+    cores: Set[int],
+    threads: Tuple[int, int],
+    requests: "mp.Queue[Any]",
+    results: "mp.Queue[Any]",
+) -> None:
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    cv2.setNumThreads(threads[0])
+    started = time.perf_counter()
+    try:
+        backend = create_backend(backend_name, cfg, model_path, threads)
+    except Exception as error:
+        results.put(("error", f"{type(error).__name__}: {error}"))
+        return
+    results.put(("ready", time.perf_counter() - started))
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            shapes, bgr = request
+            images = [
+                np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+                for slot, shape in enumerate(shapes)
+            ]
+            try:
+                bboxes = backend.predict_batch(images, bgr)
+                results.put(("ok", [np.asarray(b, dtype=np.float32) for b in bboxes]))
+            except Exception as error:
+                results.put(("error", f"{type(error).__name__}: {error}"))
+            del images
+    finally:
+        shm.close()
+
+
+class _Worker:
+    def __init__(self, process: Any, shm: shared_memory.SharedMemory, requests: Any, results: Any) -> None:
+        self.process = process
+        self.shm = shm
+        self.requests = requests
+        self.results = results
+
+
+class ProcessPoolBackend:
+    """Runs ``backend_name`` in ``workers`` processes, one batch per worker at a time.
+
+    YOLO postprocessing happens in the worker, so ``forward`` already returns the per-frame
+    bboxes and ``postprocess`` passes them through.
+    """
+
+    def __init__(
+        self,
+        backend_name: str,
+        cfg: CN,
+        model_path: Path,
+        workers: int,
+        slots: int,
+        slot_bytes: int,
+        inter_op_threads: int = 1,
+        intra_op_threads: Optional[int] = None,
+    ) -> None:
+        self.name = backend_name
+        self.cfg = cfg
+        self.input_size = int(cfg.model.input_size)
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        available = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else range(os.cpu_count() or 1)
+        core_groups = split_cores(list(available), workers)
+
+        context = mp.get_context("spawn")
+        self._workers: List[_Worker] = []
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        try:
+            for index, cores in enumerate(core_groups):
+                threads = (intra_op_threads or len(cores), inter_op_threads)
+                shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+                requests, results = context.Queue(), context.Queue()
+                process = context.Process(
+                    target=_worker_main,
+                    args=(index, backend_name, cfg, model_path, shm.name, slot_bytes, cores, threads, requests, results),
+                    name=f"deepdarts-worker-{index}",
+                    daemon=True,
+                )
+                self._workers.append(_Worker(process, shm, requests, results))
+                process.start()
+                LOGGER.info("Worker %d démarré sur les cœurs %s (threads %s)", index, sorted(cores), threads)
+            for index, worker in enumerate(self._workers):
+                status, value = self._receive(worker, READY_TIMEOUT_S)
+                if status != "ready":
+                    raise RuntimeError(f"Le worker {index} n'a pas pu charger le modèle: {value}")
+                LOGGER.info("Worker %d prêt en %.2f s", index, value)
+                self._idle.put(worker)
+        except BaseException:
+            self.close()
+            raise
+
+    def _receive(self, worker: _Worker, timeout: Optional[float] = None) -> Tuple[str, Any]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return worker.results.get(timeout=POLL_INTERVAL_S)
+            except queue.Empty:
+                if not worker.process.is_alive():
+                    raise RuntimeError(f"Le worker {worker.process.name} s'est arrêté (code {worker.process.exitcode})")
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"Le worker {worker.process.name} ne répond pas")
+
+    def _fit(self, image: np.ndarray) -> np.ndarray:
+        # Frames larger than a slot are downscaled; the outputs are normalised, and the
+        # model input is much smaller than a slot anyway.
+        if image.nbytes <= self.slot_bytes:
+            return image
+        scale = (self.slot_bytes / image.nbytes) ** 0.5
+        size = (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    def forward(self, rgb_images: List[np.ndarray], bgr: bool = False) -> List[np.ndarray]:
+        bboxes: List[np.ndarray] = []
+        for start in range(0, len(rgb_images), self.slots):
+            bboxes.extend(self._run(rgb_images[start:start + self.slots], bgr))
+        return bboxes
+
+    def _submit(self, worker: _Worker, rgb_images: List[np.ndarray], bgr: bool) -> None:
+        shapes = []
+        for slot, image in enumerate(rgb_images):
+            image = np.ascontiguousarray(self._fit(image), dtype=np.uint8)
+            view = np.ndarray(image.shape, dtype=np.uint8, buffer=worker.shm.buf, offset=slot * self.slot_bytes)
+            view[...] = image
+            shapes.append(image.shape)
+            del view
+        worker.requests.put((shapes, bgr))
+
+    def _run(self, rgb_images: List[np.ndarray], bgr: bool) -> List[np.ndarray]:
+        if not any(worker.process.is_alive() for worker in self._workers):
+            raise RuntimeError("Aucun worker d'inférence actif")
+        worker = self._idle.get()
+        try:
+            self._submit(worker, rgb_images, bgr)
+            status, value = self._receive(worker)
+        except BaseException:
+            if worker.process.is_alive():
+                self._idle.put(worker)
+            raise
+        self._idle.put(worker)
+        if status != "ok":
+            raise RuntimeError(f"Échec de l'inférence dans {worker.process.name}: {value}")
+        return value
+
+    def warm_up(self, batch_sizes: Sequence[int]) -> Dict[int, float]:
+        """Run one blank batch of each size in every worker, since requests go to whichever
+        worker is idle. Workers run in parallel; returns the seconds spent per batch size."""
+        frame = np.zeros((self.input_size, self.input_size, 3), dtype=np.uint8)
+        workers = [self._idle.get() for _ in self._workers]
+        timings: Dict[int, float] = {}
+        try:
+            for batch_size in batch_sizes:
+                started = time.perf_counter()
+                for start in range(0, batch_size, self.slots):
+                    images = [frame] * min(self.slots, batch_size - start)
+                    for worker in workers:
+                        self._submit(worker, images, False)
+                    for worker in workers:
+                        status, value = self._receive(worker)
+                        if status != "ok":
+                            raise RuntimeError(f"Échec du préchauffage dans {worker.process.name}: {value}")
+                timings[batch_size] = time.perf_counter() - started
+        finally:
+            for worker in workers:
+                if worker.process.is_alive():
+                    self._idle.put(worker)
+        return timings
+
+    def postprocess(self, bboxes: List[np.ndarray], rgb_images: List[np.ndarray]) -> List[np.ndarray]:
+        return bboxes
+
+    def predict_batch(self, rgb_images: List[np.ndarray], bgr: bool = False) -> List[np.ndarray]:
+        return self.forward(rgb_images, bgr)
+
+    def close(self) -> None:
+        for worker in self._workers:
+            if worker.process.is_alive():
+                worker.requests.put(None)
+        for worker in self._workers:
+            if worker.process.pid is not None:
+                worker.process.join(timeout=10)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            worker.shm.close()
+            worker.shm.unlink()
+        self._workers = []
@@ -9,9 +9,16 @@ class YOLOv4Loss(Loss):
     Patched version of loss to fix potential nan with conf_loss
     """
 
-    def __init__(self, batch_size, iou_type, verbose=0):
+    def __init__(self, batch_size, iou_type, verbose=0, max_boxes=None):
+        """
+        @param `max_boxes`: upper bound on the truth boxes of an image at one
+            scale. When given, the confidence loss compares every prediction
+            with that many truths instead of looping over the batch, so that
+            the loss compiles with XLA.
+        """
         super(YOLOv4Loss, self).__init__(name="YOLOv4Loss")
         self.batch_size = batch_size
+        self.max_boxes = max_boxes
         if iou_type == "iou":
             self.bbox_xiou = bbox_iou
         elif iou_type == "giou":
@@ -40,11 +47,12 @@ class YOLOv4Loss(Loss):
         else:
             _, g_height, g_width, _, box_size = y_pred.shape
 
+        # float32 even when the model computes in float16
         y_true = tf.reshape(
-            y_true, shape=(-1, g_height * g_width * 3, box_size)
+            tf.cast(y_true, tf.float32), shape=(-1, g_height * g_width * 3, box_size)
         )
         y_pred = tf.reshape(
-            y_pred, shape=(-1, g_height * g_width * 3, box_size)
+            tf.cast(y_pred, tf.float32), shape=(-1, g_height * g_width * 3, box_size)
         )
 
         truth_xywh = y_true[..., 0:4]
@@ -72,45 +80,57 @@ class YOLOv4Loss(Loss):
         xiou_loss = 3 * tf.reduce_mean(tf.reduce_sum(xiou_loss, axis=(1, 2)))
 
         # Confidence Loss
-        i0 = tf.constant(0)
-
-        def body(i, max_iou):
-            object_mask = tf.reshape(one_obj_mask[i, ...], shape=(-1,))
-            truth_bbox = tf.boolean_mask(truth_xywh[i, ...], mask=object_mask)
-            # g_height * g_width * 3,      1, xywh
-            #               1, answer, xywh
-            #   => g_height * g_width * 3, answer
-            _max_iou0 = tf.cond(
-                tf.equal(num_obj[i], 0),
-                lambda: zero,
-                lambda: tf.reshape(
-                    tf.reduce_max(
-                        bbox_iou(
-                            pred_xywh[i, :, tf.newaxis, :],
-                            truth_bbox[tf.newaxis, ...],
+        if self.max_boxes:
+            # the max_boxes most confident truths of each image: no dynamic
+            # shapes, for XLA
+            truth_obj, index = tf.math.top_k(
+                truth_conf[..., 0], k=min(self.max_boxes, g_height * g_width * 3)
+            )
+            truth_bbox = tf.gather(truth_xywh, index, batch_dims=1)
+            # batch, g_height * g_width * 3, max_boxes
+            iou = bbox_iou(pred_xywh[:, :, tf.newaxis, :], truth_bbox[:, tf.newaxis, ...])
+            iou = tf.where(truth_obj[:, tf.newaxis, :] > 0.5, iou, 0.0)
+            max_iou = tf.reduce_max(iou, axis=-1, keepdims=True)
+        else:
+            i0 = tf.constant(0)
+
+            def body(i, max_iou):
+                object_mask = tf.reshape(one_obj_mask[i, ...], shape=(-1,))
+                truth_bbox = tf.boolean_mask(truth_xywh[i, ...], mask=object_mask)
+                # g_height * g_width * 3,      1, xywh
+                #               1, answer, xywh
+                #   => g_height * g_width * 3, answer
+                _max_iou0 = tf.cond(
+                    tf.equal(num_obj[i], 0),
+                    lambda: zero,
+                    lambda: tf.reshape(
+                        tf.reduce_max(
+                            bbox_iou(
+                                pred_xywh[i, :, tf.newaxis, :],
+                                truth_bbox[tf.newaxis, ...],
+                            ),
+                            axis=-1,
                         ),
-                        axis=-1,
+                        shape=(1, -1, 1),
                     ),
-                    shape=(1, -1, 1),
-                ),
-            )
-            # 1, g_height * g_width * 3, 1
-            _max_iou1 = tf.cond(
-                tf.equal(i, 0),
-                lambda: _max_iou0,
-                lambda: tf.concat([max_iou, _max_iou0], axis=0),
+                )
+                # 1, g_height * g_width * 3, 1
+                _max_iou1 = tf.cond(
+                    tf.equal(i, 0),
+                    lambda: _max_iou0,
+                    lambda: tf.concat([max_iou, _max_iou0], axis=0),
+                )
+                return tf.add(i, 1), _max_iou1
+
+            _, max_iou = tf.while_loop(
+                self.while_cond,
+                body,
+                [i0, zero],
+                shape_invariants=[
+                    i0.get_shape(),
+                    tf.TensorShape([None, g_height * g_width * 3, 1]),
+                ],
             )
-            return tf.add(i, 1), _max_iou1
-
-        _, max_iou = tf.while_loop(
-            self.while_cond,
-            body,
-            [i0, zero],
-            shape_invariants=[
-                i0.get_shape(),
-                tf.TensorShape([None, g_height * g_width * 3, 1]),
-            ],
-        )
 
         conf_obj_loss = one_obj * (0.0 - backend.log(pred_conf + backend.epsilon()))  # changed eps from 1e-9
         conf_noobj_loss = (